@@ -0,0 +1,426 @@
+"""
+基于 asyncio 的数据接收服务器
+
+与 main.py 中的 JSONHandler 提供完全相同的接口（GET / 、GET /health、POST 写入），
+但所有连接在同一个事件循环中并发处理，ES 写入通过异步客户端完成，
+单个缓慢的 Elasticsearch 请求不会阻塞其他客户端。
+
+用法:
+    python async_server.py [--host 0.0.0.0] [--port 5000]
+"""
+import argparse
+import asyncio
+import json
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+import main as ingest
+from utils.http_utils import ContentDecoder, parse_chunk_size, BodyTooLarge, IncompleteBody, MAX_CHUNK_LINE
+from utils.log_utils import logger
+from utils.metrics_utils import stage_duration, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from config import (
+    SERVER_HOST,
+    SERVER_PORT,
+    INDEX_NAME_LINECHANGES,
+    ASYNC_KEEPALIVE_TIMEOUT,
+    ASYNC_MAX_CONNECTIONS,
+    ASYNC_MAX_HEADERS,
+    HTTP_LISTEN_BACKLOG,
+    ASYNC_ES_CONNECTIONS,
+    ASYNC_STORE_THREADS,
+    REQUEST_READ_CHUNK_BYTES,
+    REQUEST_DISCARD_MAX_BYTES,
+    REQUEST_DISCARD_TIMEOUT_SECONDS,
+    ES_WRITE_MODE,
+    ES_PARTITION_VIEW_TTL_SECONDS,
+    STORAGE_BACKEND
+)
+
+
+class RequestBody:
+    """
+    一个请求的请求体，在处理请求时才从连接中逐块读取并解压
+    consumed 为 False 时请求体没有被完整读取，响应后关闭连接，剩余数据不会被当作下一个请求
+    """
+
+    def __init__(self, reader, writer, headers, path):
+        self.reader = reader
+        self.writer = writer
+        self.headers = headers
+        self.max_bytes = ingest.body_limit(path)
+        self.content_length, self.error = ingest.check_request_body(headers, path)
+        self.consumed = self.error is None and self.content_length == 0
+
+    async def pieces(self):
+        """逐块产出解压后的请求体，失败时抛出 ValueError / TimeoutError，由 ingest.body_error 转换为响应"""
+        decoder = ContentDecoder(self.headers.get('content-encoding'), self.max_bytes, REQUEST_READ_CHUNK_BYTES)
+        if self.headers.get('expect', '').lower() == '100-continue':
+            self.writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+            await self.writer.drain()
+        async for chunk in self.raw_body():
+            for piece in decoder.decode(chunk):
+                yield piece
+        self.consumed = True
+        decoder.finish()
+
+    async def read(self):
+        """读取完整的请求体，返回 (body, None)，或在失败时返回 (None, (状态码, 响应内容))"""
+        try:
+            return b"".join([piece async for piece in self.pieces()]), None
+        except (ValueError, TimeoutError) as e:
+            return None, ingest.body_error(e)
+
+    async def raw_body(self):
+        if self.content_length is not None:
+            async for chunk in self.read_exactly(self.content_length):
+                yield chunk
+            return
+        received = 0
+        while True:
+            size = parse_chunk_size(await self.read_line())
+            if size == 0:
+                break
+            received += size
+            if received > self.max_bytes:
+                raise BodyTooLarge(f"Request body exceeds {self.max_bytes} bytes")
+            async for chunk in self.read_exactly(size):
+                yield chunk
+            if await self.read_line() not in (b"\r\n", b"\n"):
+                raise ValueError("Invalid chunk terminator")
+        # 忽略 trailer
+        while await self.read_line() not in (b"\r\n", b"\n"):
+            pass
+
+    async def read_exactly(self, size):
+        while size:
+            chunk = await asyncio.wait_for(self.reader.read(min(size, REQUEST_READ_CHUNK_BYTES)), timeout=ASYNC_KEEPALIVE_TIMEOUT)
+            if not chunk:
+                raise IncompleteBody("Incomplete request body")
+            size -= len(chunk)
+            yield chunk
+
+    async def read_line(self):
+        line = await asyncio.wait_for(self.reader.readline(), timeout=ASYNC_KEEPALIVE_TIMEOUT)
+        if not line:
+            raise IncompleteBody("Incomplete request body")
+        if len(line) > MAX_CHUNK_LINE:
+            raise ValueError("Chunk header too long")
+        return line
+
+    async def discard(self):
+        """
+        响应发送后关闭写方向，再读掉最多 REQUEST_DISCARD_MAX_BYTES 字节未读的请求体
+        接收缓冲区中还有数据时直接关闭连接，内核会发送 RST，客户端可能在读到响应前收到 ECONNRESET / EPIPE
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + REQUEST_DISCARD_TIMEOUT_SECONDS
+        discarded = 0
+        try:
+            if self.writer.can_write_eof():
+                self.writer.write_eof()
+            while discarded < REQUEST_DISCARD_MAX_BYTES:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                chunk = await asyncio.wait_for(self.reader.read(min(REQUEST_READ_CHUNK_BYTES, REQUEST_DISCARD_MAX_BYTES - discarded)), timeout=remaining)
+                if not chunk:
+                    break
+                discarded += len(chunk)
+        except (asyncio.TimeoutError, ConnectionError, OSError):
+            pass
+
+
+class AsyncIngestServer:
+
+    def __init__(self, host=SERVER_HOST, port=SERVER_PORT):
+        self.host = host
+        self.port = port
+        self.es_manager = None
+        self.connection_slots = asyncio.Semaphore(ASYNC_MAX_CONNECTIONS)
+        # 归档、持久化队列与 fsync 等磁盘操作在线程池中执行，不阻塞事件循环
+        self.store_executor = ThreadPoolExecutor(max_workers=ASYNC_STORE_THREADS, thread_name_prefix="store")
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port, backlog=HTTP_LISTEN_BACKLOG)
+        ingest.mark_startup("listener_ms")
+        logger.info(f"Async server listening on http://{self.host}:{self.port}")
+
+    async def close(self):
+        self.store_executor.shutdown(wait=True)
+        if self.es_manager:
+            await self.es_manager.manager.close()
+
+    async def run_blocking(self, fn, *args):
+        """在存储线程池中执行会读写磁盘的同步函数"""
+        return await asyncio.get_running_loop().run_in_executor(self.store_executor, fn, *args)
+
+    def get_es_manager(self):
+        """
+        启用持久化队列或批量写入时由后台线程负责 ES 写入，返回 None；
+        否则在 ES 初始化完成后创建异步客户端，与同步客户端共用熔断器
+        SQLite 存储没有异步客户端，返回 None，由 ingest.store_record 同步写入
+        """
+        if STORAGE_BACKEND != "elasticsearch":
+            return None
+        if self.es_manager is None and ingest.es_manager and not (ingest.spool or ingest.bulk_writer):
+            from utils.es_utils import AsyncElasticsearchManager, GuardedElasticsearchManager
+            self.es_manager = GuardedElasticsearchManager(
+                AsyncElasticsearchManager(
+                    connections_per_node=ASYNC_ES_CONNECTIONS,
+                    write_mode=ES_WRITE_MODE,
+                    partitions=ingest.es_manager.partitions,
+                    view_ttl=ES_PARTITION_VIEW_TTL_SECONDS
+                ),
+                ingest.es_breaker
+            )
+        return self.es_manager
+
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def handle_connection(self, reader, writer):
+        peer = writer.get_extra_info('peername')
+        client_ip = peer[0] if peer else "unknown"
+        async with self.connection_slots:
+            try:
+                while True:
+                    request, error = await self.read_request(reader)
+                    if error:
+                        # 请求行或请求头无法解析，不知道请求体的边界，响应后关闭连接
+                        self.write_response(writer, *error, None, False)
+                        await writer.drain()
+                        break
+                    if request is None:
+                        break
+                    method, path, version, headers = request
+                    body = RequestBody(reader, writer, headers, path)
+
+                    status, payload, content_type = await self.dispatch(method, path, headers, body, client_ip)
+
+                    connection = headers.get('connection', '').lower()
+                    keep_alive = connection == 'keep-alive' if version == 'HTTP/1.0' else connection != 'close'
+                    keep_alive = keep_alive and body.consumed
+                    self.write_response(writer, status, payload, content_type, keep_alive)
+                    await writer.drain()
+                    if not keep_alive:
+                        if not body.consumed:
+                            await body.discard()
+                        break
+            except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError, ValueError):
+                pass
+            finally:
+                writer.close()
+
+    async def read_request(self, reader):
+        """
+        读取一个 HTTP 请求的请求行与请求头，返回 ((method, path, version, headers), None)，连接关闭时返回 (None, None)，
+        请求无法解析时返回 (None, (状态码, 响应内容))；请求体由 RequestBody 按需读取
+        """
+        request_line = await asyncio.wait_for(reader.readline(), timeout=ASYNC_KEEPALIVE_TIMEOUT)
+        if not request_line.strip():
+            return None, None
+        words = request_line.decode('latin-1').split()
+        if len(words) != 3 or not words[2].startswith('HTTP/'):
+            return None, (400, f"Bad request line: {request_line.strip()[:100]!r}".encode())
+        method, path, version = words
+
+        headers = {}
+        while True:
+            # 每个请求头都有超时，客户端不能一行行地慢慢发送来占住连接
+            line = await asyncio.wait_for(reader.readline(), timeout=ASYNC_KEEPALIVE_TIMEOUT)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            if len(headers) >= ASYNC_MAX_HEADERS:
+                return None, (431, b"Too many headers")
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return (method, path, version, headers), None
+
+    def write_response(self, writer, status, payload, content_type, keep_alive):
+        lines = [
+            f"HTTP/1.1 {status} {HTTPStatus(status).phrase}",
+            f"Content-Length: {len(payload)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        if content_type:
+            lines.append(f"Content-type: {content_type}")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1') + payload)
+
+    async def dispatch(self, method, path, headers, body, client_ip):
+        started = time.perf_counter()
+        status, payload, content_type = await self.route(method, path, headers, body, client_ip)
+        ingest.record_request(method, path, status, started)
+        return status, payload, content_type
+
+    async def route(self, method, path, headers, body, client_ip):
+        if method == 'GET':
+            path, _, query_string = path.partition('?')
+            if path == '/metrics':
+                return 200, ingest.render_metrics(), METRICS_CONTENT_TYPE
+            if path == '/' or path == '/health':
+                return 200, json.dumps(ingest.build_health_status()).encode(), 'application/json'
+            if path == '/stats':
+                # 聚合查询可能需要等待 ES，放到线程池中执行，不阻塞事件循环
+                status, payload = await asyncio.get_running_loop().run_in_executor(None, ingest.handle_stats, query_string)
+                return status, payload, 'application/json'
+            logger.warning(f"404 Not Found request from {client_ip} for path: {path}")
+            return 404, b"Not Found", None
+        if method == 'POST':
+            error = body.error
+            if not error:
+                # NDJSON 批量请求边接收边处理
+                if path == '/batch' and 'ndjson' in headers.get('content-type', ''):
+                    return await self.handle_ndjson_batch(body, client_ip)
+                with stage_duration.time("read"):
+                    body, error = await body.read()
+            if error:
+                return self.reject_body(error, client_ip)
+            if path == '/batch':
+                return await self.handle_batch(body, client_ip)
+            return await self.handle_post(body, client_ip)
+        return 501, b"Unsupported method", None
+
+    def reject_body(self, error, client_ip):
+        status, message = error
+        logger.warning(f"Rejected request body from {client_ip}: {message.decode()}")
+        ingest.record_outcome(status)
+        return status, message, None
+
+    async def handle_post(self, body, client_ip):
+        logger.info(f"Received POST request from {client_ip}", extra={"log_type": "request"})
+        try:
+            data, error = ingest.parse_and_authenticate(body, client_ip)
+            if error:
+                status, message = error
+                ingest.record_outcome(status)
+                return status, message, None
+
+            filename = await self.store_record(data, client_ip)
+            ingest.record_outcome(200)
+            logger.info(f"Successfully processed request from {client_ip}: {ingest.stored_message(filename)}", extra={"log_type": "request"})
+            return 200, ingest.stored_message(filename).encode(), None
+        except Exception as e:
+            logger.error(f"Server error from {client_ip}: {e}")
+            ingest.record_outcome(500)
+            return 500, f"Server error: {e}".encode(), None
+
+    async def handle_batch(self, body, client_ip):
+        try:
+            with stage_duration.time("parse"):
+                records, error = ingest.parse_batch(body)
+            if error:
+                status, message = error
+                logger.warning(f"Rejected batch from {client_ip}: {message.decode()}")
+                ingest.record_outcome(status)
+                return status, message, None
+
+            logger.info(f"Received batch of {len(records)} records from {client_ip}", extra={"log_type": "request"})
+            results = []
+            with stage_duration.time("auth"):
+                authenticated = ingest.authenticate_batch(records, client_ip)
+            for data, error in authenticated:
+                if error:
+                    results.append(error)
+                    continue
+                try:
+                    filename = await self.store_record(data, client_ip)
+                    results.append((200, ingest.stored_message(filename)))
+                except Exception as e:
+                    logger.error(f"Failed to store batch record from {client_ip}: {e}")
+                    results.append((500, f"Server error: {e}"))
+            for status, _ in results:
+                ingest.record_outcome(status)
+
+            logger.info(f"Successfully processed batch of {len(records)} records from {client_ip}", extra={"log_type": "request"})
+            return 200, ingest.build_batch_response(results), 'application/json'
+        except Exception as e:
+            logger.error(f"Server error from {client_ip}: {e}")
+            ingest.record_outcome(500)
+            return 500, f"Server error: {e}".encode(), None
+
+    async def handle_ndjson_batch(self, body, client_ip):
+        batch = ingest.BatchStream(client_ip)
+        error = None
+        try:
+            async for piece in body.pieces():
+                for position, data in batch.feed(piece):
+                    await self.store_batch_record(batch, position, data, client_ip)
+            for position, data in batch.close():
+                await self.store_batch_record(batch, position, data, client_ip)
+        except (ValueError, TimeoutError) as e:
+            error = ingest.body_error(e)
+            if not batch.results:
+                return self.reject_body(error, client_ip)
+            logger.warning(f"Batch body from {client_ip} failed after {len(batch.results)} records: {error[1].decode()}")
+
+        logger.info(f"Successfully processed batch of {len(batch.results)} records from {client_ip}", extra={"log_type": "request"})
+        return 200, batch.response(error), 'application/json'
+
+    async def store_batch_record(self, batch, position, data, client_ip):
+        try:
+            batch.stored(position, await self.store_record(data, client_ip))
+        except Exception as e:
+            batch.failed(position, e)
+
+    async def store_record(self, data, client_ip):
+        # 持久化队列或批量写入模式下只入队、不等待 ES，与同步服务器共用同一实现；
+        # 其中的归档、队列写入与 fsync 都是磁盘操作，放到线程池中执行
+        if not (ingest.es_available and self.get_es_manager()):
+            return await self.run_blocking(ingest.store_record, data, client_ip)
+
+        if not ingest.claim_record(data):
+            logger.info(f"Duplicate record from {client_ip} ignored", extra={"log_type": "request"})
+            return None
+        try:
+            with stage_duration.time("file"):
+                filename = await self.run_blocking(ingest.save_to_file, data)
+        except Exception:
+            ingest.release_record(data)
+            raise
+        with stage_duration.time("es"):
+            try:
+                await self.es_manager.write_to_es(INDEX_NAME_LINECHANGES, ingest.prepare_es_document(data).to_dict())
+                ingest.stats_cache.invalidate()
+                logger.info(f"Data written to Elasticsearch index: {INDEX_NAME_LINECHANGES} from {client_ip}", extra={"log_type": "request"})
+            except Exception as e:
+                logger.error(f"Failed to write to Elasticsearch from {client_ip}: {e}")
+        ingest.add_to_rollups(data)
+        return filename
+
+
+async def run(host, port):
+    ingest.start_pipeline()
+    server = AsyncIngestServer(host, port)
+    await server.start()
+
+    # 先监听端口，再在后台初始化 Elasticsearch
+    ingest.start_background_bootstrap()
+    try:
+        await server.serve_forever()
+    finally:
+        await server.close()
+        ingest.stop_pipeline()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Line changes receiver (asyncio)")
+    parser.add_argument("--host", default=SERVER_HOST, help="监听地址")
+    parser.add_argument("--port", type=int, default=SERVER_PORT, help="监听端口")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    # docker stop 发送 SIGTERM，转为 KeyboardInterrupt 以便刷新队列和归档后再退出
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        asyncio.run(run(args.host, args.port))
+    except KeyboardInterrupt:
+        logger.info("Shutting down server.")
@@ -0,0 +1 @@
+"""接收服务器的基准测试工具"""
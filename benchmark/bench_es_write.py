@@ -0,0 +1,70 @@
+"""
+对比 ElasticsearchManager.write_to_es 各写入模式的每条记录往返次数与吞吐量
+
+每种模式写入一个临时索引：先写入 N 条新记录，再以相同 id 重写一遍（更新路径），
+可选地带上 update_condition 走保留字段逻辑。结束后删除临时索引。
+
+用法:
+    ELASTICSEARCH_URL=http://localhost:9200 python -m benchmark.bench_es_write --records 500
+"""
+import argparse
+import json
+import time
+
+from benchmark.load_client import make_record
+from utils.es_utils import ElasticsearchManager, WRITE_MODES
+
+
+def run_pass(manager, index_name, records, update_condition):
+    start_trips = manager.round_trips
+    start = time.perf_counter()
+    for record in records:
+        manager.write_to_es(index_name, dict(record), update_condition=update_condition)
+    elapsed = time.perf_counter() - start
+    trips = manager.round_trips - start_trips
+    return {
+        "records_per_s": round(len(records) / elapsed, 1) if elapsed else 0.0,
+        "round_trips_per_record": round(trips / len(records), 2),
+    }
+
+
+def bench_mode(mode, count, update_condition):
+    manager = ElasticsearchManager(write_mode=mode)
+    index_name = f"bench_linechanges_{mode}"
+    manager.delete_indexes(index_name)
+    records = []
+    for i in range(count):
+        record = make_record(i)
+        record["id"] = f"{mode}-{i}"
+        records.append(record)
+    try:
+        return {
+            "new": run_pass(manager, index_name, records, update_condition),
+            "existing": run_pass(manager, index_name, records, update_condition),
+        }
+    finally:
+        manager.delete_indexes(index_name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="write_to_es round-trip benchmark")
+    parser.add_argument("--records", type=int, default=500)
+    parser.add_argument("--mode", action="append", choices=WRITE_MODES, help="默认测试全部模式")
+    parser.add_argument("--preserve", action="store_true", help="带 update_condition（保留 version 字段）写入")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    update_condition = {"version": 1} if args.preserve else None
+    results = {mode: bench_mode(mode, args.records, update_condition) for mode in (args.mode or WRITE_MODES)}
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'mode':<20}{'pass':<10}{'records/s':>12}{'trips/record':>14}")
+    for mode, passes in results.items():
+        for name, result in passes.items():
+            print(f"{mode:<20}{name:<10}{result['records_per_s']:>12}{result['round_trips_per_record']:>14}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""
+端到端接收基准测试：N 个模拟扩展客户端 -> 接收服务器 -> 本地 ES 替身
+
+在临时目录中启动 main.py（或 async_server.py），让它连接进程内的 fake_es，
+等待启动完成后以 N 个并发客户端发送带有效 token 的 SingleFileRecord，报告：
+吞吐量、p50/p95/p99 延迟、服务器内存峰值、每个请求消耗的服务器 CPU 时间，
+以及所有已接受记录出现在 ES 中所需的时间。
+完全离线运行，结果可保存为 JSON 并与之前某次提交的结果对比。
+
+用法:
+    python -m benchmark.bench_ingest --clients 50 --requests 5000
+    python -m benchmark.bench_ingest --es-latency-ms 20 --es-error-rate 0.05 --output after.json --compare before.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from benchmark.bench_server import REPO_ROOT, SERVERS, spawn_server
+from benchmark.bench_startup import fetch_health
+from benchmark.fake_es import start_fake_es
+from benchmark.load_client import run_load, summarize
+from config import INDEX_NAME_LINECHANGES
+
+# 对比时报告的指标及其方向（True 表示越大越好）
+COMPARED_METRICS = {
+    "rps": True,
+    "p50_ms": False,
+    "p95_ms": False,
+    "p99_ms": False,
+    "peak_rss_mb": False,
+    "cpu_ms_per_request": False,
+    "es_drain_s": False,
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def process_tree_rss_kb(pid):
+    """pid 及其子进程（pre-fork 工作进程）的 RSS 之和，依赖 /proc，不可用时返回 None"""
+    try:
+        total = 0
+        pending = [pid]
+        while pending:
+            current = pending.pop()
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+                        break
+            try:
+                with open(f"/proc/{current}/task/{current}/children") as f:
+                    pending.extend(int(child) for child in f.read().split())
+            except OSError:
+                pass
+        return total
+    except OSError:
+        return None
+
+
+def process_tree_cpu_seconds(pid):
+    """pid 及其子进程已消耗的用户态与内核态 CPU 时间之和（秒），依赖 /proc，不可用时返回 None"""
+    try:
+        ticks = 0
+        pending = [pid]
+        while pending:
+            current = pending.pop()
+            with open(f"/proc/{current}/stat") as f:
+                # 进程名可能包含空格，从最后一个 ")" 之后开始解析；utime、stime 为第 14、15 个字段
+                fields = f.read().rpartition(")")[2].split()
+            ticks += int(fields[11]) + int(fields[12])
+            try:
+                with open(f"/proc/{current}/task/{current}/children") as f:
+                    pending.extend(int(child) for child in f.read().split())
+            except OSError:
+                pass
+        return ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError):
+        return None
+
+
+class MemorySampler(threading.Thread):
+    """定期采样服务器进程树的 RSS，记录峰值"""
+
+    def __init__(self, pid, interval=0.1):
+        super().__init__(name="memory-sampler", daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak_kb = None
+        self.stopping = threading.Event()
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            rss = process_tree_rss_kb(self.pid)
+            if rss is not None:
+                self.peak_kb = max(self.peak_kb or 0, rss)
+
+    def stop(self):
+        self.stopping.set()
+        self.join()
+
+
+def wait_until_ready(port, timeout):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        health = fetch_health(port)
+        if health and health.get("startup", {}).get("state") == "ready":
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def wait_for_drain(store, index_name, expected, timeout):
+    """等待 index_name（或其分区）中的文档数达到已接受的记录数，返回耗时（秒），超时返回 None；预聚合索引等其他索引不计入"""
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        if store.count(index_name) >= expected:
+            return round(time.perf_counter() - started, 3)
+        time.sleep(0.05)
+    return None
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(args):
+    es_server, es_url = start_fake_es(
+        latency=args.es_latency_ms / 1000, jitter=args.es_jitter_ms / 1000,
+        error_rate=args.es_error_rate, error_status=args.es_error_status,
+    )
+    port = free_port()
+    workdir = tempfile.mkdtemp(prefix="bench_ingest_")
+    extra_args = ["--workers", str(args.workers)] if args.workers > 1 else []
+    process = spawn_server(SERVERS[args.server], port, workdir, extra_args, env={"ELASTICSEARCH_URL": es_url})
+    sampler = MemorySampler(process.pid)
+    try:
+        if not wait_until_ready(port, args.startup_timeout):
+            raise RuntimeError(f"server did not become ready within {args.startup_timeout}s (logs in {workdir})")
+        idle_kb = process_tree_rss_kb(process.pid)
+        idle_cpu = process_tree_cpu_seconds(process.pid)
+        sampler.start()
+        latencies, statuses, elapsed = asyncio.run(run_load(f"http://127.0.0.1:{port}/", args.requests, args.clients))
+        result = summarize(latencies, statuses, elapsed)
+        result["es_drain_s"] = wait_for_drain(es_server.store, INDEX_NAME_LINECHANGES, statuses.get(200, 0), args.drain_timeout)
+        # 包括请求处理以及把已接受记录写入 ES 的后台线程
+        busy_cpu = process_tree_cpu_seconds(process.pid)
+        result["cpu_ms_per_request"] = (
+            round((busy_cpu - idle_cpu) * 1000 / args.requests, 3) if idle_cpu is not None and busy_cpu is not None else None
+        )
+    finally:
+        if sampler.is_alive():
+            sampler.stop()
+        process.terminate()
+        process.wait()
+        es_server.shutdown()
+
+    # /proc 不可用（如 macOS）时退回到已退出子进程的最大 RSS
+    peak_kb = sampler.peak_kb
+    if peak_kb is None:
+        maxrss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        peak_kb = maxrss // 1024 if sys.platform == "darwin" else maxrss
+    result["idle_rss_mb"] = round(idle_kb / 1024, 1) if idle_kb else None
+    result["peak_rss_mb"] = round(peak_kb / 1024, 1)
+    result["fake_es"] = es_server.store.stats()
+    return result
+
+
+def compare(current, previous):
+    """返回 {指标: {"before", "after", "change_pct", "better"}}"""
+    changes = {}
+    for metric, higher_is_better in COMPARED_METRICS.items():
+        before, after = previous["result"].get(metric), current["result"].get(metric)
+        if not before or after is None:
+            continue
+        change = (after - before) / before * 100
+        changes[metric] = {
+            "before": before,
+            "after": after,
+            "change_pct": round(change, 1),
+            "better": change > 0 if higher_is_better else change < 0,
+        }
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end ingest benchmark against a local Elasticsearch stand-in")
+    parser.add_argument("--server", choices=SERVERS, default="threaded")
+    parser.add_argument("--workers", type=int, default=1, help="传给服务器的 --workers")
+    parser.add_argument("--clients", type=int, default=50, help="并发模拟客户端数")
+    parser.add_argument("--requests", type=int, default=5000, help="总请求数")
+    parser.add_argument("--es-latency-ms", type=float, default=2.0)
+    parser.add_argument("--es-jitter-ms", type=float, default=1.0)
+    parser.add_argument("--es-error-rate", type=float, default=0.0)
+    parser.add_argument("--es-error-status", type=int, choices=(429, 503), default=503)
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    parser.add_argument("--drain-timeout", type=float, default=60, help="等待已接受记录全部写入 ES 的最长秒数")
+    parser.add_argument("--output", help="把结果写入 JSON 文件")
+    parser.add_argument("--compare", help="与之前保存的 JSON 结果对比")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare", "json")},
+        "result": run_benchmark(args),
+    }
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            report["comparison"] = compare(report, json.load(f))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    result = report["result"]
+    print(f"commit {report['commit']}  server={args.server} workers={args.workers} clients={args.clients}")
+    print(f"rps {result['rps']}  p50 {result['p50_ms']} ms  p95 {result['p95_ms']} ms  p99 {result['p99_ms']} ms  statuses {result['statuses']}")
+    print(f"memory idle {result['idle_rss_mb']} MB  peak {result['peak_rss_mb']} MB  cpu {result['cpu_ms_per_request']} ms/request  "
+          f"es drain {result['es_drain_s']} s  fake es {result['fake_es']}")
+    for metric, change in report.get("comparison", {}).items():
+        print(f"  {metric:<12}{change['before']:>10} -> {change['after']:<10}{change['change_pct']:+.1f}% {'better' if change['better'] else 'worse'}")
+
+
+if __name__ == "__main__":
+    main()
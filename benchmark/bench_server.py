@@ -0,0 +1,102 @@
+"""
+对比 main.py（HTTPServer）与 async_server.py 的吞吐量和 p99 延迟
+
+用法:
+    # 自动在临时目录中启动两个服务器并依次压测
+    python -m benchmark.bench_server --spawn
+
+    # 压测已经在运行的服务器
+    python -m benchmark.bench_server --url http://127.0.0.1:5000/ --url http://127.0.0.1:5001/
+
+可通过 ELASTICSEARCH_URL 环境变量让被启动的服务器连接真实的 ES。
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlparse
+
+from benchmark.load_client import run_load, summarize
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVERS = {
+    "threaded": "main.py",
+    "async": "async_server.py",
+}
+
+
+def wait_for_port(host, port, timeout=90):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def spawn_server(script, port, workdir, extra_args=(), env=None):
+    """在 workdir 中启动服务器，数据和日志写入该临时目录；env 中的变量会覆盖当前环境"""
+    return subprocess.Popen(
+        [sys.executable, os.path.join(REPO_ROOT, script), "--host", "127.0.0.1", "--port", str(port), *extra_args],
+        cwd=workdir,
+        env={**os.environ, **(env or {})},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def bench(url, requests, concurrency):
+    latencies, statuses, elapsed = asyncio.run(run_load(url, requests, concurrency))
+    return summarize(latencies, statuses, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Receiver throughput / latency benchmark")
+    parser.add_argument("--url", action="append", default=[], help="要压测的服务器地址，可重复指定")
+    parser.add_argument("--spawn", action="store_true", help="自动启动 threaded 与 async 两种服务器进行对比")
+    parser.add_argument("--base-port", type=int, default=5100)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    targets = [(url, url) for url in args.url]
+    processes = []
+    if args.spawn:
+        for offset, (name, script) in enumerate(SERVERS.items()):
+            port = args.base_port + offset
+            # 每个服务器使用独立的目录，不共享 spool/、datas/ 中的检查点和段文件
+            workdir = tempfile.mkdtemp(prefix=f"bench_server_{name}_")
+            processes.append(spawn_server(script, port, workdir))
+            targets.append((name, f"http://127.0.0.1:{port}/"))
+
+    results = {}
+    try:
+        for name, url in targets:
+            parsed = urlparse(url)
+            if not wait_for_port(parsed.hostname, parsed.port or 80):
+                print(f"{name}: server at {url} did not come up", file=sys.stderr)
+                continue
+            results[name] = bench(url, args.requests, args.concurrency)
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'server':<12}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  statuses")
+    for name, result in results.items():
+        print(f"{name:<12}{result['rps']:>10}{result['p50_ms']:>10}{result['p95_ms']:>10}{result['p99_ms']:>10}  {result['statuses']}")
+
+
+if __name__ == "__main__":
+    main()
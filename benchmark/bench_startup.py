@@ -0,0 +1,88 @@
+"""
+测量服务器冷启动耗时：从启动进程到 /health 可响应（listener），以及到 ES 初始化完成（ready）
+
+每轮在临时目录中启动一次服务器，轮询 /health 直到 startup.state 变为 ready，
+同时记录服务器自己上报的各阶段耗时（startup 字段）。
+
+用法:
+    python -m benchmark.bench_startup --runs 5
+    python -m benchmark.bench_startup --server async --json
+"""
+import argparse
+import json
+import statistics
+import sys
+import tempfile
+import time
+import urllib.request
+
+from benchmark.bench_server import SERVERS, spawn_server
+
+
+def fetch_health(port):
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as response:
+            return json.loads(response.read())
+    except (OSError, ValueError):
+        return None
+
+
+def measure(script, port, timeout):
+    workdir = tempfile.mkdtemp(prefix="bench_startup_")
+    started = time.perf_counter()
+    process = spawn_server(script, port, workdir)
+    result = {"listening_ms": None, "ready_ms": None, "startup": None}
+    try:
+        deadline = started + timeout
+        while time.perf_counter() < deadline:
+            health = fetch_health(port)
+            elapsed = round((time.perf_counter() - started) * 1000, 1)
+            if health is not None:
+                if result["listening_ms"] is None:
+                    result["listening_ms"] = elapsed
+                if health.get("startup", {}).get("state") == "ready":
+                    result["ready_ms"] = elapsed
+                    result["startup"] = health["startup"]
+                    break
+            time.sleep(0.01)
+    finally:
+        process.terminate()
+        process.wait()
+    return result
+
+
+def median(values):
+    values = [value for value in values if value is not None]
+    return round(statistics.median(values), 1) if values else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Receiver cold start benchmark")
+    parser.add_argument("--server", choices=SERVERS, default="threaded")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=5102)
+    parser.add_argument("--timeout", type=float, default=120, help="单轮等待 ready 的最长秒数")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    runs = [measure(SERVERS[args.server], args.port, args.timeout) for _ in range(args.runs)]
+    summary = {
+        "server": args.server,
+        "runs": runs,
+        "median_listening_ms": median(run["listening_ms"] for run in runs),
+        "median_ready_ms": median(run["ready_ms"] for run in runs),
+    }
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+    for i, run in enumerate(runs):
+        if run["ready_ms"] is None:
+            print(f"run {i}: did not become ready (listening after {run['listening_ms']} ms)", file=sys.stderr)
+            continue
+        print(f"run {i}: listening {run['listening_ms']} ms, ready {run['ready_ms']} ms, server phases {run['startup']}")
+    print(f"median: listening {summary['median_listening_ms']} ms, ready {summary['median_ready_ms']} ms")
+
+
+if __name__ == "__main__":
+    main()
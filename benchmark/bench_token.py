@@ -0,0 +1,111 @@
+"""
+token 验证的 JS 兼容性检查与微基准测试
+
+1. 用 benchmark/token_vectors.json（由 token_vectors.js 以扩展中的 computeMinuteToken 生成）
+   校验 compute_minute_token、MinuteTokenTable 与 parse_iso_epoch 的结果与 JavaScript 一致；
+2. 对比旧的验证方式（fromisoformat + 每次计算哈希）与预计算表的每次验证耗时。
+
+用法:
+    python -m benchmark.bench_token
+    python -m benchmark.bench_token --iterations 200000 --json
+
+重新生成语料:
+    node benchmark/token_vectors.js > benchmark/token_vectors.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+from utils.token_utils import MinuteTokenTable, compute_minute_token, parse_iso_epoch
+
+VECTORS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "token_vectors.json")
+WINDOW_MINUTES = 5
+
+
+def check_vectors(path=VECTORS_FILE):
+    """返回与 JavaScript 结果不一致的条目列表"""
+    with open(path, "r", encoding="utf-8") as f:
+        vectors = json.load(f)
+    mismatches = []
+    for vector in vectors:
+        timestamp, token, epoch_ms = vector["timestamp"], vector["token"], vector["epoch_ms"]
+        if compute_minute_token(timestamp) != token:
+            mismatches.append({"timestamp": timestamp, "check": "compute_minute_token"})
+            continue
+        if epoch_ms is None:
+            continue
+        # 以该时间为“当前时间”，预计算表必须接受语料中的 token
+        epoch = parse_iso_epoch(timestamp)
+        if abs(epoch * 1000 - epoch_ms) >= 1:
+            mismatches.append({"timestamp": timestamp, "check": "parse_iso_epoch"})
+            continue
+        table = MinuteTokenTable(WINDOW_MINUTES, clock=lambda: epoch)
+        if not (table.in_window(timestamp)[0] and table.validate(timestamp, token)):
+            mismatches.append({"timestamp": timestamp, "check": "MinuteTokenTable"})
+    return len(vectors), mismatches
+
+
+def legacy_validate(timestamp, provided_token):
+    """改动前 main.validate_token_against_current_time 的实现"""
+    provided_time = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+    time_diff = abs((datetime.now(timezone.utc) - provided_time).total_seconds() / 60)
+    if time_diff > WINDOW_MINUTES:
+        return False
+    return compute_minute_token(timestamp) == provided_token
+
+
+def table_validate(table):
+    def validate(timestamp, provided_token):
+        return table.in_window(timestamp)[0] and table.validate(timestamp, provided_token)
+    return validate
+
+
+def time_per_call(validate, timestamp, token, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        validate(timestamp, token)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Token validation compatibility check and micro-benchmark")
+    parser.add_argument("--iterations", type=int, default=100000)
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    total, mismatches = check_vectors()
+    timestamp = datetime.now(timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+    token = compute_minute_token(timestamp)
+    table = MinuteTokenTable(WINDOW_MINUTES)
+    cases = {
+        "valid": (timestamp, token),
+        "wrong_token": (timestamp, "deadbeef"),
+    }
+    results = {
+        name: {
+            "legacy_us": round(time_per_call(legacy_validate, *case, args.iterations), 3),
+            "table_us": round(time_per_call(table_validate(table), *case, args.iterations), 3),
+        }
+        for name, case in cases.items()
+    }
+    summary = {"vectors": total, "mismatches": mismatches, "per_call": results}
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print(f"JS compatibility: {total - len(mismatches)}/{total} vectors match")
+        for mismatch in mismatches:
+            print(f"  mismatch in {mismatch['check']}: {mismatch['timestamp']!r}")
+        print(f"{'case':<14}{'legacy us':>12}{'table us':>12}{'speedup':>10}")
+        for name, result in results.items():
+            speedup = result["legacy_us"] / result["table_us"] if result["table_us"] else 0.0
+            print(f"{name:<14}{result['legacy_us']:>12}{result['table_us']:>12}{speedup:>9.1f}x")
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
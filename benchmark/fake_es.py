@@ -0,0 +1,501 @@
+"""
+本地 Elasticsearch 替身：实现接收服务器用到的 REST 接口，文档保存在内存中
+
+支持 ping、索引存在检查/创建/删除、单文档 create/update/index/get、_bulk、_search 与 _count，
+_search 支持 terms/sum 聚合与 point in time + search_after 分页（查询条件只应用 term 与 range 子句），
+索引模板、别名和 _rollover（条件只判断 max_docs），以及 _delete_by_query 与 _tasks（任务立即完成），
+可配置每个请求的固定延迟与抖动，并按比例注入错误（503 或 429），用于离线基准测试。
+
+用法:
+    python -m benchmark.fake_es --port 9201 --latency-ms 5 --jitter-ms 2 --error-rate 0.01
+    ELASTICSEARCH_URL=http://127.0.0.1:9201 python main.py
+"""
+import argparse
+import fnmatch
+import itertools
+import json
+import random
+import zlib
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, unquote, parse_qs
+from utils.time_utils import to_epoch_millis
+
+ES_VERSION = "8.17.0"
+
+
+class FakeElasticsearch:
+    """In-memory document store plus the latency / error injection settings."""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, error_status=503):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.lock = threading.Lock()
+        self.indices = {}  # index name -> {doc id: source}
+        self.created = {}  # index name -> creation time (epoch ms)
+        self.aliases = {}  # alias -> [index name]
+        self.templates = {}  # template name -> index template body
+        self.pits = {}  # point in time id -> [(doc id, source)] snapshot
+        self.pit_ids = itertools.count(1)
+        self.tasks = {}  # task id -> response of the completed task
+        self.task_ids = itertools.count(1)
+        self.requests = 0
+        self.injected_errors = 0
+        self.bulk_items = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "injected_errors": self.injected_errors,
+                "bulk_items": self.bulk_items,
+                "documents": sum(len(docs) for docs in self.indices.values()),
+            }
+
+    def count(self, expression):
+        """索引（或别名指向的所有分区）中的文档数，不存在时为 0"""
+        with self.lock:
+            return sum(len(self.indices[index]) for index in self.resolve(expression, ignore_unavailable=True))
+
+    def delay(self):
+        duration = self.latency + (random.uniform(-self.jitter, self.jitter) if self.jitter else 0.0)
+        if duration > 0:
+            time.sleep(duration)
+
+    def should_fail(self):
+        with self.lock:
+            self.requests += 1
+            if self.error_rate and random.random() < self.error_rate:
+                self.injected_errors += 1
+                return True
+        return False
+
+    def index_docs(self, index):
+        if index not in self.indices:
+            # 与 ES 一样，写入不存在的索引时自动创建并应用匹配的模板
+            self.create_index(index)
+        return self.indices[index]
+
+    def create_index(self, index, body=None):
+        """调用方持有 self.lock"""
+        aliases = {}
+        for template in sorted(self.templates.values(), key=lambda t: t.get("priority", 0)):
+            if any(fnmatch.fnmatchcase(index, pattern) for pattern in template.get("index_patterns", [])):
+                aliases.update(template.get("template", {}).get("aliases", {}))
+        aliases.update((body or {}).get("aliases", {}))
+        self.indices[index] = {}
+        self.created[index] = int(time.time() * 1000)
+        for alias in aliases:
+            self.aliases.setdefault(alias, []).append(index)
+
+    def resolve(self, expression, ignore_unavailable=False):
+        """逗号分隔的索引名或别名 -> 去重后的索引列表；不存在时抛出 KeyError（ignore_unavailable 时跳过）"""
+        indices = []
+        for name in unquote(expression).split(","):
+            if name in self.indices:
+                found = [name]
+            elif name in self.aliases:
+                found = self.aliases[name]
+            elif ignore_unavailable:
+                continue
+            else:
+                raise KeyError(name)
+            indices.extend(index for index in found if index not in indices)
+        return indices
+
+    def write_index(self, name):
+        """写入别名只能指向一个索引"""
+        indices = self.aliases.get(name)
+        if indices is None:
+            return name
+        if len(indices) != 1:
+            raise ValueError(f"no write index is defined for alias [{name}]")
+        return indices[0]
+
+    def write(self, index, doc_id, action, body):
+        """Apply one create/index/update action. Returns (status, result or error type)."""
+        with self.lock:
+            try:
+                index = self.write_index(index)
+            except ValueError:
+                return 400, "illegal_argument_exception"
+            docs = self.index_docs(index)
+            exists = doc_id in docs
+            if action == "create":
+                if exists:
+                    return 409, "version_conflict_engine_exception"
+                docs[doc_id] = body
+                return 201, "created"
+            if action == "index":
+                docs[doc_id] = body
+                return (200, "updated") if exists else (201, "created")
+            # update: partial doc, doc_as_upsert or scripted upsert
+            if exists:
+                if "doc" in body:
+                    docs[doc_id].update(body["doc"])
+                elif "script" in body:
+                    params = body["script"].get("params", {})
+                    doc = dict(params.get("doc", {}))
+                    # bulk_increment 的计数字段累加，其余字段覆盖
+                    for field in params.get("fields", []):
+                        doc[field] = docs[doc_id].get(field, 0) + doc.get(field, 0)
+                    # PRESERVE_FIELDS_SCRIPT：已有文档满足全部条件时保留条件中的字段
+                    condition = params.get("condition") or {}
+                    if condition and all(field in docs[doc_id] and docs[doc_id][field] == value for field, value in condition.items()):
+                        for field in condition:
+                            doc.pop(field, None)
+                    docs[doc_id].update(doc)
+                return 200, "updated"
+            if body.get("doc_as_upsert") and "doc" in body:
+                docs[doc_id] = dict(body["doc"])
+                return 201, "created"
+            if "upsert" in body:
+                docs[doc_id] = dict(body["upsert"])
+                return 201, "created"
+            return 404, "document_missing_exception"
+
+
+def matches_terms(query, source):
+    """只判断 term 与日期 range 子句（顶层或 bool 的 must/filter 中），其余查询条件视为匹配"""
+    if not query:
+        return True
+    if "term" in query:
+        (field, value), = query["term"].items()
+        if isinstance(value, dict):
+            value = value.get("value")
+        return source.get(field) == value
+    if "range" in query:
+        (field, bounds), = query["range"].items()
+        value = to_epoch_millis(source.get(field))
+        if value is None:
+            return False
+        checks = {"gte": value.__ge__, "gt": value.__gt__, "lte": value.__le__, "lt": value.__lt__}
+        return all(check(to_epoch_millis(bounds[op])) for op, check in checks.items() if op in bounds)
+    if "bool" in query:
+        clauses = query["bool"].get("must", []) + query["bool"].get("filter", [])
+        return all(matches_terms(clause, source) for clause in clauses)
+    return True
+
+
+def aggregate(sources, aggs):
+    """terms 与 sum 聚合"""
+    result = {}
+    for name, spec in aggs.items():
+        if "sum" in spec:
+            result[name] = {"value": float(sum(source.get(spec["sum"]["field"], 0) for source in sources))}
+        elif "terms" in spec:
+            terms = spec["terms"]
+            groups = {}
+            for source in sources:
+                if source.get(terms["field"]) is not None:
+                    groups.setdefault(source[terms["field"]], []).append(source)
+            buckets = []
+            for key, members in groups.items():
+                bucket = {"key": key, "doc_count": len(members)}
+                bucket.update(aggregate(members, spec.get("aggs", {})))
+                buckets.append(bucket)
+            (order_by, direction), = terms.get("order", {"_count": "desc"}).items()
+            sort_key = (lambda b: b["doc_count"]) if order_by == "_count" else (lambda b: b[order_by]["value"])
+            buckets.sort(key=sort_key, reverse=direction == "desc")
+            result[name] = {"buckets": buckets[:terms.get("size", 10)]}
+    return result
+
+
+class FakeESHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "fake-elasticsearch"
+
+    @property
+    def store(self):
+        return self.server.store
+
+    def do_HEAD(self):
+        self.handle_method("HEAD")
+
+    def do_GET(self):
+        self.handle_method("GET")
+
+    def do_PUT(self):
+        self.handle_method("PUT")
+
+    def do_POST(self):
+        self.handle_method("POST")
+
+    def do_DELETE(self):
+        self.handle_method("DELETE")
+
+    def handle_method(self, method):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else b""
+        self.store.delay()
+        if self.store.should_fail():
+            status = self.store.error_status
+            error_type = "es_rejected_execution_exception" if status == 429 else "unavailable_shards_exception"
+            return self.reply(status, {"error": {"type": error_type, "reason": "injected by fake_es"}, "status": status})
+
+        url = urlparse(self.path)
+        parts = [unquote(part) for part in url.path.split("/") if part]
+        try:
+            status, payload = self.route(method, parts, body, url.query)
+        except (ValueError, KeyError) as e:
+            status, payload = 400, {"error": {"type": "parse_exception", "reason": str(e)}, "status": 400}
+        self.reply(status, payload, head=method == "HEAD")
+
+    def route(self, method, parts, body, query_string=""):
+        store = self.store
+        if not parts:
+            return 200, {"name": "fake-es", "cluster_name": "fake", "version": {"number": ES_VERSION}, "tagline": "You Know, for Search"}
+        if parts == ["_bulk"] or parts[-1:] == ["_bulk"]:
+            return 200, self.bulk(body, parts[0] if len(parts) == 2 else None)
+        if parts == ["_search"]:
+            return self.search_pit(json.loads(body or b"{}"))
+        if parts == ["_pit"] and method == "DELETE":
+            with store.lock:
+                found = store.pits.pop(json.loads(body or b"{}").get("id"), None) is not None
+            return 200, {"succeeded": found, "num_freed": int(found)}
+        ignore_unavailable = parse_qs(query_string).get("ignore_unavailable") == ["true"]
+        if parts[0] == "_tasks" and len(parts) == 2:
+            with store.lock:
+                response = store.tasks.get(parts[1])
+            if response is None:
+                return 404, {"error": {"type": "resource_not_found_exception", "reason": f"task [{parts[1]}] isn't running and hasn't stored its results"}, "status": 404}
+            return 200, {"completed": True, "task": {"id": parts[1], "status": response}, "response": response}
+        if parts[0] == "_index_template" and len(parts) == 2 and method == "PUT":
+            with store.lock:
+                store.templates[parts[1]] = json.loads(body)
+            return 200, {"acknowledged": True}
+        if parts[0] == "_alias" and len(parts) == 2:
+            return (200 if parts[1] in store.aliases else 404), ({} if method != "HEAD" else None)
+        if parts[1:2] == ["_rollover"]:
+            return self.rollover(parts[0], parts[2] if len(parts) > 2 else None, json.loads(body or b"{}"))
+        if parts[1:] == ["_pit"]:
+            with store.lock:
+                try:
+                    indices = store.resolve(parts[0], ignore_unavailable)
+                except KeyError as e:
+                    return 404, {"error": {"type": "index_not_found_exception", "index": str(e)}, "status": 404}
+                pit_id = f"pit-{next(store.pit_ids)}"
+                store.pits[pit_id] = [item for index in indices for item in sorted(store.indices[index].items())]
+            return 200, {"id": pit_id}
+
+        index = parts[0]
+        if len(parts) == 1:
+            if method == "HEAD":
+                return (200 if index in store.indices or index in store.aliases else 404), None
+            if method == "GET":
+                return self.get_indices(index)
+            if method == "PUT":
+                with store.lock:
+                    if index in store.indices:
+                        return 400, {"error": {"type": "resource_already_exists_exception", "index": index}, "status": 400}
+                    store.create_index(index, json.loads(body or b"{}"))
+                return 200, {"acknowledged": True, "index": index}
+            if method == "DELETE":
+                with store.lock:
+                    store.indices.pop(index, None)
+                    store.created.pop(index, None)
+                    for members in store.aliases.values():
+                        if index in members:
+                            members.remove(index)
+                return 200, {"acknowledged": True}
+
+        endpoint = parts[1]
+        if endpoint in ("_search", "_count"):
+            request = json.loads(body or b"{}")
+            with store.lock:
+                try:
+                    indices = store.resolve(index, ignore_unavailable)
+                except KeyError as e:
+                    return 404, {"error": {"type": "index_not_found_exception", "index": str(e)}, "status": 404}
+                docs = [(name, doc_id, source) for name in indices for doc_id, source in store.indices[name].items()
+                        if matches_terms(request.get("query"), source)]
+            if endpoint == "_count":
+                return 200, {"count": len(docs)}
+            size = request.get("size", 10)
+            hits = [{"_index": name, "_id": doc_id, "_source": source} for name, doc_id, source in docs[:size]]
+            response = {"hits": {"total": {"value": len(docs), "relation": "eq"}, "hits": hits}}
+            if request.get("aggs"):
+                response["aggregations"] = aggregate([source for _, _, source in docs], request["aggs"])
+            return 200, response
+
+        if endpoint == "_delete_by_query":
+            return self.delete_by_query(index, json.loads(body or b"{}"), parse_qs(query_string), ignore_unavailable)
+
+        doc_id = parts[2] if len(parts) > 2 else None
+        if endpoint == "_doc" and method == "GET":
+            with store.lock:
+                source = store.index_docs(store.write_index(index)).get(doc_id)
+            if source is None:
+                return 404, {"_index": index, "_id": doc_id, "found": False}
+            return 200, {"_index": index, "_id": doc_id, "found": True, "_source": source}
+
+        action = {"_create": "create", "_update": "update", "_doc": "index"}.get(endpoint)
+        if action is None:
+            return 404, {"error": {"type": "fake_es_unsupported", "reason": f"{method} /{'/'.join(parts)}"}, "status": 404}
+        status, result = store.write(index, doc_id, action, json.loads(body))
+        if status >= 400:
+            return status, {"error": {"type": result, "index": index, "id": doc_id}, "status": status}
+        return status, {"_index": index, "_id": doc_id, "result": result}
+
+    def delete_by_query(self, expression, request, params, ignore_unavailable):
+        """wait_for_completion=false 时返回任务 id，任务结果通过 GET /_tasks/<id> 查询"""
+        store = self.store
+        started = time.perf_counter()
+        with store.lock:
+            try:
+                indices = store.resolve(expression, ignore_unavailable)
+            except KeyError as e:
+                return 404, {"error": {"type": "index_not_found_exception", "index": str(e)}, "status": 404}
+            deleted = 0
+            for name in indices:
+                docs = store.indices[name]
+                for doc_id in [doc_id for doc_id, source in docs.items() if matches_terms(request.get("query"), source)]:
+                    del docs[doc_id]
+                    deleted += 1
+        response = {"took": int((time.perf_counter() - started) * 1000), "total": deleted, "deleted": deleted,
+                    "batches": 1, "version_conflicts": 0, "failures": []}
+        if params.get("wait_for_completion") == ["false"]:
+            with store.lock:
+                task_id = f"fake:{next(store.task_ids)}"
+                store.tasks[task_id] = response
+            return 200, {"task": task_id}
+        return 200, response
+
+    def get_indices(self, expression):
+        """GET /<index>：各索引的别名与创建时间"""
+        store = self.store
+        with store.lock:
+            try:
+                indices = store.resolve(expression)
+            except KeyError as e:
+                return 404, {"error": {"type": "index_not_found_exception", "index": str(e)}, "status": 404}
+            return 200, {
+                index: {
+                    "aliases": {alias: {} for alias, members in store.aliases.items() if index in members},
+                    "mappings": {},
+                    "settings": {"index": {"creation_date": str(store.created[index]), "provided_name": index}},
+                }
+                for index in indices
+            }
+
+    def rollover(self, alias, new_index, request):
+        """把只指向一个索引的别名移到新索引；条件只判断 max_docs，其余条件视为未满足"""
+        store = self.store
+        with store.lock:
+            members = store.aliases.get(alias)
+            if not members or len(members) != 1:
+                return 400, {"error": {"type": "illegal_argument_exception", "reason": f"rollover target [{alias}] does not point to a write index"}, "status": 400}
+            old_index = members[0]
+            conditions = request.get("conditions", {})
+            results = {}
+            for name, value in conditions.items():
+                met = name == "max_docs" and len(store.indices[old_index]) >= value
+                results[f"[{name}: {value}]"] = met
+            if conditions and not any(results.values()):
+                return 200, {"acknowledged": False, "rolled_over": False, "old_index": old_index, "new_index": new_index, "conditions": results}
+            if new_index in store.indices:
+                return 400, {"error": {"type": "resource_already_exists_exception", "index": new_index}, "status": 400}
+            store.create_index(new_index)
+            members.remove(old_index)
+            members.append(new_index)
+        return 200, {"acknowledged": True, "rolled_over": True, "old_index": old_index, "new_index": new_index, "conditions": results}
+
+    def search_pit(self, request):
+        """point in time 搜索：按快照中的位置排序（_shard_doc），search_after 为上一页最后的位置"""
+        pit_id = request.get("pit", {}).get("id")
+        with self.store.lock:
+            snapshot = self.store.pits.get(pit_id)
+        if snapshot is None:
+            return 404, {"error": {"type": "search_context_missing_exception", "reason": f"No search context found for id [{pit_id}]"}, "status": 404}
+        start = request["search_after"][0] + 1 if request.get("search_after") else 0
+        slice_spec = request.get("slice")
+        fields = request.get("_source")
+        hits = []
+        for position in range(start, len(snapshot)):
+            doc_id, source = snapshot[position]
+            if slice_spec and zlib.crc32(doc_id.encode()) % slice_spec["max"] != slice_spec["id"]:
+                continue
+            if not matches_terms(request.get("query"), source):
+                continue
+            if fields:
+                source = {key: value for key, value in source.items() if key in fields}
+            hits.append({"_id": doc_id, "_source": source, "sort": [position]})
+            if len(hits) >= request.get("size", 10):
+                break
+        return 200, {"pit_id": pit_id, "hits": {"hits": hits}}
+
+    def bulk(self, body, default_index):
+        lines = [line for line in body.split(b"\n") if line.strip()]
+        items = []
+        errors = False
+        i = 0
+        while i < len(lines):
+            action, meta = next(iter(json.loads(lines[i]).items()))
+            source = json.loads(lines[i + 1]) if action != "delete" else {}
+            i += 2 if action != "delete" else 1
+            index = meta.get("_index", default_index)
+            status, result = self.store.write(index, meta.get("_id"), action, source)
+            item = {"_index": index, "_id": meta.get("_id"), "status": status}
+            if status >= 400:
+                errors = True
+                item["error"] = {"type": result}
+            else:
+                item["result"] = result
+            items.append({action: item})
+        with self.store.lock:
+            self.store.bulk_items += len(items)
+        return {"took": 1, "errors": errors, "items": items}
+
+    def reply(self, status, payload, head=False):
+        data = b"" if payload is None else json.dumps(payload).encode()
+        self.send_response(status)
+        # elasticsearch-py 8 拒绝没有该响应头的服务器
+        self.send_header("X-Elastic-Product", "Elasticsearch")
+        self.send_header("Content-Type", "application/vnd.elasticsearch+json;compatible-with=8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        return
+
+
+def start_fake_es(host="127.0.0.1", port=0, **options):
+    """在后台线程中启动替身服务器，返回 (server, url)；server.store 为 FakeElasticsearch"""
+    server = ThreadingHTTPServer((host, port), FakeESHandler)
+    server.daemon_threads = True
+    server.store = FakeElasticsearch(**options)
+    threading.Thread(target=server.serve_forever, name="fake-es", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-memory Elasticsearch stand-in for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9201)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="每个请求的固定延迟")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="延迟的随机抖动范围（±）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="注入错误的请求比例 (0-1)")
+    parser.add_argument("--error-status", type=int, choices=(429, 503), default=503)
+    args = parser.parse_args()
+
+    server, url = start_fake_es(
+        args.host, args.port,
+        latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000,
+        error_rate=args.error_rate, error_status=args.error_status,
+    )
+    print(f"Fake Elasticsearch listening on {url}")
+    try:
+        while True:
+            time.sleep(10)
+            print(json.dumps(server.store.stats()))
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
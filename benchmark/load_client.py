@@ -0,0 +1,103 @@
+"""
+基准测试共用的负载生成客户端
+
+模拟 VS Code 扩展发送 SingleFileRecord：每条记录一个 POST，每次请求新建连接。
+"""
+import asyncio
+import json
+import random
+import time
+import uuid
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+
+from main import compute_minute_token
+
+MODELS = ["Claude Sonnet 4", "GPT-4.1", "GPT-4o", "Gemini 2.5 Pro"]
+LANGUAGES = ["python", "typescript", "javascript", "css", "go", "java"]
+
+
+def make_record(client_index=0):
+    """生成一条带有效 token 的 SingleFileRecord"""
+    timestamp = datetime.now(timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+    return {
+        "version": 1,
+        "timestamp": timestamp,
+        "token": compute_minute_token(timestamp),
+        "sessionId": str(uuid.uuid4()),
+        "responseId": str(uuid.uuid4()),
+        "agentId": "github.copilot.editsAgent",
+        "githubUsername": f"bench_user_{client_index}",
+        "gitUrl": f"git@github.com:bench/repo-{client_index % 7}.git",
+        "vscodeVersion": "1.104.0-insider",
+        "model": random.choice(MODELS),
+        "file": f"src/module_{random.randint(0, 999)}.py",
+        "language": random.choice(LANGUAGES),
+        "added": random.randint(0, 200),
+        "removed": random.randint(0, 50),
+    }
+
+
+async def post_once(host, port, path, body):
+    """发送一个 POST 请求，返回 (状态码, 延迟秒数)"""
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        head = (
+            f"POST {path} HTTP/1.1\r\n"
+            f"Host: {host}:{port}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n"
+        )
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    status = int(response.split(b' ', 2)[1]) if response else 0
+    return status, time.perf_counter() - start
+
+
+async def run_load(url, total_requests, concurrency):
+    """以固定并发度向 url 发送 total_requests 个请求，返回 (延迟列表, 状态码计数, 总耗时)"""
+    parsed = urlparse(url)
+    host, port, path = parsed.hostname, parsed.port or 80, parsed.path or '/'
+    latencies = []
+    statuses = {}
+    counter = iter(range(total_requests))
+
+    async def worker(worker_index):
+        for _ in counter:
+            body = json.dumps(make_record(worker_index)).encode('utf-8')
+            try:
+                status, latency = await post_once(host, port, path, body)
+            except OSError:
+                status, latency = 0, 0.0
+            statuses[status] = statuses.get(status, 0) + 1
+            if status:
+                latencies.append(latency)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    return latencies, statuses, time.perf_counter() - start
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies, statuses, elapsed):
+    ordered = sorted(latencies)
+    return {
+        "requests": sum(statuses.values()),
+        "statuses": {str(k): v for k, v in sorted(statuses.items())},
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(len(ordered) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 2),
+    }
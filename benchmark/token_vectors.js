@@ -0,0 +1,56 @@
+// 生成 token 兼容性语料：与 VS Code 扩展中的 computeMinuteToken 完全相同的实现
+// 用法: node benchmark/token_vectors.js > benchmark/token_vectors.json
+function computeMinuteToken(timestamp) {
+  try {
+    const minutePart = timestamp.slice(0, 16);
+    let hash = 0x811c9dc5;
+    for (let i = 0; i < minutePart.length; i++) {
+      hash ^= minutePart.charCodeAt(i);
+      hash = (hash >>> 0) * 0x01000193;
+    }
+    return (hash >>> 0).toString(16).padStart(8, '0');
+  } catch {
+    return '00000000';
+  }
+}
+
+// 固定种子的线性同余生成器，保证每次生成的语料相同
+let seed = 20250815;
+function random() {
+  seed = (seed * 1103515245 + 12345) % 2147483648;
+  return seed / 2147483648;
+}
+
+const timestamps = [];
+const start = Date.UTC(2020, 0, 1);
+const end = Date.UTC(2035, 0, 1);
+for (let i = 0; i < 400; i++) {
+  timestamps.push(new Date(start + Math.floor(random() * (end - start))).toISOString());
+}
+// 跨年、闰日、月末与一天中的边界分钟
+for (const ts of [
+  '2024-02-29T23:59:59.999Z', '2024-03-01T00:00:00.000Z', '2025-12-31T23:59:59.999Z',
+  '2026-01-01T00:00:00.000Z', '2000-02-29T12:00:00.000Z', '2100-02-28T12:00:00.000Z',
+  '1970-01-01T00:00:00.000Z', '2038-01-19T03:14:07.000Z',
+]) {
+  timestamps.push(ts);
+}
+// 带时区偏移、秒无小数与微秒精度
+for (const ts of [
+  '2025-08-15T09:46:38.820+08:00', '2025-08-15T01:46:38-05:30', '2025-08-15T01:46:38Z',
+  '2025-08-15T01:46:38.820123Z',
+]) {
+  timestamps.push(ts);
+}
+
+const vectors = timestamps.map((timestamp) => ({
+  timestamp,
+  token: computeMinuteToken(timestamp),
+  epoch_ms: Date.parse(timestamp),
+}));
+// 非 ISO 输入只比较 token
+for (const timestamp of ['', '2025', '2025-08-15T01:4', 'not a timestamp at all', '２０２５-08-15T01:46']) {
+  vectors.push({ timestamp, token: computeMinuteToken(timestamp), epoch_ms: null });
+}
+
+process.stdout.write('[\n' + vectors.map((v) => JSON.stringify(v)).join(',\n') + '\n]\n');
@@ -1,4 +1,5 @@
 import os
+import socket
 
 # 应用版本号
 APP_VERSION = "1.0.0"
@@ -6,17 +7,149 @@ APP_VERSION = "1.0.0"
 # 服务器配置
 SERVER_HOST = "0.0.0.0"
 SERVER_PORT = 5000
+SERVER_WORKERS = int(os.environ.get('WORKERS', 1))  # 工作进程数量，大于 1 时启用 pre-fork 模式
+HTTP_KEEPALIVE_ENABLED = True     # main.py 使用 HTTP/1.1 持久连接，一个连接可以发送多个请求
+HTTP_KEEPALIVE_TIMEOUT = 15       # 空闲连接保持时间（秒），也是读取请求的超时时间
+HTTP_LISTEN_BACKLOG = socket.SOMAXCONN  # 监听队列长度（两种服务器），不小于准入控制的处理数 + 排队数，避免突发连接被内核丢弃后等待 SYN 重传
+REQUEST_MAX_BODY_BYTES = 1 * 1024 * 1024     # POST / 请求体（解压后）的最大字节数，超过时返回 413
+REQUEST_MAX_BATCH_BYTES = 16 * 1024 * 1024   # POST /batch 请求体（解压后）的最大字节数；NDJSON 边接收边处理，不整体读入内存
+REQUEST_READ_CHUNK_BYTES = 64 * 1024         # 每次从连接读取、解压的字节数
+REQUEST_DISCARD_MAX_BYTES = 64 * 1024        # 拒绝请求后关闭连接前最多读掉的未读请求体字节数，避免连接被重置、客户端收不到响应
+REQUEST_DISCARD_TIMEOUT_SECONDS = 2          # 读掉未读请求体的最长时间
+
+# 准入控制 (main.py)：限制每个进程同时处理和排队的写入请求，过载时快速返回 429/503 与 Retry-After
+ADMISSION_ENABLED = True
+ADMISSION_MAX_IN_FLIGHT = 64          # 同时处理的 POST 请求数
+ADMISSION_MAX_QUEUED = 256            # 等待处理的 POST 请求数，队列满时返回 429
+ADMISSION_QUEUE_TIMEOUT_SECONDS = 2.0 # 排队超过该时间返回 503
+ADMISSION_MAX_RETRY_AFTER_SECONDS = 30  # Retry-After 的上限
+
+# asyncio 服务器配置 (async_server.py)
+ASYNC_KEEPALIVE_TIMEOUT = 15      # 空闲连接保持时间（秒）
+ASYNC_MAX_CONNECTIONS = 1024      # 同时处理的最大连接数
+ASYNC_MAX_HEADERS = 100           # 单个请求最多的请求头数量，与 http.client 相同
+ASYNC_ES_CONNECTIONS = 32         # 异步 ES 客户端连接池大小
+ASYNC_STORE_THREADS = 8           # 执行归档、持久化队列等磁盘写入的线程数，事件循环只处理网络 I/O
 
 # 数据存储配置
 SAVE_DIR = "datas"
+ARCHIVE_FORMAT = "segments"       # "segments": 追加写入 NDJSON 段文件；"files": 每个请求一个 JSON 文件（旧格式）
+ARCHIVE_SEGMENT_MAX_BYTES = 64 * 1024 * 1024  # 段文件达到该大小时轮转
+ARCHIVE_SEGMENT_MAX_AGE_SECONDS = 3600        # 段文件打开超过该时间时轮转
+ARCHIVE_FSYNC_EVERY = 100         # 每累计该数量的记录 fsync 一次
+ARCHIVE_FSYNC_INTERVAL_SECONDS = 1.0  # 距上次 fsync 超过该时间时 fsync
+ARCHIVE_COMPRESS = True           # 轮转后的段文件是否 gzip 压缩
+
+# 存储后端: "elasticsearch"，或 "sqlite"（嵌入式本地存储，无需 ES 集群）
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'elasticsearch')
+SQLITE_PATH = os.environ.get('SQLITE_PATH', 'sqlite/linechanges.db')
+SQLITE_INDEXED_FIELDS = ("timestamp", "githubUsername", "model", "language", "gitUrl")  # 建立索引的列
+SQLITE_BUSY_TIMEOUT_SECONDS = 30  # 多个工作进程同时写入时等待锁的最长时间
 
 # Elasticsearch 配置
 INDEX_NAME_LINECHANGES = "linechanges"
-MAPPING_FILE_LINECHANGES = "elasticsearch/mapping/linechanges_mapping.json"
+# 相对于项目目录解析，服务器可以在任意工作目录下启动
+MAPPING_FILE_LINECHANGES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "elasticsearch/mapping/linechanges_mapping.json")
+
+# 按时间分区的索引（仅 Elasticsearch）：None 为单个 linechanges 索引；"day" / "month" 时按天或按月创建分区，
+# 经写入别名 linechanges-write 写入当前分区，读取别名 linechanges 覆盖全部分区
+ES_PARTITION_INTERVAL = os.environ.get('ES_PARTITION_INTERVAL') or None
+ES_ROLLOVER_CONDITIONS = {"max_primary_shard_size": "30gb"}  # 同一天/月内提前滚动的条件
+ES_ROLLOVER_CHECK_INTERVAL_SECONDS = 60  # 检查是否需要滚动的间隔
+ES_PARTITION_VIEW_TTL_SECONDS = 60      # 分区列表的缓存时间
+
+# 持久化写入队列：记录先写入本地磁盘队列，再由后台线程按检查点回放到 ES
+# ES 故障期间数据持续落盘，恢复后自动按限速补写
+SPOOL_ENABLED = True
+SPOOL_DIR = "spool"
+SPOOL_SEGMENT_MAX_BYTES = 16 * 1024 * 1024
+SPOOL_FSYNC_EVERY = 100
+SPOOL_FSYNC_INTERVAL_SECONDS = 1.0
+SPOOL_REPLAY_BATCH_SIZE = 500           # 每次 _bulk 回放的最大文档数
+SPOOL_REPLAY_MAX_DOCS_PER_SECOND = 2000  # 回放限速
+SPOOL_RETRY_MAX_BACKOFF_SECONDS = 60    # ES 不可用时的最大重试间隔
+
+# Elasticsearch 熔断器：连续失败后快速失败，后台探测恢复
+ES_BREAKER_FAILURE_THRESHOLD = 5        # 连续失败多少次后打开熔断器
+ES_BREAKER_RESET_TIMEOUT_SECONDS = 30   # 无探测时打开状态持续多久后允许试探请求
+ES_PROBE_INTERVAL_SECONDS = 5           # 打开状态下后台健康探测的间隔
+
+# 写入模式: "create"（新文档 1 次请求）、"upsert"（始终 1 次请求）、"read_modify_write"（旧的 get + update/index）
+ES_WRITE_MODE = "create"
+
+# Elasticsearch 后台批量写入配置
+ES_BULK_ENABLED = True            # 关闭后恢复为请求内逐条写入（仅在 SPOOL_ENABLED = False 时生效）
+ES_BULK_MAX_DOCS = 500            # 累计文档数达到该值时刷新
+ES_BULK_MAX_BYTES = 5 * 1024 * 1024  # 累计大小达到该值时刷新
+ES_BULK_MAX_AGE_SECONDS = 1.0     # 最早入队的文档等待超过该时间时刷新
+ES_BULK_QUEUE_SIZE = 10000        # 内存队列容量，队列满时在请求内直接写入 ES
+ES_BULK_MAX_RETRIES = 3           # 暂时失败（ES 过载、请求失败）的文档随后续批次重试的次数
+
+# 重复记录过滤：按 sessionId + responseId + file + timestamp 识别扩展重试或重复发送的记录，
+# 在写文件和 ES 之前丢弃；未提供 id 的记录也使用由这些字段生成的确定性 id
+DEDUP_ENABLED = True
+DEDUP_WINDOW_SIZE = 100000  # 每个进程记住的最近记录数
+
+# 预聚合（rollup）配置：按时间桶和 githubUsername/model/language/gitUrl 累加行数，定期写入独立索引
+ROLLUP_ENABLED = True
+INDEX_NAME_ROLLUP = "linechanges_rollup"
+MAPPING_FILE_ROLLUP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "elasticsearch/mapping/linechanges_rollup_mapping.json")
+ROLLUP_INTERVALS = ("hour",)       # 聚合粒度，可选 "minute"、"hour"、"day"
+ROLLUP_FLUSH_INTERVAL_SECONDS = 10  # 刷新间隔
+ROLLUP_MAX_PENDING_ROWS = 100000    # 内存中待刷新的行数达到该值时提前刷新
+
+# 统计查询 API (GET /stats)：优先从 rollup 索引聚合，未启用 rollup 时聚合原始索引
+STATS_CACHE_TTL_SECONDS = 30      # 结果缓存时间；本进程写入新数据后立即失效
+STATS_CACHE_MAX_ENTRIES = 1024    # 缓存条目上限，超出时淘汰最久未使用的条目
+STATS_DEFAULT_RANGE = "now-30d"   # 未指定 from 时的起始时间
+STATS_MAX_GROUPS = 1000           # 分组结果的最大条数
 
 # Token 验证配置
 TOKEN_TIME_WINDOW_MINUTES = 5  # 允许的时间窗口（分钟）
 
+# 批量写入配置 (POST /batch)
+BATCH_MAX_RECORDS = 1000  # 单个批量请求允许的最大记录数
+
+# 记录类型：接收时按 linechanges 映射校验一次字段类型，转换为每个字段一个 slot 的 LineChangeRecord
+RECORD_INTERNED_FIELDS = ("agentId", "vscodeVersion", "model", "language", "githubUsername", "gitUrl")  # 取值大量重复的字段，相同的字符串只保存一份
+RECORD_MAX_EXTRA_FIELDS = 32  # 映射之外的字段数上限，超过时返回 400
+
+# 日志配置
+LOG_QUEUE_ENABLED = True  # 日志先写入内存队列，由后台线程格式化并写文件，不阻塞请求处理
+LOG_QUEUE_SIZE = 10000  # 日志队列容量，队列满时丢弃新日志而不是阻塞
+LOG_COMPRESS_ROTATED = True  # 每日切换日志文件后 gzip 压缩前一天的日志
+# 按消息类型（extra={"log_type": ...}）的采样率与每秒条数上限；ERROR 及以上级别不受限制
+LOG_SAMPLE_RATES = {
+    "request": 1.0,  # 每个请求的 INFO 日志
+}
+LOG_RATE_LIMITS = {
+    "request": 200,
+    "auth": 50,  # token 验证失败等 WARNING 日志
+}
+
+# 数据保留：后台定期删除过期数据，压缩和清理本地归档与日志（pre-fork 模式下只在 0 号工作进程中运行）
+# 也可以关闭后由 cron 执行 python -m utils.retention_utils
+RETENTION_ENABLED = True
+RETENTION_INTERVAL_SECONDS = 3600
+# 索引 -> 按 field 判断过期的保留天数；max_age_days 为 None 时保留全部数据
+# 分区索引整块删除过期分区，其余数据通过后台 delete_by_query 任务分片、限速删除
+RETENTION_INDEX_POLICIES = {
+    INDEX_NAME_LINECHANGES: {"field": "timestamp", "max_age_days": None},
+    INDEX_NAME_ROLLUP: {"field": "timestamp", "max_age_days": None},
+}
+RETENTION_DELETE_OPTIONS = {
+    "requests_per_second": 1000,  # delete_by_query 每秒删除的文档数上限
+    "poll_interval": 10,          # 查询任务进度的间隔（秒）
+    "timeout": 3600,              # 超过该时间不再等待，任务在 ES 中继续执行
+}
+# 目录 -> 策略：kind 为 "archive"（SAVE_DIR）或 "logs"；compress_after_days 天后合并旧的 JSON 文件、压缩段文件或日志，
+# 超过 max_age_days 天未修改的文件被删除；None 表示不处理（默认不删除任何文件，需要时显式设置天数）。
+# SPOOL_DIR 由回放线程管理，不在此列
+RETENTION_DIRECTORY_POLICIES = {
+    SAVE_DIR: {"kind": "archive", "compress_after_days": 1 if ARCHIVE_COMPRESS else None, "max_age_days": None},
+    "logs": {"kind": "logs", "compress_after_days": 1, "max_age_days": None},
+}
+
 # debug mode controlled by environment variable
 def is_debug_enabled():
     """Check if debug mode is enabled via DEBUG environment variable"""
@@ -1,58 +1,165 @@
-from http.server import BaseHTTPRequestHandler, HTTPServer
+import time
+
+# 启动耗时从模块导入开始计算
+PROCESS_STARTED = time.perf_counter()
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
 import json
 import os
+import signal
+import socket
+import threading
 from datetime import datetime, timezone
-from utils.es_utils import ElasticsearchManager
-from utils.log_utils import logger
+from urllib.parse import parse_qs
+from utils.breaker_utils import CircuitBreaker, OPEN
+from utils.es_bulk_utils import BulkWriter
+from utils.archive_utils import SegmentArchive
+from utils.spool_utils import DurableSpool, SpoolReplayer
+from utils.rollup_utils import RollupAggregator, COUNTERS as ROLLUP_COUNTERS, DIMENSIONS as ROLLUP_DIMENSIONS, INTERVAL_SECONDS
+from utils.cache_utils import TTLCache
+from utils.dedup_utils import DuplicateFilter, content_digest, content_id
+from utils.json_utils import loads_document, encode
+from utils.record_utils import InvalidRecord, record_type
+from utils.time_utils import to_epoch_millis
+from utils.http_utils import ContentDecoder, LineSplitter, parse_chunk_size, parse_content_encoding, BodyTooLarge, IncompleteBody, UnsupportedEncoding, MAX_CHUNK_LINE
+from utils.admission_utils import AdmissionController, Rejected
+from utils.retention_utils import RetentionJob
+from utils.log_utils import logger, configure_worker_logger, log_queue_stats, LazyJSON
+from utils.metrics_utils import registry, requests_total, request_duration, stage_duration, records_total, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from utils.prefork_utils import PreforkSupervisor, reuse_port_supported
+from utils.token_utils import MinuteTokenTable, compute_minute_token
 from config import (
     SERVER_HOST, 
     SERVER_PORT, 
+    SERVER_WORKERS,
+    HTTP_KEEPALIVE_ENABLED,
+    HTTP_KEEPALIVE_TIMEOUT,
+    HTTP_LISTEN_BACKLOG,
+    REQUEST_MAX_BODY_BYTES,
+    REQUEST_MAX_BATCH_BYTES,
+    REQUEST_READ_CHUNK_BYTES,
+    REQUEST_DISCARD_MAX_BYTES,
+    REQUEST_DISCARD_TIMEOUT_SECONDS,
+    ADMISSION_ENABLED,
+    ADMISSION_MAX_IN_FLIGHT,
+    ADMISSION_MAX_QUEUED,
+    ADMISSION_QUEUE_TIMEOUT_SECONDS,
+    ADMISSION_MAX_RETRY_AFTER_SECONDS,
     SAVE_DIR, 
     INDEX_NAME_LINECHANGES, 
     MAPPING_FILE_LINECHANGES,
-    TOKEN_TIME_WINDOW_MINUTES
+    TOKEN_TIME_WINDOW_MINUTES,
+    BATCH_MAX_RECORDS,
+    RECORD_INTERNED_FIELDS,
+    RECORD_MAX_EXTRA_FIELDS,
+    ES_BULK_ENABLED,
+    ES_BULK_MAX_DOCS,
+    ES_BULK_MAX_BYTES,
+    ES_BULK_MAX_AGE_SECONDS,
+    ES_BULK_QUEUE_SIZE,
+    ES_BULK_MAX_RETRIES,
+    ES_WRITE_MODE,
+    ES_PARTITION_INTERVAL,
+    ES_ROLLOVER_CONDITIONS,
+    ES_ROLLOVER_CHECK_INTERVAL_SECONDS,
+    ES_PARTITION_VIEW_TTL_SECONDS,
+    STORAGE_BACKEND,
+    SQLITE_PATH,
+    SQLITE_INDEXED_FIELDS,
+    SQLITE_BUSY_TIMEOUT_SECONDS,
+    ARCHIVE_FORMAT,
+    ARCHIVE_SEGMENT_MAX_BYTES,
+    ARCHIVE_SEGMENT_MAX_AGE_SECONDS,
+    ARCHIVE_FSYNC_EVERY,
+    ARCHIVE_FSYNC_INTERVAL_SECONDS,
+    ARCHIVE_COMPRESS,
+    SPOOL_ENABLED,
+    SPOOL_DIR,
+    SPOOL_SEGMENT_MAX_BYTES,
+    SPOOL_FSYNC_EVERY,
+    SPOOL_FSYNC_INTERVAL_SECONDS,
+    SPOOL_REPLAY_BATCH_SIZE,
+    SPOOL_REPLAY_MAX_DOCS_PER_SECOND,
+    SPOOL_RETRY_MAX_BACKOFF_SECONDS,
+    ES_BREAKER_FAILURE_THRESHOLD,
+    ES_BREAKER_RESET_TIMEOUT_SECONDS,
+    ES_PROBE_INTERVAL_SECONDS,
+    ROLLUP_ENABLED,
+    INDEX_NAME_ROLLUP,
+    MAPPING_FILE_ROLLUP,
+    ROLLUP_INTERVALS,
+    ROLLUP_FLUSH_INTERVAL_SECONDS,
+    ROLLUP_MAX_PENDING_ROWS,
+    STATS_CACHE_TTL_SECONDS,
+    STATS_CACHE_MAX_ENTRIES,
+    STATS_DEFAULT_RANGE,
+    STATS_MAX_GROUPS,
+    DEDUP_ENABLED,
+    DEDUP_WINDOW_SIZE,
+    RETENTION_ENABLED,
+    RETENTION_INTERVAL_SECONDS,
+    RETENTION_INDEX_POLICIES,
+    RETENTION_DIRECTORY_POLICIES,
+    RETENTION_DELETE_OPTIONS
 )
 
 # 确保保存目录存在
 os.makedirs(SAVE_DIR, exist_ok=True)
 
 # 初始化 Elasticsearch 管理器
+# elasticsearch 客户端在后台启动线程中延迟导入，监听端口不必等待
 es_manager = None
 es_available = False
+es_breaker = None
 
-def compute_minute_token(timestamp: str) -> str:
-    """
-    根据timestamp计算token，严格按照提供的TypeScript算法实现
-    function computeMinuteToken(timestamp: string): string {
-      try {
-        const minutePart = timestamp.slice(0, 16);
-        let hash = 0x811c9dc5;
-        for (let i = 0; i < minutePart.length; i++) {
-          hash ^= minutePart.charCodeAt(i);
-          hash = (hash >>> 0) * 0x01000193;
-        }
-        return (hash >>> 0).toString(16).padStart(8, '0');
-      } catch {
-        return '00000000';
-      }
-    }
-    """
-    try:
-        # Extract the first 16 chars of ISO string: 'YYYY-MM-DDTHH:MM'
-        minute_part = timestamp[:16]
-        
-        # FNV-1a 32-bit hash with JavaScript-like floating point behavior
-        hash_val = 0x811c9dc5
-        for char in minute_part:
-            hash_val = hash_val ^ ord(char)
-            # 模拟JavaScript的浮点乘法然后截断
-            # JavaScript中所有数字运算都是浮点数，可能导致精度差异
-            hash_val = int((float(hash_val) * 0x01000193)) & 0xFFFFFFFF
-        
-        # JavaScript: (hash >>> 0).toString(16).padStart(8, '0')
-        return format(hash_val, '08x')
-    except Exception:
-        return '00000000'
+# 启动状态与各阶段耗时（毫秒），通过 /health 暴露
+startup = {
+    "state": "warming",
+    "listener_ms": None,
+    "elasticsearch_import_ms": None,
+    "elasticsearch_ready_ms": None
+}
+
+# 后台批量写入器（启用 ES_BULK_ENABLED 且 ES 可用时创建）
+bulk_writer = None
+
+# NDJSON 段文件归档（ARCHIVE_FORMAT 为 "segments" 时创建）
+archive = None
+
+# 持久化写入队列及其回放线程（SPOOL_ENABLED 时创建，取代内存中的批量写入队列）
+spool = None
+spool_replayer = None
+
+# 按时间桶预聚合的行数统计（ROLLUP_ENABLED 时创建），定期累加写入 rollup 索引
+rollups = None
+
+# GET /stats 的结果缓存，本进程写入新数据后失效
+stats_cache = TTLCache(STATS_CACHE_MAX_ENTRIES, STATS_CACHE_TTL_SECONDS)
+
+# 最近接收的记录，用于丢弃重试或重复发送的记录
+recent_records = DuplicateFilter(DEDUP_WINDOW_SIZE) if DEDUP_ENABLED else None
+
+# JSONHandler 写入请求的准入控制（ADMISSION_ENABLED 时由 main.py 的服务器入口创建）
+admission = None
+
+# 过期数据与本地文件的定期清理（RETENTION_ENABLED 时只在一个进程中创建）
+retention = None
+
+# pre-fork 模式下的工作进程编号（单进程模式为 None）
+worker_id = None
+
+# 时间窗口内各分钟的有效 token，随当前分钟滚动更新
+minute_tokens = MinuteTokenTable(TOKEN_TIME_WINDOW_MINUTES)
+
+# 接收的记录类型，每个映射字段一个 slot
+LineChangeRecord = record_type(MAPPING_FILE_LINECHANGES, "LineChangeRecord", RECORD_INTERNED_FIELDS, RECORD_MAX_EXTRA_FIELDS)
+
+# 旧的单文件存储模式下写入 SAVE_DIR 的字节数（段归档模式由 archive.bytes_written 统计）
+file_bytes_written = 0
+
+# 指标中的 path 标签只取以下取值，其余路径归为 other，避免标签基数失控
+METRICS_PATHS = ('/', '/health', '/metrics', '/batch', '/stats')
 
 def validate_token(timestamp: str, provided_token: str) -> bool:
     """
@@ -61,30 +168,24 @@ def validate_token(timestamp: str, provided_token: str) -> bool:
     expected_token = compute_minute_token(timestamp)
     return expected_token == provided_token
 
+def check_token_time_window(timestamp: str) -> bool:
+    """
+    检查timestamp与当前时间的差值是否在允许的时间窗口内
+    """
+    ok, time_diff = minute_tokens.in_window(timestamp)
+    if not ok:
+        logger.warning(f"Token时间差过大: {time_diff:.1f}分钟", extra={"log_type": "auth"})
+    return ok
+
 def validate_token_against_current_time(timestamp: str, provided_token: str) -> bool:
     """
     验证token是否与当前时间的分钟匹配（允许一定的时间窗口）
+    窗口内各分钟的token预先计算在 minute_tokens 中，使用常量时间比较
     """
     try:
-        # 解析ISO格式的时间戳 (例如: "2025-08-15T01:46:38.820Z")
-        # 移除Z后缀并解析
-        clean_timestamp = timestamp.replace('Z', '+00:00')
-        provided_time = datetime.fromisoformat(clean_timestamp)
-        
-        # 获取当前UTC时间
-        current_time = datetime.now(timezone.utc)
-        
-        # 计算时间差（分钟）
-        time_diff = abs((current_time - provided_time).total_seconds() / 60)
-        
-        # 允许5分钟的时间窗口
-        if time_diff > TOKEN_TIME_WINDOW_MINUTES:
-            logger.warning(f"Token时间差过大: {time_diff:.1f}分钟")
+        if not check_token_time_window(timestamp):
             return False
-        
-        # 验证token是否正确
-        expected_token = compute_minute_token(timestamp)
-        return expected_token == provided_token
+        return minute_tokens.validate(timestamp, provided_token)
         
     except Exception as e:
         logger.error(f"时间验证错误: {e}")
@@ -97,165 +198,1104 @@ def validate_token(timestamp: str, provided_token: str) -> bool:
     expected_token = compute_minute_token(timestamp)
     return expected_token == provided_token
 
+def build_health_status():
+    """构造健康检查响应内容"""
+    return {
+        "status": "healthy",
+        "version": "1.0.0",
+        "storage": STORAGE_BACKEND,
+        "elasticsearch": "available" if es_available else "unavailable",
+        "elasticsearch_circuit": es_breaker.state if es_breaker else "disabled",
+        "admission": admission.stats() if admission else "disabled",
+        "retention": retention.stats() if retention else "disabled",
+        "startup": startup,
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    }
+
+def body_limit(path: str) -> int:
+    """请求体（解压后）的最大字节数"""
+    return REQUEST_MAX_BATCH_BYTES if path == '/batch' else REQUEST_MAX_BODY_BYTES
+
+def check_request_body(headers, path: str):
+    """
+    在读取请求体之前检查传输方式、编码与大小，Content-Length 超过上限的请求直接返回 413，不读取请求体
+    返回 (content_length, None)，chunked 请求体的 content_length 为 None；或在失败时返回 (None, (状态码, 响应内容))
+    """
+    transfer_encoding = headers.get('transfer-encoding')
+    if transfer_encoding is not None:
+        if transfer_encoding.strip().lower() != 'chunked':
+            return None, (501, b"Unsupported Transfer-Encoding")
+        content_length = None
+    else:
+        try:
+            content_length = int(headers.get('content-length', 0))
+        except ValueError:
+            content_length = -1
+        if content_length < 0:
+            return None, (400, b"Invalid Content-Length")
+        if content_length > body_limit(path):
+            return None, (413, f"Request body exceeds {body_limit(path)} bytes".encode())
+    try:
+        parse_content_encoding(headers.get('content-encoding'))
+    except UnsupportedEncoding as e:
+        return None, (415, str(e).encode())
+    return content_length, None
+
+def body_error(e):
+    """读取请求体时的异常对应的 (状态码, 响应内容)"""
+    if isinstance(e, TimeoutError):
+        return 408, b"Request body timed out"
+    if isinstance(e, BodyTooLarge):
+        return 413, str(e).encode()
+    if isinstance(e, UnsupportedEncoding):
+        return 415, str(e).encode()
+    return 400, str(e).encode()
+
+def parse_and_authenticate(body: bytes, client_ip: str):
+    """
+    解析请求体并完成 token 验证
+    直接从字节解析并校验字段类型，转换为 LineChangeRecord；记录保留请求体的原始字节，归档、持久化队列与 _bulk 请求都复用这份编码，不再重新序列化
+    返回 (data, None)，或在失败时返回 (None, (状态码, 响应内容))
+    """
+    # 解析 JSON
+    try:
+        with stage_duration.time("parse"):
+            data = loads_document(body)
+        # 完整的请求内容只在调试模式下序列化并输出
+        logger.debug("Received JSON from %s: %s", client_ip, LazyJSON(data))
+    except ValueError:
+        # 即使JSON格式错误（包括非 UTF-8 内容），也要打印原始数据
+        logger.error(f"Invalid JSON format from {client_ip}. Raw data: {body.decode('utf-8', 'replace')}")
+        return None, (400, b"Invalid JSON format")
+
+    record, error = to_record(data)
+    if error:
+        return None, error
+    with stage_duration.time("auth"):
+        error = authenticate_record(record, client_ip)
+    if error:
+        return None, error
+    return record, None
+
+def to_record(data):
+    """
+    校验字段类型并转换为 LineChangeRecord，之后的去重、归档、队列与写入都使用这个对象
+    返回 (record, None)，或在失败时返回 (None, (400, 响应内容))
+    """
+    try:
+        with stage_duration.time("parse"):
+            return LineChangeRecord.from_document(data), None
+    except InvalidRecord as e:
+        return None, (400, str(e).encode())
+
+def authenticate_record(data, client_ip: str):
+    """
+    对单条记录进行 token 验证，成功返回 None，失败返回 (状态码, 响应内容)
+    """
+    # Token 验证逻辑
+    if 'token' not in data:
+        # 没有token字段，要求提供token
+        logger.warning(f"No token provided from {client_ip}", extra={"log_type": "auth"})
+        return 401, b"Token required for authentication"
+    elif 'timestamp' not in data:
+        # 有token但没有timestamp
+        logger.warning(f"Token provided but no timestamp found from {client_ip}", extra={"log_type": "auth"})
+        return 400, b"Timestamp required when token is provided"
+
+    # 有token且有timestamp，进行验证
+    timestamp = data['timestamp']
+    provided_token = data['token']
+
+    # 使用包含时间窗口的验证
+    if not validate_token_against_current_time(timestamp, provided_token):
+        logger.warning(
+            f"Token validation failed from {client_ip}: timestamp={timestamp}, "
+            f"provided token={provided_token}, expected token={minute_tokens.expected_token(timestamp)}",
+            extra={"log_type": "auth"}
+        )
+        return 401, b"Invalid token or timestamp too old"
+
+    logger.info(f"Token validation successful from {client_ip}", extra={"log_type": "request"})
+    return None
+
+def parse_batch(body: bytes):
+    """
+    解析 JSON 数组形式的批量请求体（NDJSON 请求体由 BatchStream 边接收边处理）
+    返回 (records, None)，或在失败时返回 (None, (状态码, 响应内容))
+    """
+    try:
+        records = json.loads(body)
+    except ValueError:
+        return None, (400, b"Invalid JSON format")
+    if not isinstance(records, list):
+        return None, (400, b"Batch body must be a JSON array or NDJSON")
+
+    if len(records) > BATCH_MAX_RECORDS:
+        return None, (413, f"Batch exceeds {BATCH_MAX_RECORDS} records".encode())
+    return records, None
+
+def authenticate_batch(records, client_ip: str):
+    """
+    逐条验证批量记录
+    返回 [(data, error)]，error 为 None 表示验证通过
+    """
+    results = []
+    for data in records:
+        if not isinstance(data, dict):
+            results.append((None, (400, b"Invalid JSON format")))
+            continue
+        record, error = to_record(data)
+        results.append((record, error or authenticate_record(record, client_ip)))
+    return results
+
+class BatchStream:
+    """
+    边接收边处理 NDJSON 批量请求体：每收到一行完整记录就解析并验证，请求体不整体读入内存
+    feed() 返回可以保存的 [(位置, data)]，调用方保存后通过 stored() / failed() 填写该位置的结果
+    超过 BATCH_MAX_RECORDS 条之后的记录不再处理，超过 REQUEST_MAX_BODY_BYTES 的单行记录返回 413
+    """
+
+    def __init__(self, client_ip: str):
+        self.client_ip = client_ip
+        self.lines = LineSplitter(REQUEST_MAX_BODY_BYTES)
+        self.results = []  # [(状态码, 响应内容)]，按记录顺序
+        self.truncated = False
+
+    def feed(self, piece: bytes):
+        return self.accept(self.lines.feed(piece))
+
+    def close(self):
+        return self.accept(self.lines.close())
+
+    def accept(self, lines):
+        ready = []
+        for line in lines:
+            if line is not None and not line.strip():
+                continue
+            if len(self.results) >= BATCH_MAX_RECORDS:
+                self.truncated = True
+                continue
+            position = len(self.results)
+            if line is None:
+                self.results.append((413, f"Record exceeds {REQUEST_MAX_BODY_BYTES} bytes"))
+                continue
+            try:
+                with stage_duration.time("parse"):
+                    data = loads_document(line)
+            except ValueError:
+                data = None
+            if not isinstance(data, dict):
+                self.results.append((400, b"Invalid JSON format"))
+                continue
+            record, error = to_record(data)
+            if error is None:
+                with stage_duration.time("auth"):
+                    error = authenticate_record(record, self.client_ip)
+            self.results.append(error)
+            if error is None:
+                ready.append((position, record))
+        return ready
+
+    def stored(self, position: int, filename):
+        self.results[position] = (200, stored_message(filename))
+
+    def failed(self, position: int, e: Exception):
+        logger.error(f"Failed to store batch record from {self.client_ip}: {e}")
+        self.results[position] = (500, f"Server error: {e}")
+
+    def response(self, error=None) -> bytes:
+        """
+        记录每条记录的结果并构造响应；error 为请求体中途读取失败时的 (状态码, 响应内容)，
+        此前收到的记录已经保存，error 作为最后一项结果返回
+        """
+        results = list(self.results)
+        if self.truncated:
+            results.append((413, f"Batch exceeds {BATCH_MAX_RECORDS} records, remaining records ignored"))
+        if error:
+            results.append(error)
+        for status, _ in results:
+            record_outcome(status)
+        return build_batch_response(results)
+
+def record_outcome(status, count=1):
+    """按处理结果统计记录数：200 为 accepted，5xx 为 failed，其余为 rejected"""
+    outcome = "accepted" if status == 200 else "failed" if status >= 500 else "rejected"
+    records_total.inc(outcome, amount=count)
+
+def record_request(method, path, status, started):
+    """记录一次 HTTP 请求的状态码与总耗时"""
+    path = path.partition('?')[0]
+    path = path if path in METRICS_PATHS else "other"
+    requests_total.inc(method, path, str(status))
+    request_duration.observe(time.perf_counter() - started, method, path)
+
+def render_metrics() -> bytes:
+    """Prometheus 文本格式的指标，多进程模式下带 worker 标签（每次抓取只反映处理该请求的工作进程）"""
+    const_labels = [("worker", worker_id)] if worker_id is not None else []
+    return registry.render(const_labels).encode()
+
+def parse_stats_params(query_string: str):
+    """
+    解析 GET /stats 的查询参数，返回 (params, None)，或在失败时返回 (None, 错误信息)
+    group_by: githubUsername、model、language、gitUrl 之一，省略时只返回总计
+    from/to: ISO 8601 或 now-7d 形式（默认 from=STATS_DEFAULT_RANGE，to 不限）
+    size: 最多返回的分组数；githubUsername 等维度字段同时作为过滤条件
+    """
+    raw = parse_qs(query_string)
+    unknown = set(raw) - {"group_by", "from", "to", "size"} - set(ROLLUP_DIMENSIONS)
+    if unknown:
+        return None, f"Unknown parameter: {', '.join(sorted(unknown))}"
+    params = {key: values[-1] for key, values in raw.items()}
+
+    if params.get("group_by", ROLLUP_DIMENSIONS[0]) not in ROLLUP_DIMENSIONS:
+        return None, f"group_by must be one of: {', '.join(ROLLUP_DIMENSIONS)}"
+    params.setdefault("from", STATS_DEFAULT_RANGE)
+    for key in ("from", "to"):
+        if key in params and to_epoch_millis(params[key]) is None:
+            return None, f"Invalid {key}: {params[key]}"
+    try:
+        size = int(params.get("size", STATS_MAX_GROUPS))
+    except ValueError:
+        size = 0
+    if not 1 <= size <= STATS_MAX_GROUPS:
+        return None, f"size must be between 1 and {STATS_MAX_GROUPS}"
+    params["size"] = size
+    return params, None
+
+def query_stats(params: dict) -> dict:
+    """从 rollup 索引（未启用时从原始索引）按参数聚合新增/删除行数与记录数"""
+    time_range = {"gte": params["from"]}
+    if "to" in params:
+        time_range["lt"] = params["to"]
+    filters = [{"range": {"timestamp": time_range}}]
+    filters.extend({"term": {field: params[field]}} for field in ROLLUP_DIMENSIONS if field in params)
+    if ROLLUP_ENABLED:
+        # rollup 按时间桶起点过滤，使用最细的粒度
+        interval = min(ROLLUP_INTERVALS, key=INTERVAL_SECONDS.get)
+        filters.append({"term": {"interval": interval}})
+        index_name, sum_fields = INDEX_NAME_ROLLUP, ["added", "removed", "count"]
+    else:
+        index_name, sum_fields = INDEX_NAME_LINECHANGES, ["added", "removed"]
+
+    group_by = params.get("group_by")
+    rows = es_manager.aggregate(index_name, {"bool": {"filter": filters}}, group_by, sum_fields, params["size"])
+    groups = []
+    for row in rows:
+        stats = {"added": row["added"], "removed": row["removed"], "count": row["count"] if ROLLUP_ENABLED else row["doc_count"]}
+        groups.append({group_by: row["key"], **stats} if group_by else stats)
+
+    result = {
+        "source": "rollup" if ROLLUP_ENABLED else "raw",
+        "from": params["from"],
+        "to": params.get("to"),
+        "filters": {field: params[field] for field in ROLLUP_DIMENSIONS if field in params},
+    }
+    if group_by:
+        result["group_by"] = group_by
+        result["groups"] = groups
+    else:
+        result["totals"] = groups[0] if groups else {"added": 0, "removed": 0, "count": 0}
+    return result
+
+def handle_stats(query_string: str):
+    """GET /stats：返回 (状态码, JSON 响应内容)，结果按查询参数缓存"""
+    params, error = parse_stats_params(query_string)
+    if error:
+        return 400, json.dumps({"error": error}).encode()
+    if not (es_available and es_manager):
+        return 503, json.dumps({"error": "Storage is not available"}).encode()
+    try:
+        result = stats_cache.get_or_load(tuple(sorted(params.items())), lambda: query_stats(params))
+    except Exception as e:
+        logger.error(f"Stats query failed: {e}")
+        return 503, json.dumps({"error": f"Stats query failed: {e}"}).encode()
+    return 200, json.dumps(result, ensure_ascii=False).encode()
+
+def build_batch_response(results) -> bytes:
+    """results: [(状态码, 响应内容)]，按请求中的记录顺序返回每条记录的结果"""
+    items = [
+        {"index": index, "status": status, "message": message.decode() if isinstance(message, bytes) else message}
+        for index, (status, message) in enumerate(results)
+    ]
+    accepted = sum(1 for item in items if item["status"] == 200)
+    return json.dumps({
+        "accepted": accepted,
+        "rejected": len(items) - accepted,
+        "results": items
+    }).encode()
+
+def save_to_file(data) -> str:
+    """将记录保存到 SAVE_DIR，返回文件名（段归档模式下为段文件名）"""
+    if archive:
+        return archive.append(data)
+
+    # 生成文件名，多进程模式下附加工作进程编号，避免同一微秒内的文件名冲突
+    filename = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    if worker_id is not None:
+        filename += f"_w{worker_id}"
+    filename += ".json"
+    filepath = os.path.join(SAVE_DIR, filename)
+
+    # 保存到文件：请求体的原始字节（或紧凑 JSON）
+    global file_bytes_written
+    encoded = encode(data)
+    with open(filepath, "wb") as f:
+        f.write(encoded)
+    file_bytes_written += len(encoded)
+    return filename
+
+def prepare_es_document(data):
+    """确保数据有必要的字段：没有 id 字段时由记录内容生成确定性 id（重复发送的记录写入同一文档），缺少 sessionId 或 responseId 时使用时间戳"""
+    if 'id' not in data:
+        data['id'] = content_id(data) or datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    return data
+
+def record_key(data):
+    """重复记录过滤使用的键：内容字段的摘要，缺少 sessionId 或 responseId 时使用记录自带的 id（都没有则不去重）"""
+    key = content_digest(data)
+    if key is None and data.get('id') is not None:
+        key = str(data['id'])
+    return key
+
+def claim_record(data) -> bool:
+    """记录在窗口内首次出现时返回 True；重复记录返回 False"""
+    if recent_records is None:
+        return True
+    key = record_key(data)
+    return key is None or recent_records.claim(key)
+
+def release_record(data):
+    """保存失败时从窗口中移除，客户端重试时不会被当作重复记录"""
+    if recent_records is not None:
+        key = record_key(data)
+        if key is not None:
+            recent_records.release(key)
+
+def stored_message(filename) -> str:
+    return f"Saved to {filename}" if filename else "Duplicate record ignored"
+
+def store_record(data, client_ip: str):
+    """保存到文件并写入 Elasticsearch (如果可用)，返回文件名；重复记录不做任何写入，返回 None"""
+    if not claim_record(data):
+        logger.info(f"Duplicate record from {client_ip} ignored", extra={"log_type": "request"})
+        return None
+    try:
+        return write_record(data, client_ip)
+    except Exception:
+        release_record(data)
+        raise
+
+def write_record(data, client_ip: str) -> str:
+    """保存到文件并写入 Elasticsearch (如果可用)，返回文件名"""
+    with stage_duration.time("file"):
+        filename = save_to_file(data)
+
+    # 写入到 Elasticsearch：持久化队列模式下即使 ES 当前不可用也先落盘，由回放线程写入
+    if spool:
+        with stage_duration.time("es"):
+            spool.append(INDEX_NAME_LINECHANGES, prepare_es_document(data))
+    elif bulk_writer:
+        with stage_duration.time("es"):
+            queued = bulk_writer.submit(INDEX_NAME_LINECHANGES, prepare_es_document(data))
+        if not queued:
+            # 队列已满时退回到请求内直接写入，记录仍会写入 ES，同时减慢客户端的发送速度
+            write_directly(data, client_ip)
+    else:
+        write_directly(data, client_ip)
+    add_to_rollups(data)
+    return filename
+
+def write_directly(data, client_ip: str):
+    """在请求内直接写入 Elasticsearch (如果可用)，失败只记录日志"""
+    if not (es_available and es_manager):
+        return
+    try:
+        # ES 客户端自行序列化文档，传入普通 dict
+        with stage_duration.time("es"):
+            es_manager.write_to_es(INDEX_NAME_LINECHANGES, prepare_es_document(data).to_dict())
+        stats_cache.invalidate()
+        logger.info(f"Data written to Elasticsearch index: {INDEX_NAME_LINECHANGES} from {client_ip}", extra={"log_type": "request"})
+    except Exception as e:
+        logger.error(f"Failed to write to Elasticsearch from {client_ip}: {e}")
+        # 即使写入 ES 失败，也不阻止响应
+
+def add_to_rollups(data):
+    """把已保存的记录计入内存中的预聚合"""
+    if rollups:
+        rollups.add(data)
+
 class JSONHandler(BaseHTTPRequestHandler):
-    
+
+    # HTTP/1.1 下连接默认保持，每个响应都通过 Content-Length 标明长度
+    protocol_version = "HTTP/1.1" if HTTP_KEEPALIVE_ENABLED else "HTTP/1.0"
+    # 空闲连接等待下一个请求（以及读取请求）的超时时间，超时后关闭连接
+    timeout = HTTP_KEEPALIVE_TIMEOUT
+
+    response_status = None
+    # 请求体没有读完就要关闭连接（拒绝请求或读取失败）
+    body_unread = False
+
+    def send_response(self, code, message=None):
+        # 记录响应状态码，供请求指标使用
+        self.response_status = code
+        super().send_response(code, message)
+
+    def send_body(self, status, payload: bytes, content_type=None):
+        """发送带 Content-Length 的完整响应"""
+        self.send_response(status)
+        if content_type:
+            self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        elif self.request_version == 'HTTP/1.0':
+            # HTTP/1.0 客户端通过 Connection: keep-alive 请求保持连接
+            self.send_header('Connection', 'keep-alive')
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def handle_expect_100(self):
+        # 客户端等到 100 Continue 才发送请求体：无法接受的请求不回复 100，由 handle_post 直接返回错误
+        _, error = check_request_body(self.headers, self.path)
+        if error:
+            return True
+        return super().handle_expect_100()
+
+    def raw_body(self, content_length, max_bytes):
+        """逐块读取请求体（Content-Length 或 chunked），每块不超过 REQUEST_READ_CHUNK_BYTES"""
+        if content_length is not None:
+            yield from self.read_exactly(content_length)
+            return
+        received = 0
+        while True:
+            size = parse_chunk_size(self.read_line())
+            if size == 0:
+                break
+            received += size
+            if received > max_bytes:
+                raise BodyTooLarge(f"Request body exceeds {max_bytes} bytes")
+            yield from self.read_exactly(size)
+            if self.read_line() not in (b"\r\n", b"\n"):
+                raise ValueError("Invalid chunk terminator")
+        # 忽略 trailer
+        while self.read_line() not in (b"\r\n", b"\n"):
+            pass
+
+    def read_exactly(self, size):
+        while size:
+            chunk = self.rfile.read(min(size, REQUEST_READ_CHUNK_BYTES))
+            if not chunk:
+                raise IncompleteBody("Incomplete request body")
+            size -= len(chunk)
+            yield chunk
+
+    def read_line(self):
+        line = self.rfile.readline(MAX_CHUNK_LINE + 1)
+        if not line:
+            raise IncompleteBody("Incomplete request body")
+        if len(line) > MAX_CHUNK_LINE:
+            raise ValueError("Chunk header too long")
+        return line
+
+    def body_pieces(self, content_length):
+        """
+        逐块读取并解压请求体，解压后的大小不超过 body_limit
+        失败时抛出 ValueError / TimeoutError，由 body_error 转换为响应
+        """
+        max_bytes = body_limit(self.path)
+        decoder = ContentDecoder(self.headers.get('Content-Encoding'), max_bytes, REQUEST_READ_CHUNK_BYTES)
+        for chunk in self.raw_body(content_length, max_bytes):
+            yield from decoder.decode(chunk)
+        decoder.finish()
+
+    def read_body(self, content_length):
+        """
+        读取完整的请求体
+        返回 (body, None)，或在失败时返回 (None, (状态码, 响应内容))
+        请求体没有被完整读取时关闭连接，剩余数据不会被当作下一个请求
+        """
+        try:
+            return b"".join(self.body_pieces(content_length)), None
+        except (ValueError, TimeoutError) as e:
+            self.close_connection = True
+            self.body_unread = True
+            return None, body_error(e)
+
+    def reject_body(self, error, client_ip):
+        status, message = error
+        logger.warning(f"Rejected request body from {client_ip}: {message.decode()}")
+        record_outcome(status)
+        self.send_body(status, message)
+
     def do_GET(self):
+        started = time.perf_counter()
+        try:
+            self.handle_get()
+        finally:
+            record_request("GET", self.path, self.response_status, started)
+
+    def handle_get(self):
         # 获取客户端IP地址
         client_ip = self.client_address[0]
         
+        path, _, query_string = self.path.partition('?')
+
+        # Prometheus 指标
+        if path == '/metrics':
+            self.send_body(200, render_metrics(), METRICS_CONTENT_TYPE)
         # 健康检查端点
-        if self.path == '/' or self.path == '/health':
+        elif path == '/' or path == '/health':
             # logger.info(f"Health check request from {client_ip}")
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            
-            health_status = {
-                "status": "healthy",
-                "version": "1.0.0",
-                "elasticsearch": "available" if es_available else "unavailable",
-                "timestamp": datetime.now(timezone.utc).isoformat()
-            }
-            
-            self.wfile.write(json.dumps(health_status).encode())
+            self.send_body(200, json.dumps(build_health_status()).encode(), 'application/json')
+        # 行数统计查询
+        elif path == '/stats':
+            status, payload = handle_stats(query_string)
+            self.send_body(status, payload, 'application/json')
         else:
             logger.warning(f"404 Not Found request from {client_ip} for path: {self.path}")
-            self.send_response(404)
-            self.end_headers()
-            self.wfile.write(b"Not Found")
+            self.send_body(404, b"Not Found")
     
     def do_POST(self):
+        started = time.perf_counter()
+        try:
+            if admission is None:
+                self.handle_post()
+                return
+            try:
+                release = admission.admit()
+            except Rejected as e:
+                self.reject(e)
+                return
+            try:
+                self.handle_post()
+            finally:
+                release()
+        finally:
+            record_request("POST", self.path, self.response_status, started)
+
+    def reject(self, rejection):
+        """过载时不读取请求体，直接返回 429/503 并关闭连接"""
+        logger.warning(f"Request from {self.client_address[0]} shed: {rejection}", extra={"log_type": "request"})
+        record_outcome(rejection.status)
+        self.close_connection = True
+        self.body_unread = True
+        self.send_response(rejection.status)
+        self.send_header('Retry-After', str(rejection.retry_after))
+        self.send_header('Content-Length', '0')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+
+    def handle_post(self):
         # 获取客户端IP地址
         client_ip = self.client_address[0]
         
         # 记录接收到POST请求，包含源IP
-        logger.info(f"Received POST request from {client_ip}")
+        logger.info(f"Received POST request from {client_ip}", extra={"log_type": "request"})
         
         try:
-            # 读取请求体
-            content_length = int(self.headers.get('Content-Length', 0))
-            post_data = self.rfile.read(content_length).decode('utf-8')
-
-            # 解析 JSON
-            try:
-                data = json.loads(post_data)
-                # 打印完整的接收到的JSON消息
-                logger.info(f"Received JSON from {client_ip}: {json.dumps(data, ensure_ascii=False, indent=2)}")
-            except json.JSONDecodeError:
-                # 即使JSON格式错误，也要打印原始数据
-                logger.error(f"Invalid JSON format from {client_ip}. Raw data: {post_data}")
-                self.send_response(400)
-                self.end_headers()
-                self.wfile.write(b"Invalid JSON format")
+            content_length, error = check_request_body(self.headers, self.path)
+            if error:
+                # 不读取请求体，关闭连接
+                self.close_connection = True
+                self.body_unread = True
+                self.reject_body(error, client_ip)
+                return
+            # NDJSON 批量请求边接收边处理
+            if self.path == '/batch' and 'ndjson' in self.headers.get('Content-Type', ''):
+                self.handle_ndjson_batch(content_length, client_ip)
                 return
 
-            # Token 验证逻辑
-            if 'token' not in data:
-                # 没有token字段，要求提供token
-                logger.warning(f"No token provided from {client_ip}")
-                self.send_response(401)
-                self.end_headers()
-                self.wfile.write(b"Token required for authentication")
+            # 读取请求体
+            with stage_duration.time("read"):
+                body, error = self.read_body(content_length)
+            if error:
+                self.reject_body(error, client_ip)
+                return
+            # 批量写入端点
+            if self.path == '/batch':
+                self.handle_batch(body, client_ip)
                 return
-            elif 'timestamp' not in data:
-                # 有token但没有timestamp
-                logger.warning(f"Token provided but no timestamp found from {client_ip}")
-                self.send_response(400)
-                self.end_headers()
-                self.wfile.write(b"Timestamp required when token is provided")
+
+            # 解析 JSON 并验证 token
+            data, error = parse_and_authenticate(body, client_ip)
+            if error:
+                status, message = error
+                record_outcome(status)
+                self.send_body(status, message)
                 return
-            else:
-                # 有token且有timestamp，进行验证
-                timestamp = data['timestamp']
-                provided_token = data['token']
-                
-                # 使用包含时间窗口的验证
-                if not validate_token_against_current_time(timestamp, provided_token):
-                    logger.warning(f"Token validation failed from {client_ip}")
-                    logger.warning(f"  Timestamp: {timestamp}")
-                    logger.warning(f"  Provided token: {provided_token}")
-                    logger.warning(f"  Expected token: {compute_minute_token(timestamp)}")
-                    
-                    self.send_response(401)
-                    self.end_headers()
-                    self.wfile.write(b"Invalid token or timestamp too old")
-                    return
-                else:
-                    logger.info(f"Token validation successful from {client_ip}")
-
-            # 生成文件名
-            filename = datetime.now().strftime("%Y%m%d_%H%M%S_%f") + ".json"
-            filepath = os.path.join(SAVE_DIR, filename)
-
-            # 保存到文件
-            with open(filepath, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-
-            # 写入到 Elasticsearch (如果可用)
-            if es_available and es_manager:
-                try:
-                    # 确保数据有必要的字段，如果没有 id 字段，使用时间戳生成
-                    if 'id' not in data:
-                        data['id'] = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-                    
-                    es_manager.write_to_es(INDEX_NAME_LINECHANGES, data)
-                    logger.info(f"Data written to Elasticsearch index: {INDEX_NAME_LINECHANGES} from {client_ip}")
-                except Exception as e:
-                    logger.error(f"Failed to write to Elasticsearch from {client_ip}: {e}")
-                    # 即使写入 ES 失败，也不阻止响应
+
+            filename = store_record(data, client_ip)
+            record_outcome(200)
 
             # 返回成功响应
-            self.send_response(200)
-            self.end_headers()
-            self.wfile.write(f"Saved to {filename}".encode())
-            logger.info(f"Successfully processed request from {client_ip}, saved to {filename}")
+            self.send_body(200, stored_message(filename).encode())
+            logger.info(f"Successfully processed request from {client_ip}: {stored_message(filename)}", extra={"log_type": "request"})
 
         except Exception as e:
             logger.error(f"Server error from {client_ip}: {e}")
-            self.send_response(500)
-            self.end_headers()
-            self.wfile.write(f"Server error: {e}".encode())
+            record_outcome(500)
+            self.send_body(500, f"Server error: {e}".encode())
+
+    def handle_batch(self, body, client_ip):
+        """处理 JSON 数组形式的批量记录，返回每条记录的处理结果"""
+        with stage_duration.time("parse"):
+            records, error = parse_batch(body)
+        if error:
+            status, message = error
+            logger.warning(f"Rejected batch from {client_ip}: {message.decode()}")
+            record_outcome(status)
+            self.send_body(status, message)
+            return
+
+        logger.info(f"Received batch of {len(records)} records from {client_ip}", extra={"log_type": "request"})
+        results = []
+        with stage_duration.time("auth"):
+            authenticated = authenticate_batch(records, client_ip)
+        for data, error in authenticated:
+            if error:
+                results.append(error)
+                continue
+            try:
+                filename = store_record(data, client_ip)
+                results.append((200, stored_message(filename)))
+            except Exception as e:
+                logger.error(f"Failed to store batch record from {client_ip}: {e}")
+                results.append((500, f"Server error: {e}"))
+        for status, _ in results:
+            record_outcome(status)
+
+        self.send_body(200, build_batch_response(results), 'application/json')
+        logger.info(f"Successfully processed batch of {len(records)} records from {client_ip}", extra={"log_type": "request"})
+
+    def handle_ndjson_batch(self, content_length, client_ip):
+        """逐行处理 NDJSON 批量记录：每收到一条完整记录就验证并保存，返回每条记录的处理结果"""
+        batch = BatchStream(client_ip)
+        error = None
+        try:
+            for piece in self.body_pieces(content_length):
+                for position, data in batch.feed(piece):
+                    self.store_batch_record(batch, position, data, client_ip)
+            for position, data in batch.close():
+                self.store_batch_record(batch, position, data, client_ip)
+        except (ValueError, TimeoutError) as e:
+            self.close_connection = True
+            self.body_unread = True
+            error = body_error(e)
+            if not batch.results:
+                self.reject_body(error, client_ip)
+                return
+            logger.warning(f"Batch body from {client_ip} failed after {len(batch.results)} records: {error[1].decode()}")
+
+        self.send_body(200, batch.response(error), 'application/json')
+        logger.info(f"Successfully processed batch of {len(batch.results)} records from {client_ip}", extra={"log_type": "request"})
+
+    def store_batch_record(self, batch, position, data, client_ip):
+        try:
+            batch.stored(position, store_record(data, client_ip))
+        except Exception as e:
+            batch.failed(position, e)
+
+    def finish(self):
+        super().finish()
+        if self.body_unread:
+            self.discard_body()
+
+    def discard_body(self):
+        """
+        响应发送后关闭写方向，再读掉最多 REQUEST_DISCARD_MAX_BYTES 字节未读的请求体
+        接收缓冲区中还有数据时直接关闭连接，内核会发送 RST，客户端可能在读到响应前收到 ECONNRESET / EPIPE
+        """
+        deadline = time.monotonic() + REQUEST_DISCARD_TIMEOUT_SECONDS
+        discarded = 0
+        try:
+            self.connection.shutdown(socket.SHUT_WR)
+            while discarded < REQUEST_DISCARD_MAX_BYTES:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.connection.settimeout(remaining)
+                chunk = self.connection.recv(min(REQUEST_READ_CHUNK_BYTES, REQUEST_DISCARD_MAX_BYTES - discarded))
+                if not chunk:
+                    break
+                discarded += len(chunk)
+        except OSError:
+            pass
 
     def log_message(self, format, *args):
         # 禁用默认日志输出
         return
 
+def start_admission():
+    """创建写入请求的准入控制器，只用于 main.py 的线程服务器"""
+    global admission
+    if ADMISSION_ENABLED:
+        admission = AdmissionController(
+            max_in_flight=ADMISSION_MAX_IN_FLIGHT,
+            max_queued=ADMISSION_MAX_QUEUED,
+            queue_timeout=ADMISSION_QUEUE_TIMEOUT_SECONDS,
+            max_retry_after=ADMISSION_MAX_RETRY_AFTER_SECONDS
+        )
+
+def storage_indexes():
+    """需要创建的索引及其映射文件"""
+    indexes = {INDEX_NAME_LINECHANGES: MAPPING_FILE_LINECHANGES}
+    if ROLLUP_ENABLED:
+        indexes[INDEX_NAME_ROLLUP] = MAPPING_FILE_ROLLUP
+    return indexes
+
 def initialize_elasticsearch():
-    """初始化 Elasticsearch 索引"""
-    global es_manager, es_available
+    """
+    初始化 Elasticsearch 客户端、熔断器与索引
+    ES 不可用时熔断器直接进入打开状态，由后台探测线程在 ES 恢复后补建索引并恢复写入
+    """
+    global es_manager, es_available, es_breaker
+
+    logger.info("Initializing Elasticsearch...")
+
+    # 延迟导入 elasticsearch 客户端，并记录导入耗时
+    import_started = time.perf_counter()
+    from utils.es_utils import ElasticsearchManager, GuardedElasticsearchManager
+    startup["elasticsearch_import_ms"] = round((time.perf_counter() - import_started) * 1000, 1)
     
+    # 创建 Elasticsearch 管理器
+    manager = ElasticsearchManager(
+        write_mode=ES_WRITE_MODE,
+        partitions={INDEX_NAME_LINECHANGES: ES_PARTITION_INTERVAL} if ES_PARTITION_INTERVAL else None,
+        rollover_conditions=ES_ROLLOVER_CONDITIONS,
+        # 通过 token 验证的记录时间戳最多比接收时间晚一个时间窗口
+        partition_skew=TOKEN_TIME_WINDOW_MINUTES * 60,
+        view_ttl=ES_PARTITION_VIEW_TTL_SECONDS
+    )
+    indexes = storage_indexes()
+
+    def probe():
+        # 熔断期间的后台健康探测：ES 恢复后确保索引存在
+        if not manager.ping():
+            return False
+        manager.check_and_create_indexes(indexes)
+        return True
+
+    es_breaker = CircuitBreaker(
+        "elasticsearch",
+        failure_threshold=ES_BREAKER_FAILURE_THRESHOLD,
+        reset_timeout=ES_BREAKER_RESET_TIMEOUT_SECONDS,
+        probe=probe,
+        probe_interval=ES_PROBE_INTERVAL_SECONDS,
+        on_state_change=on_es_state_change
+    )
+
     try:
-        logger.info("Initializing Elasticsearch...")
-        
-        # 创建 Elasticsearch 管理器
-        es_manager = ElasticsearchManager()
-        
         # 检查并创建索引
-        indexes = {INDEX_NAME_LINECHANGES: MAPPING_FILE_LINECHANGES}
-        es_manager.check_and_create_indexes(indexes)
-        
+        manager.check_and_create_indexes(indexes)
         es_available = True
         logger.info("Elasticsearch initialization completed")
-        return True
     except Exception as e:
         logger.error(f"Failed to initialize Elasticsearch: {e}")
-        logger.warning("Server will continue without Elasticsearch functionality")
-        es_available = False
-        return False
+        logger.warning("Server will continue without Elasticsearch functionality until it recovers")
+        es_breaker.trip()
+    es_manager = GuardedElasticsearchManager(manager, es_breaker)
+    es_breaker.start_probe()
+    if ES_PARTITION_INTERVAL:
+        threading.Thread(target=run_rollover, name="es-rollover", daemon=True).start()
+    return es_available
 
-if __name__ == "__main__":
-    # 初始化 Elasticsearch
-    initialize_elasticsearch()
-    
-    server = HTTPServer((SERVER_HOST, SERVER_PORT), JSONHandler)
-    logger.info(f"Server listening on http://{SERVER_HOST}:{SERVER_PORT}")
-    if es_available:
-        logger.info(f"Elasticsearch integration enabled - data will be stored in index: {INDEX_NAME_LINECHANGES}")
+def run_rollover():
+    """后台线程：定期检查分区索引是否需要滚动（日期变化或达到大小条件）"""
+    while True:
+        time.sleep(ES_ROLLOVER_CHECK_INTERVAL_SECONDS)
+        if not es_available:
+            continue
+        try:
+            es_manager.rollover(INDEX_NAME_LINECHANGES)
+        except Exception as e:
+            logger.warning(f"Rollover check of {INDEX_NAME_LINECHANGES} failed: {e}")
+
+def initialize_sqlite():
+    """
+    初始化嵌入式 SQLite 存储（STORAGE_BACKEND = "sqlite"）
+    本地数据库文件不需要熔断器，写入与查询沿用 es_manager 的接口
+    """
+    global es_manager, es_available
+
+    logger.info(f"Initializing SQLite storage at {SQLITE_PATH}...")
+    from utils.sqlite_utils import SQLiteManager
+
+    manager = SQLiteManager(SQLITE_PATH, indexed_fields=SQLITE_INDEXED_FIELDS, busy_timeout=SQLITE_BUSY_TIMEOUT_SECONDS)
+    manager.check_and_create_indexes(storage_indexes())
+    es_manager = manager
+    es_available = True
+    logger.info("SQLite storage initialization completed")
+    return es_available
+
+def bootstrap_elasticsearch():
+    """后台启动线程：初始化存储后端，完成后启动依赖客户端的批量写入，并标记为 ready"""
+    try:
+        if STORAGE_BACKEND == "sqlite":
+            initialize_sqlite()
+        else:
+            initialize_elasticsearch()
+        if es_available:
+            logger.info(f"{STORAGE_BACKEND} integration enabled - data will be stored in index: {INDEX_NAME_LINECHANGES}")
+        else:
+            logger.warning("Elasticsearch integration disabled - data will only be stored in files until it recovers")
+        if not SPOOL_ENABLED:
+            start_bulk_writer()
+    except Exception as e:
+        logger.error(f"Elasticsearch bootstrap failed: {e}")
+    finally:
+        mark_startup("elasticsearch_ready_ms")
+        startup["state"] = "ready"
+        logger.info(f"Startup completed: {startup}")
+
+def start_background_bootstrap():
+    """在监听端口之后启动 ES 初始化，不阻塞请求处理"""
+    thread = threading.Thread(target=bootstrap_elasticsearch, name="es-bootstrap", daemon=True)
+    thread.start()
+    return thread
+
+def mark_startup(phase):
+    startup[phase] = round((time.perf_counter() - PROCESS_STARTED) * 1000, 1)
+
+def on_es_state_change(state):
+    """熔断器状态变化时更新 es_available（半开状态允许试探请求，视为可用）"""
+    global es_available
+    es_available = state != OPEN
+
+def start_pipeline():
+    """启动当前进程的归档与 ES 批量写入（文件句柄和线程不能跨 fork 继承，工作进程需各自启动）"""
+    global archive
+    if ARCHIVE_FORMAT == "segments":
+        archive = SegmentArchive(
+            SAVE_DIR,
+            max_bytes=ARCHIVE_SEGMENT_MAX_BYTES,
+            max_age=ARCHIVE_SEGMENT_MAX_AGE_SECONDS,
+            fsync_every=ARCHIVE_FSYNC_EVERY,
+            fsync_interval=ARCHIVE_FSYNC_INTERVAL_SECONDS,
+            compress=ARCHIVE_COMPRESS,
+            name_suffix=f"_w{worker_id}" if worker_id is not None else ""
+        ).start()
+    if SPOOL_ENABLED:
+        start_spool()
     else:
-        logger.warning("Elasticsearch integration disabled - data will only be stored in files")
-    
+        start_bulk_writer()
+    if ROLLUP_ENABLED:
+        start_rollups()
+    # 保留策略作用于共享的索引和目录，多个工作进程时只由 0 号进程执行
+    if RETENTION_ENABLED and worker_id in (None, 0):
+        start_retention()
+
+def stop_pipeline():
+    """刷新并关闭当前进程的 ES 写入队列、预聚合与归档"""
+    global archive
+    stop_retention()
+    stop_rollups()
+    stop_spool()
+    stop_bulk_writer()
+    if archive:
+        archive.close()
+        archive = None
+
+def start_spool():
+    """创建当前进程的持久化写入队列并启动回放线程，每个工作进程使用独立的目录"""
+    global spool, spool_replayer
+    directory = os.path.join(SPOOL_DIR, f"w{worker_id}" if worker_id is not None else "main")
+    spool = DurableSpool(
+        directory,
+        max_bytes=SPOOL_SEGMENT_MAX_BYTES,
+        fsync_every=SPOOL_FSYNC_EVERY,
+        fsync_interval=SPOOL_FSYNC_INTERVAL_SECONDS
+    )
+    spool_replayer = SpoolReplayer(
+        spool,
+        write_spooled_batch,
+        batch_size=SPOOL_REPLAY_BATCH_SIZE,
+        max_rate=SPOOL_REPLAY_MAX_DOCS_PER_SECOND,
+        max_backoff=SPOOL_RETRY_MAX_BACKOFF_SECONDS
+    ).start()
+
+def stop_spool():
+    global spool, spool_replayer
+    if spool_replayer:
+        spool_replayer.close()
+        logger.info(f"Spool replayer stopped: {spool_replayer.stats()}")
+        spool_replayer = None
+    if spool:
+        spool.close()
+        spool = None
+
+def write_spooled_batch(documents):
+    """回放线程的写入回调：熔断器打开时立即抛出 CircuitOpenError，由回放线程退避重试"""
+    if not es_manager:
+        raise ConnectionError("Elasticsearch is not configured")
+    errors = es_manager.bulk_write(documents)
+    if len(errors) < len(documents):
+        # 新数据写入后使 /stats 缓存失效
+        stats_cache.invalidate()
+    return errors
+
+def start_rollups():
+    """启动当前进程的预聚合刷新线程；各工作进程的结果在 rollup 索引中累加"""
+    global rollups
+    rollups = RollupAggregator(
+        write_rollups,
+        INDEX_NAME_ROLLUP,
+        intervals=ROLLUP_INTERVALS,
+        flush_interval=ROLLUP_FLUSH_INTERVAL_SECONDS,
+        max_keys=ROLLUP_MAX_PENDING_ROWS
+    ).start()
+
+def stop_rollups():
+    global rollups
+    if rollups:
+        rollups.close()
+        logger.info(f"Rollup aggregator stopped: {rollups.stats()}")
+        rollups = None
+
+def write_rollups(documents):
+    """预聚合刷新线程的写入回调：ES 未初始化或熔断器打开时抛出异常，保留到下次刷新"""
+    if not es_manager:
+        raise ConnectionError("Elasticsearch is not configured")
+    errors = es_manager.bulk_increment(documents, ROLLUP_COUNTERS)
+    stats_cache.invalidate()
+    return errors
+
+def start_retention():
+    """启动定期清理线程；存储后端尚未就绪或熔断时跳过索引策略，只处理本地目录"""
+    global retention
+    retention = RetentionJob(
+        lambda: es_manager if es_available else None,
+        index_policies=RETENTION_INDEX_POLICIES,
+        directory_policies=RETENTION_DIRECTORY_POLICIES,
+        interval=RETENTION_INTERVAL_SECONDS,
+        delete_options=RETENTION_DELETE_OPTIONS,
+        segment_max_age=ARCHIVE_SEGMENT_MAX_AGE_SECONDS
+    ).start()
+
+def stop_retention():
+    global retention
+    if retention:
+        retention.close()
+        retention = None
+
+def start_bulk_writer():
+    """为当前进程启动后台批量写入线程（ES 客户端尚未初始化时由后台启动线程稍后调用）"""
+    global bulk_writer
+    if ES_BULK_ENABLED and es_manager and not bulk_writer:
+        bulk_writer = BulkWriter(
+            es_manager,
+            max_docs=ES_BULK_MAX_DOCS,
+            max_bytes=ES_BULK_MAX_BYTES,
+            max_age=ES_BULK_MAX_AGE_SECONDS,
+            queue_size=ES_BULK_QUEUE_SIZE,
+            max_retries=ES_BULK_MAX_RETRIES,
+            on_flush=stats_cache.invalidate
+        ).start()
+    return bulk_writer
+
+def stop_bulk_writer():
+    """刷新队列中剩余的文档并停止批量写入线程"""
+    global bulk_writer
+    if bulk_writer:
+        bulk_writer.close()
+        logger.info(f"Bulk writer stopped: {bulk_writer.stats()}")
+        bulk_writer = None
+
+def queue_depths():
+    depths = {("log",): log_queue_stats()["queued"]}
+    if bulk_writer:
+        depths[("es_bulk",)] = bulk_writer.queue.qsize()
+    if rollups:
+        depths[("rollup",)] = rollups.stats()["pending_rows"]
+    if admission:
+        depths[("admission",)] = admission.queued
+    return depths
+
+# 在抓取时读取的指标
+registry.callback("linechanges_queue_depth", "Items waiting in in-memory queues.", queue_depths, ("queue",))
+registry.callback("linechanges_spool_pending_bytes", "Spooled bytes not yet written to Elasticsearch.",
+                  lambda: spool.pending_bytes() if spool else None)
+registry.callback("linechanges_save_dir_bytes_written_total", "Bytes written to SAVE_DIR by this process.",
+                  lambda: file_bytes_written + (archive.bytes_written if archive else 0), type="counter")
+registry.callback("linechanges_log_records_dropped_total", "Log records dropped because the log queue was full.",
+                  lambda: log_queue_stats()["dropped"], type="counter")
+registry.callback("linechanges_duplicate_records_total", "Records dropped as duplicates of a recently accepted record.",
+                  lambda: recent_records.duplicates if recent_records else None, type="counter")
+registry.callback("linechanges_stats_cache_requests_total", "GET /stats lookups by cache result.",
+                  lambda: {("hit",): stats_cache.hits, ("miss",): stats_cache.misses}, ("result",), type="counter")
+registry.callback("linechanges_requests_in_flight", "POST requests holding an admission slot.",
+                  lambda: admission.in_flight if admission else None)
+registry.callback("linechanges_requests_shed_total", "POST requests rejected by admission control, by reason.",
+                  lambda: {(reason,): count for reason, count in admission.rejected.items()} if admission else None,
+                  ("reason",), type="counter")
+registry.callback("linechanges_retention_deleted_total", "Items deleted by the retention job, by kind (documents, indexes, files).",
+                  lambda: {(kind,): count for kind, count in retention.stats()["deleted"].items()} if retention else None,
+                  ("kind",), type="counter")
+registry.callback("linechanges_elasticsearch_available", "1 while the Elasticsearch circuit allows requests.",
+                  lambda: int(es_available))
+
+class IngestHTTPServer(ThreadingHTTPServer):
+    """每个连接一个线程：保持连接的空闲客户端不会阻塞其他客户端的请求"""
+    daemon_threads = True
+    # 标准库默认的监听队列只有 5，并发连接超出时客户端要等 1s / 3s 的 SYN 重传
+    request_queue_size = max(HTTP_LISTEN_BACKLOG, ADMISSION_MAX_IN_FLIGHT + ADMISSION_MAX_QUEUED)
+
+class ReusePortHTTPServer(IngestHTTPServer):
+    """设置 SO_REUSEPORT 的 HTTPServer，多个工作进程可以绑定同一端口"""
+
+    def server_bind(self):
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+def run_worker(host, port, index):
+    """pre-fork 工作进程入口：独立的日志处理器和 ES 客户端"""
+    global worker_id
+    worker_id = index
+    configure_worker_logger(logger, index)
+
+    start_pipeline()
+    start_admission()
+    server = ReusePortHTTPServer((host, port), JSONHandler)
+    mark_startup("listener_ms")
+    logger.info(f"Worker {index} (pid {os.getpid()}) listening on http://{host}:{port}")
+
+    # 每个工作进程在监听之后各自初始化 ES 客户端（连接和线程不能跨 fork 共享）
+    start_background_bootstrap()
     try:
         server.serve_forever()
-    except KeyboardInterrupt:
-        logger.info("Shutting down server.")
-        server.server_close()
\ No newline at end of file
+    finally:
+        server.server_close()
+        stop_pipeline()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Line changes receiver")
+    parser.add_argument("--host", default=SERVER_HOST, help="监听地址")
+    parser.add_argument("--port", type=int, default=SERVER_PORT, help="监听端口")
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS, help="工作进程数量（大于 1 时启用 SO_REUSEPORT pre-fork 模式）")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if args.workers > 1:
+        if not reuse_port_supported():
+            raise SystemExit("--workers requires a platform with fork() and SO_REUSEPORT")
+        logger.info(f"Starting {args.workers} workers on http://{args.host}:{args.port}")
+        PreforkSupervisor(args.workers, lambda index: run_worker(args.host, args.port, index)).run()
+    else:
+        # docker stop 发送 SIGTERM，转为 KeyboardInterrupt 以便刷新队列和归档后再退出
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        start_pipeline()
+        start_admission()
+        server = IngestHTTPServer((args.host, args.port), JSONHandler)
+        mark_startup("listener_ms")
+        logger.info(f"Server listening on http://{args.host}:{args.port}")
+
+        # 先监听端口，再在后台初始化 Elasticsearch
+        start_background_bootstrap()
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logger.info("Shutting down server.")
+            server.server_close()
+            stop_pipeline()
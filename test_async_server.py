@@ -0,0 +1,104 @@
+import asyncio
+import json
+import pytest
+import main
+import async_server
+from benchmark.load_client import make_record
+
+
+@pytest.fixture
+def storage(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "SAVE_DIR", str(tmp_path))
+    for name in ("archive", "spool", "bulk_writer", "rollups", "es_manager"):
+        monkeypatch.setattr(main, name, None)
+    monkeypatch.setattr(main, "es_available", False)
+    return tmp_path
+
+
+async def read_response(reader):
+    status_line = await reader.readline()
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode().partition(":")
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers["content-length"]))
+    return int(status_line.split()[1]), headers, body
+
+
+def request(method, path, body=b"", **headers):
+    lines = [f"{method} {path} HTTP/1.1", "Host: test", f"Content-Length: {len(body)}"]
+    lines.extend(f"{name.replace('_', '-')}: {value}" for name, value in headers.items())
+    return ("\r\n".join(lines) + "\r\n\r\n").encode() + body
+
+
+def run(scenario):
+    async def main_coroutine():
+        server = async_server.AsyncIngestServer(host="127.0.0.1", port=0)
+        await server.start()
+        port = server.server.sockets[0].getsockname()[1]
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            try:
+                return await scenario(reader, writer)
+            finally:
+                writer.close()
+        finally:
+            server.server.close()
+            await server.server.wait_closed()
+            await server.close()
+    return asyncio.run(main_coroutine())
+
+
+def test_keep_alive_round_trip(storage):
+    async def scenario(reader, writer):
+        writer.write(request("POST", "/", json.dumps(make_record()).encode(), Content_Type="application/json"))
+        status, headers, body = await read_response(reader)
+        assert status == 200 and headers["connection"] == "keep-alive"
+        assert body.startswith(b"Saved to ")
+
+        batch = b"".join(json.dumps(record).encode() + b"\n" for record in (make_record(), [1], make_record()))
+        writer.write(request("POST", "/batch", batch, Content_Type="application/x-ndjson"))
+        status, headers, body = await read_response(reader)
+        assert status == 200 and headers["connection"] == "keep-alive"
+        assert [item["status"] for item in json.loads(body)["results"]] == [200, 400, 200]
+
+        writer.write(request("GET", "/health", Connection="close"))
+        status, headers, _ = await read_response(reader)
+        assert status == 200 and headers["connection"] == "close"
+        assert await reader.read() == b""
+
+    run(scenario)
+    assert len(list(storage.iterdir())) == 3
+
+
+def test_malformed_request_line_gets_400(storage):
+    async def scenario(reader, writer):
+        writer.write(b"GARBAGE\r\n\r\n")
+        status, headers, _ = await read_response(reader)
+        assert status == 400 and headers["connection"] == "close"
+        assert await reader.read() == b""
+
+    run(scenario)
+
+
+def test_too_many_headers_get_431(storage):
+    async def scenario(reader, writer):
+        headers = {f"X_Header_{i}": i for i in range(async_server.ASYNC_MAX_HEADERS + 1)}
+        writer.write(request("GET", "/health", **headers))
+        status, _, body = await read_response(reader)
+        assert (status, body) == (431, b"Too many headers")
+
+    run(scenario)
+
+
+def test_slow_headers_time_out(storage, monkeypatch):
+    monkeypatch.setattr(async_server, "ASYNC_KEEPALIVE_TIMEOUT", 0.1)
+
+    async def scenario(reader, writer):
+        writer.write(b"GET /health HTTP/1.1\r\nHost: test\r\n")
+        assert await asyncio.wait_for(reader.read(), 5) == b""
+
+    run(scenario)
@@ -0,0 +1,159 @@
+import json
+import socket
+import threading
+import time
+from email.message import Message
+import pytest
+import main
+from benchmark.load_client import make_record
+
+
+def headers(**fields):
+    message = Message()
+    for name, value in fields.items():
+        message[name.replace("_", "-")] = str(value)
+    return message
+
+
+def test_check_request_body():
+    assert main.check_request_body(headers(Content_Length=10), "/") == (10, None)
+    assert main.check_request_body(headers(), "/") == (0, None)
+    assert main.check_request_body(headers(Transfer_Encoding="chunked"), "/batch") == (None, None)
+    assert main.check_request_body(headers(Transfer_Encoding="gzip"), "/")[1][0] == 501
+    assert main.check_request_body(headers(Content_Length="x"), "/")[1][0] == 400
+    assert main.check_request_body(headers(Content_Length=main.REQUEST_MAX_BODY_BYTES + 1), "/")[1][0] == 413
+    assert main.check_request_body(headers(Content_Length=main.REQUEST_MAX_BODY_BYTES + 1), "/batch") == (main.REQUEST_MAX_BODY_BYTES + 1, None)
+    assert main.check_request_body(headers(Content_Length=10, Content_Encoding="br"), "/")[1][0] == 415
+
+
+def ndjson(*records):
+    return b"".join(json.dumps(record).encode() + b"\n" for record in records)
+
+
+def test_batch_stream_splits_records_across_pieces():
+    body = ndjson(make_record(), make_record()) + b"\n" + b"not json\n" + json.dumps(make_record()).encode()
+    batch = main.BatchStream("127.0.0.1")
+    ready = []
+    for i in range(0, len(body), 13):
+        ready.extend(batch.feed(body[i:i + 13]))
+    ready.extend(batch.close())
+
+    assert [position for position, _ in ready] == [0, 1, 3]
+    assert all(isinstance(record, main.LineChangeRecord) for _, record in ready)
+    for position, _ in ready:
+        batch.stored(position, "segment.ndjson")
+    response = json.loads(batch.response())
+    assert response["accepted"] == 3
+    assert [item["status"] for item in response["results"]] == [200, 200, 400, 200]
+
+
+def test_batch_stream_rejects_invalid_records():
+    unauthenticated = make_record()
+    unauthenticated["token"] = "0" * 64
+    batch = main.BatchStream("127.0.0.1")
+    ready = batch.feed(ndjson([1, 2], {**make_record(), "added": "many"}, unauthenticated))
+    assert ready == []
+    assert [status for status, _ in batch.results] == [400, 400, 401]
+
+
+def test_batch_stream_limits(monkeypatch):
+    monkeypatch.setattr(main, "BATCH_MAX_RECORDS", 2)
+    batch = main.BatchStream("127.0.0.1")
+    batch.lines.max_line = 1000
+    ready = batch.feed(b"x" * 2000 + b"\n" + ndjson(make_record(), make_record()))
+    assert [position for position, _ in ready] == [1]
+    batch.failed(1, RuntimeError("disk full"))
+    response = json.loads(batch.response((413, b"Request body exceeds 16 bytes")))
+    assert [item["status"] for item in response["results"]] == [413, 500, 413, 413]
+
+
+@pytest.fixture
+def server():
+    httpd = main.IngestHTTPServer(("127.0.0.1", 0), main.JSONHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd.server_address
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_oversized_body_is_rejected_without_connection_reset(server):
+    # 客户端不等待响应就开始发送请求体，服务器不读取请求体也要让客户端读到 413
+    with socket.create_connection(server) as client:
+        client.sendall(b"POST / HTTP/1.1\r\nHost: test\r\nContent-Type: application/json\r\n"
+                       b"Content-Length: 2000000\r\n\r\n")
+        client.sendall(b"x" * 48 * 1024)
+        time.sleep(0.05)
+        client.sendall(b"x" * 8 * 1024)
+        time.sleep(0.1)
+        response = b""
+        while True:
+            chunk = client.recv(65536)
+            if not chunk:
+                break
+            response += chunk
+    assert response.startswith(b"HTTP/1.1 413 ")
+    assert b"Connection: close" in response
+
+
+class FakeStatsManager:
+    primary_key = "id"
+
+    def __init__(self):
+        self.queries = 0
+        self.written = []
+
+    def aggregate(self, index_name, query, group_by, sum_fields, size):
+        self.queries += 1
+        return [{"key": "alice", "added": 3, "removed": 1, "count": 2, "doc_count": 2}]
+
+    def write_to_es(self, index_name, doc):
+        self.written.append(doc["id"])
+
+    def bulk_write(self, documents):
+        return []
+
+
+@pytest.fixture
+def stats_manager(monkeypatch, tmp_path):
+    manager = FakeStatsManager()
+    monkeypatch.setattr(main, "stats_cache", main.TTLCache(10, 60))
+    monkeypatch.setattr(main, "es_manager", manager)
+    monkeypatch.setattr(main, "es_available", True)
+    monkeypatch.setattr(main, "SAVE_DIR", str(tmp_path))
+    for name in ("archive", "spool", "bulk_writer", "rollups"):
+        monkeypatch.setattr(main, name, None)
+    return manager
+
+
+def test_stats_handler_caches_until_new_data_is_stored(stats_manager):
+    status, payload = main.handle_stats("group_by=githubUsername")
+    assert status == 200
+    assert json.loads(payload)["groups"][0]["githubUsername"] == "alice"
+    assert main.handle_stats("group_by=githubUsername")[0] == 200
+    assert stats_manager.queries == 1
+
+    main.write_record(main.LineChangeRecord.from_document(make_record()), "127.0.0.1")
+    main.handle_stats("group_by=githubUsername")
+    assert stats_manager.queries == 2
+
+    main.write_spooled_batch([(main.INDEX_NAME_LINECHANGES, {"id": "a"})])
+    main.handle_stats("group_by=githubUsername")
+    assert stats_manager.queries == 3
+
+
+def test_stats_handler_errors(stats_manager, monkeypatch):
+    assert main.handle_stats("group_by=unknown")[0] == 400
+    assert main.handle_stats("size=0")[0] == 400
+    monkeypatch.setattr(main, "es_available", False)
+    assert main.handle_stats("")[0] == 503
+
+
+def test_full_bulk_queue_falls_back_to_direct_write(stats_manager, monkeypatch):
+    writer = main.BulkWriter(stats_manager, queue_size=1)
+    monkeypatch.setattr(main, "bulk_writer", writer)
+    first, second = (main.LineChangeRecord.from_document(make_record()) for _ in range(2))
+    main.write_record(first, "127.0.0.1")
+    main.write_record(second, "127.0.0.1")
+    assert writer.queue.qsize() == 1
+    assert stats_manager.written == [second["id"]]
@@ -0,0 +1,114 @@
+import math
+import threading
+import time
+
+# 拒绝原因
+QUEUE_FULL = "queue_full"
+QUEUE_TIMEOUT = "queue_timeout"
+
+
+class Rejected(Exception):
+    """
+    Raised by AdmissionController.admit() when a request is shed.
+
+    Attributes:
+        reason (str): QUEUE_FULL or QUEUE_TIMEOUT.
+        status (int): 429 when the wait queue is full, 503 when the wait timed out.
+        retry_after (int): Seconds the client should wait before retrying.
+    """
+
+    def __init__(self, reason, status, retry_after):
+        super().__init__(f"Request rejected ({reason}), retry after {retry_after}s")
+        self.reason = reason
+        self.status = status
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Bounds the number of requests in the ingest path of one process.
+
+    At most max_in_flight requests run at a time; up to max_queued more wait for a
+    slot for at most queue_timeout seconds. Anything beyond that is rejected at once,
+    so under overload a request either runs or fails fast instead of holding a socket
+    and memory while the backlog grows.
+
+    Retry-After is estimated from the backlog and the average time a request holds
+    a slot (exponentially weighted), clamped to [1, max_retry_after] seconds.
+
+    Args:
+        max_in_flight (int): Requests processed concurrently.
+        max_queued (int): Requests allowed to wait for a slot.
+        queue_timeout (float): Seconds a request waits before being rejected with 503.
+        max_retry_after (int): Upper bound of the Retry-After hint.
+    """
+
+    def __init__(self, max_in_flight=64, max_queued=256, queue_timeout=2.0, max_retry_after=30):
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.max_retry_after = max_retry_after
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.queued = 0
+        self.service_time = 0.0  # 每个请求占用处理槽位的平均秒数
+
+        self.admitted = 0
+        self.rejected = {QUEUE_FULL: 0, QUEUE_TIMEOUT: 0}
+
+    def admit(self):
+        """
+        Waits for a processing slot; returns a release callable to call once the
+        request is done.
+
+        Raises:
+            Rejected: when the wait queue is full or the wait timed out.
+        """
+        with self.condition:
+            if self.in_flight >= self.max_in_flight:
+                if self.queued >= self.max_queued:
+                    raise self._reject(QUEUE_FULL, 429)
+                self.queued += 1
+                try:
+                    admitted = self.condition.wait_for(lambda: self.in_flight < self.max_in_flight, self.queue_timeout)
+                finally:
+                    self.queued -= 1
+                if not admitted:
+                    raise self._reject(QUEUE_TIMEOUT, 503)
+            self.in_flight += 1
+            self.admitted += 1
+        started = time.monotonic()
+        return lambda: self._release(started)
+
+    def retry_after(self):
+        """Seconds until the current backlog is expected to drain."""
+        backlog = self.in_flight + self.queued
+        seconds = math.ceil(self.service_time * backlog / max(self.max_in_flight, 1))
+        return min(max(seconds, 1), self.max_retry_after)
+
+    def pressure(self):
+        """Occupied share of the in-flight and queue capacity, 0.0 - 1.0."""
+        return (self.in_flight + self.queued) / max(self.max_in_flight + self.max_queued, 1)
+
+    def stats(self):
+        with self.condition:
+            return {
+                "in_flight": self.in_flight,
+                "queued": self.queued,
+                "max_in_flight": self.max_in_flight,
+                "max_queued": self.max_queued,
+                "pressure": round(self.pressure(), 3),
+                "admitted": self.admitted,
+                "rejected": dict(self.rejected),
+            }
+
+    def _reject(self, reason, status):
+        self.rejected[reason] += 1
+        return Rejected(reason, status, self.retry_after())
+
+    def _release(self, started):
+        elapsed = time.monotonic() - started
+        with self.condition:
+            self.in_flight -= 1
+            self.service_time += 0.1 * (elapsed - self.service_time)
+            self.condition.notify()
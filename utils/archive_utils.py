@@ -0,0 +1,256 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import argparse
+import glob
+import gzip
+import json
+import shutil
+import threading
+import time
+from datetime import datetime
+from utils.log_utils import logger
+from utils.json_utils import encode
+
+SEGMENT_SUFFIX = ".ndjson"
+COMPRESSED_SUFFIX = ".ndjson.gz"
+
+
+class SegmentArchive:
+    """
+    Append-only NDJSON archive made of rotating segment files.
+
+    Records are appended as one compact JSON line each to the active segment. The
+    segment is rotated once it reaches max_bytes or is older than max_age seconds.
+    Writes are flushed on every append but fsync'ed in groups: after fsync_every
+    records or fsync_interval seconds, whichever comes first. Closed segments are
+    gzip-compressed in a background thread when compress is enabled.
+
+    Appends only check these limits for the segment they write to; start() runs a
+    thread that calls tick() every fsync_interval seconds, so the last records before
+    the writer goes idle are still fsync'ed and an idle segment is still rotated.
+
+    Segments are named after the time they were opened, or numbered from sequence
+    when it is given, for readers that must order segments independently of the clock.
+
+    Args:
+        directory (str): Directory the segments are written to.
+        max_bytes (int): Rotate the active segment at this size.
+        max_age (float): Rotate the active segment after this many seconds.
+        fsync_every (int): fsync after this many unsynced records.
+        fsync_interval (float): fsync when the last fsync is older than this many seconds.
+        compress (bool): gzip closed segments.
+        name_suffix (str): Appended to segment names, e.g. "_w0" for pre-fork workers.
+        sequence (int): Number of the first segment; segments are named by opening time when None.
+    """
+
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024, max_age=3600, fsync_every=100, fsync_interval=1.0, compress=True, name_suffix="", sequence=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.compress = compress
+        self.name_suffix = name_suffix
+        self.sequence = sequence
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+
+        self.file = None
+        self.segment_name = None
+        self.segment_bytes = 0
+        self.opened_at = 0.0
+        self.unsynced = 0
+        self.synced_at = 0.0
+        self.bytes_written = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def append(self, record):
+        """Append one record and return the name of the segment it was written to."""
+        return self.append_encoded(encode(record))
+
+    def append_encoded(self, encoded):
+        """Append one record already encoded as single-line JSON bytes."""
+        line = encoded + b"\n"
+        with self.lock:
+            if self.file is None or self.segment_bytes >= self.max_bytes or time.monotonic() - self.opened_at >= self.max_age:
+                self._rotate()
+            self.file.write(line)
+            self.file.flush()
+            self.segment_bytes += len(line)
+            self.bytes_written += len(line)
+            self.unsynced += 1
+            if self.unsynced >= self.fsync_every or time.monotonic() - self.synced_at >= self.fsync_interval:
+                self._sync()
+            return self.segment_name
+
+    def sync(self):
+        with self.lock:
+            self._sync()
+
+    def start(self):
+        """Start the thread that calls tick() every fsync_interval seconds."""
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._run, name="archive-flusher", daemon=True)
+        self.thread.start()
+        return self
+
+    def tick(self):
+        """
+        fsync the active segment if it has unsynced records and the last fsync is older
+        than fsync_interval, and close it once it is older than max_age (the next append
+        opens a new segment).
+        """
+        with self.lock:
+            if self.file is None:
+                return
+            now = time.monotonic()
+            if now - self.opened_at >= self.max_age:
+                logger.info(f"Closing idle archive segment {self.segment_name}")
+                self._close_segment(background=True)
+            elif self.unsynced and now - self.synced_at >= self.fsync_interval:
+                self._sync()
+
+    def close(self):
+        """Stop the tick() thread, then fsync and close the active segment, compressing it if enabled."""
+        if self.thread is not None:
+            self.stopping.set()
+            self.thread.join()
+            self.thread = None
+        with self.lock:
+            self._close_segment(background=False)
+
+    def _run(self):
+        while not self.stopping.wait(self.fsync_interval):
+            try:
+                self.tick()
+            except Exception as e:
+                logger.error(f"Failed to flush archive segment {self.segment_name}: {e}")
+
+    def _sync(self):
+        if self.file is not None and self.unsynced:
+            os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.synced_at = time.monotonic()
+
+    def _rotate(self):
+        self._close_segment(background=True)
+        if self.sequence is None:
+            self.segment_name = datetime.now().strftime("%Y%m%d_%H%M%S_%f") + self.name_suffix + SEGMENT_SUFFIX
+        else:
+            self.segment_name = segment_name(self.sequence, self.name_suffix)
+            self.sequence += 1
+        self.file = open(os.path.join(self.directory, self.segment_name), "ab")
+        self.segment_bytes = self.file.tell()
+        self.opened_at = time.monotonic()
+        self.synced_at = self.opened_at
+        logger.info(f"Opened archive segment {self.segment_name}")
+
+    def _close_segment(self, background):
+        if self.file is None:
+            return
+        self._sync()
+        self.file.close()
+        self.file = None
+        if self.compress:
+            path = os.path.join(self.directory, self.segment_name)
+            if background:
+                threading.Thread(target=compress_segment, args=(path,), name="archive-compress", daemon=True).start()
+            else:
+                compress_segment(path)
+
+
+def segment_name(sequence, name_suffix=""):
+    """Name of the numbered segment sequence (zero-padded so names also sort in order)."""
+    return f"{sequence:012d}{name_suffix}{SEGMENT_SUFFIX}"
+
+
+def segment_sequence(name):
+    """
+    Sequence number of a numbered segment, or None for a segment named by time.
+    """
+    number = name[:-len(SEGMENT_SUFFIX)].split("_", 1)[0]
+    if len(number) < 12 or not number.isdigit():
+        return None
+    return int(number)
+
+
+def compress_segment(path):
+    """gzip a closed segment next to the original and remove the original."""
+    compressed_path = path[:-len(SEGMENT_SUFFIX)] + COMPRESSED_SUFFIX
+    if not os.path.exists(path):
+        # already compressed by the retention job
+        return
+    try:
+        with open(path, "rb") as src, gzip.open(compressed_path + ".tmp", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(compressed_path + ".tmp", compressed_path)
+        os.remove(path)
+        logger.info(f"Compressed archive segment {os.path.basename(compressed_path)}")
+    except Exception as e:
+        logger.error(f"Failed to compress archive segment {path}: {e}")
+
+
+def read_segment(path):
+    """Yield the records of a plain or gzip-compressed segment."""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def migrate_files(directory, delete=False, min_age=None, **archive_options):
+    """
+    Fold the legacy one-file-per-request *.json archive into NDJSON segments.
+
+    Files are processed in name (= receive time) order. Originals are removed only
+    when delete is True and only after the segment holding them has been fsync'ed.
+    With min_age, only files last modified more than min_age seconds ago are folded.
+
+    Returns:
+        dict: counts of migrated and failed files.
+    """
+    files = sorted(glob.glob(os.path.join(directory, "*.json")))
+    if min_age is not None:
+        cutoff = time.time() - min_age
+        files = [path for path in files if os.path.getmtime(path) < cutoff]
+    if not files:
+        return {"migrated": 0, "failed": 0}
+    archive = SegmentArchive(directory, name_suffix="_migrated", **archive_options)
+    migrated = []
+    failed = 0
+    for path in files:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"Skipping unreadable archive file {path}: {e}")
+            failed += 1
+            continue
+        archive.append(record)
+        migrated.append(path)
+    archive.close()
+
+    if delete:
+        for path in migrated:
+            os.remove(path)
+    logger.info(f"Migrated {len(migrated)} files into segments ({failed} failed)")
+    return {"migrated": len(migrated), "failed": failed}
+
+
+if __name__ == "__main__":
+    from config import SAVE_DIR
+
+    parser = argparse.ArgumentParser(description="Archive maintenance")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate = subparsers.add_parser("migrate", help="把旧的单请求 JSON 文件合并为 NDJSON 段文件")
+    migrate.add_argument("--dir", default=SAVE_DIR, help="归档目录")
+    migrate.add_argument("--delete", action="store_true", help="迁移成功后删除原始文件")
+    migrate.add_argument("--no-compress", action="store_true", help="不压缩生成的段文件")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        print(json.dumps(migrate_files(args.dir, delete=args.delete, compress=not args.no_compress)))
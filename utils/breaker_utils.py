@@ -0,0 +1,162 @@
+import threading
+import time
+from utils.log_utils import logger
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the protected service while the circuit is open."""
+
+
+class CircuitBreaker:
+    """
+    Closed / open / half-open circuit breaker.
+
+    closed:    calls go through; failure_threshold consecutive failures open the circuit.
+    open:      calls fail immediately with CircuitOpenError. The background probe (or,
+               without a probe, the reset_timeout) moves the circuit to half-open.
+    half_open: a single trial call at a time is let through; success closes the
+               circuit, failure opens it again.
+
+    Args:
+        name (str): Used in log messages.
+        failure_threshold (int): Consecutive failures that open the circuit.
+        reset_timeout (float): Seconds before an open circuit without probe allows a trial call.
+        probe (callable, optional): Health check run every probe_interval seconds while open;
+            a truthy result moves the circuit to half-open.
+        probe_interval (float): Seconds between probes.
+        on_state_change (callable, optional): Called as on_state_change(new_state).
+        clock (callable): Monotonic time source, replaceable for tests.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30, probe=None, probe_interval=5, on_state_change=None,
+                 clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe = probe
+        self.probe_interval = probe_interval
+        self.on_state_change = on_state_change
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.rejected = 0
+        self.probe_stop = threading.Event()
+        self.probe_thread = None
+
+    def allow(self):
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and self.probe is None and self.clock() - self.opened_at >= self.reset_timeout:
+                self._transition(HALF_OPEN)
+            if self.state == HALF_OPEN and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.trial_in_flight = False
+            if self.state != CLOSED:
+                self._transition(CLOSED)
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self._open()
+
+    def trip(self):
+        """Open the circuit immediately, e.g. when the service is down at startup."""
+        with self.lock:
+            if self.state != OPEN:
+                self._open()
+
+    def call(self, func, *args, is_failure=None, **kwargs):
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} circuit is open")
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            if is_failure is None or is_failure(e):
+                self.record_failure()
+            else:
+                self.record_success()
+            raise
+        self.record_success()
+        return result
+
+    async def call_async(self, func, *args, is_failure=None, **kwargs):
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} circuit is open")
+        try:
+            result = await func(*args, **kwargs)
+        except Exception as e:
+            if is_failure is None or is_failure(e):
+                self.record_failure()
+            else:
+                self.record_success()
+            raise
+        self.record_success()
+        return result
+
+    def start_probe(self):
+        if self.probe is None or self.probe_thread is not None:
+            return
+        self.probe_stop.clear()
+        self.probe_thread = threading.Thread(target=self._probe_loop, name=f"{self.name}-probe", daemon=True)
+        self.probe_thread.start()
+
+    def stop_probe(self):
+        if self.probe_thread is None:
+            return
+        self.probe_stop.set()
+        self.probe_thread.join(5)
+        self.probe_thread = None
+
+    def stats(self):
+        return {"state": self.state, "consecutive_failures": self.failures, "rejected": self.rejected}
+
+    def _probe_loop(self):
+        while not self.probe_stop.wait(self.probe_interval):
+            self._probe_once()
+
+    def _probe_once(self):
+        if self.state != OPEN:
+            return
+        try:
+            healthy = self.probe()
+        except Exception as e:
+            logger.debug(f"{self.name} probe failed: {e}")
+            healthy = False
+        if healthy:
+            with self.lock:
+                if self.state == OPEN:
+                    self._transition(HALF_OPEN)
+
+    def _open(self):
+        self.opened_at = self.clock()
+        self._transition(OPEN)
+
+    def _transition(self, state):
+        # called with self.lock held
+        previous, self.state = self.state, state
+        if state == OPEN:
+            logger.warning(f"{self.name} circuit opened after {self.failures} consecutive failures (was {previous})")
+        else:
+            logger.info(f"{self.name} circuit {previous} -> {state}")
+        if self.on_state_change:
+            try:
+                self.on_state_change(state)
+            except Exception as e:
+                logger.error(f"{self.name} circuit state callback failed: {e}")
@@ -0,0 +1,82 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Thread-safe cache whose entries expire after ttl seconds, evicting the least
+    recently used entry once max_entries are stored.
+
+    invalidate() drops every entry when new data becomes visible. get_or_load()
+    does not store a value whose load started before the last invalidation, so a
+    slow query cannot put a stale result back into the cache.
+
+    Args:
+        max_entries (int): Maximum number of cached entries.
+        ttl (float): Seconds an entry stays valid.
+        clock (callable): Monotonic time source, replaceable for tests.
+    """
+
+    def __init__(self, max_entries=1024, ttl=30.0, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (expires at, value)
+        self.generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """Returns the cached value, or None when missing or expired."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > self.clock():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value, generation=None):
+        """Stores value; ignored when generation is given and the cache was invalidated since."""
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            self.entries[key] = (self.clock() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key, loader):
+        """Returns the cached value for key, calling loader() on a miss. Exceptions are not cached."""
+        value = self.get(key)
+        if value is not None:
+            return value
+        generation = self.generation
+        value = loader()
+        self.set(key, value, generation)
+        return value
+
+    def invalidate(self):
+        with self.lock:
+            self.entries.clear()
+            self.generation += 1
+            self.invalidations += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,68 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+# 决定一条记录身份的字段：扩展重试时这些字段不变
+CONTENT_FIELDS = ("sessionId", "responseId", "file", "timestamp")
+
+# 必须全部存在才认为记录可以识别：只有 file、timestamp 相同的不同记录很常见
+REQUIRED_FIELDS = ("sessionId", "responseId")
+
+
+def content_digest(record, fields=CONTENT_FIELDS, required=REQUIRED_FIELDS):
+    """
+    SHA-1 digest of the identity fields of record, or None when one of the required
+    fields is missing (such records are neither deduplicated nor given a derived id).
+    """
+    if any(record.get(field) is None for field in required):
+        return None
+    values = [record.get(field) for field in fields]
+    raw = "\x1f".join("" if value is None else str(value) for value in values)
+    return hashlib.sha1(raw.encode("utf-8")).digest()
+
+
+def content_id(record, fields=CONTENT_FIELDS, required=REQUIRED_FIELDS):
+    """Deterministic document id derived from the identity fields, or None."""
+    digest = content_digest(record, fields, required)
+    return digest.hex() if digest is not None else None
+
+
+class DuplicateFilter:
+    """
+    Bounded window of recently accepted record keys, used to drop retried or
+    duplicated records before they are written anywhere.
+
+    The window is an exact LRU (no false positives, unlike a Bloom filter, so a new
+    record is never dropped); the oldest key is forgotten once max_entries keys are
+    held. Keys are 20-byte digests, about 100 bytes per entry including the dict slot.
+
+    Args:
+        max_entries (int): Number of keys remembered.
+    """
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.keys = OrderedDict()
+        self.duplicates = 0
+
+    def claim(self, key):
+        """Returns True the first time key is seen within the window, False for duplicates."""
+        with self.lock:
+            if key in self.keys:
+                self.keys.move_to_end(key)
+                self.duplicates += 1
+                return False
+            self.keys[key] = None
+            if len(self.keys) > self.max_entries:
+                self.keys.popitem(last=False)
+            return True
+
+    def release(self, key):
+        """Forgets key, so that a retry of a record that failed to store is accepted again."""
+        with self.lock:
+            self.keys.pop(key, None)
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.keys), "duplicates": self.duplicates}
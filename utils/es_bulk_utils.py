@@ -0,0 +1,203 @@
+import queue
+import threading
+import time
+from collections import OrderedDict
+from utils.log_utils import logger
+from utils.json_utils import encode
+import utils.time_utils as time_utils
+
+_STOP = object()
+
+# 可重试的 _bulk 文档错误：集群暂时过载或分片不可用；映射冲突等错误重试也不会成功
+RETRYABLE_ERRORS = {
+    "es_rejected_execution_exception",
+    "circuit_breaking_exception",
+    "unavailable_shards_exception",
+    "cluster_block_exception",
+    "timeout_exception",
+}
+
+
+def is_retryable(error):
+    """Whole-request failures (reported as a message) and transient document errors are retried."""
+    if isinstance(error, dict):
+        return error.get("type") in RETRYABLE_ERRORS
+    return True
+
+
+class BulkWriter:
+    """
+    Background bulk-indexing stage in front of ElasticsearchManager.
+
+    Request handlers call submit(), which only puts the document on a bounded
+    in-memory queue. A daemon thread drains the queue and flushes the pending
+    batch with a single _bulk request once it reaches max_docs documents,
+    max_bytes of serialized source, or max_age seconds since the first pending
+    document. Repeated writes to the same (index, id) inside one batch are
+    coalesced into one partial update, so only the merged document is sent.
+
+    Documents that fail with a transient error (the whole request failed, or the
+    cluster rejected the document) are put back into the next batch, up to
+    max_retries times; the others are reported to on_error.
+
+    Args:
+        es_manager (ElasticsearchManager): Manager used for the _bulk requests.
+        max_docs (int): Flush when this many distinct documents are pending.
+        max_bytes (int): Flush when the pending documents exceed this many bytes.
+        max_age (float): Flush when the oldest pending document is this many seconds old.
+        queue_size (int): Capacity of the submission queue; submit() fails fast when full.
+        max_retries (int): How many more batches a document failing with a transient error joins.
+        on_error (callable, optional): Called as on_error(index_name, doc, error) for every
+            document that could not be indexed.
+        on_flush (callable, optional): Called with no arguments after a flush indexed at
+            least one document, e.g. to invalidate caches of query results.
+    """
+
+    def __init__(self, es_manager, max_docs=500, max_bytes=5 * 1024 * 1024, max_age=1.0, queue_size=10000, max_retries=3, on_error=None, on_flush=None):
+        self.es_manager = es_manager
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.max_retries = max_retries
+        self.on_error = on_error
+        self.on_flush = on_flush
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = None
+        self.attempts = {}  # key of a document being retried -> failed attempts
+
+        self.indexed = 0
+        self.failed = 0
+        self.retried = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.flushes = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="es-bulk-writer", daemon=True)
+        self.thread.start()
+        logger.info(f"Bulk writer started (max_docs={self.max_docs}, max_bytes={self.max_bytes}, max_age={self.max_age}s)")
+        return self
+
+    def submit(self, index_name, doc):
+        """Queue a document for indexing. Returns False if the queue is full."""
+        doc['last_updated_at'] = time_utils.current_iso8601_time()
+        try:
+            self.queue.put_nowait((index_name, doc))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            logger.warning(f"Bulk queue full, document {doc.get(self.es_manager.primary_key)} not queued for [{index_name}]")
+            return False
+
+    def close(self, timeout=30):
+        """Flush everything still queued and stop the writer thread."""
+        if self.thread is None:
+            return
+        self.queue.put(_STOP)
+        self.thread.join(timeout)
+        self.thread = None
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize(),
+            "indexed": self.indexed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+            "flushes": self.flushes,
+        }
+
+    def _run(self):
+        pending = OrderedDict()
+        pending_bytes = 0
+        first_at = None
+
+        while True:
+            timeout = None if first_at is None else max(0.0, first_at + self.max_age - time.monotonic())
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                self._flush(pending, final=True)
+                return
+
+            if item is not None:
+                index_name, doc = item
+                doc_id = doc.get(self.es_manager.primary_key)
+                key = (index_name, doc_id if doc_id is not None else id(doc))
+                if key in pending:
+                    # 同一文档的多次写入合并为一次部分更新
+                    pending[key][1].update(doc)
+                    self.coalesced += 1
+                else:
+                    pending[key] = (index_name, doc)
+                pending_bytes += len(self._source(doc))
+                if first_at is None:
+                    first_at = time.monotonic()
+
+            if pending and (
+                item is None
+                or len(pending) >= self.max_docs
+                or pending_bytes >= self.max_bytes
+                or time.monotonic() - first_at >= self.max_age
+            ):
+                # 暂时失败的文档留在下一个批次中，等待一个 max_age 周期后重试
+                pending = self._flush(pending)
+                pending_bytes = sum(len(self._source(doc)) for _, doc in pending.values())
+                first_at = time.monotonic() if pending else None
+
+    def _source(self, doc):
+        # 记录携带的编码就是 _bulk 发送的字节，直接计入批次大小；普通 dict 才需要序列化
+        source = getattr(doc, "encoded", None)
+        return source if source is not None else encode(doc)
+
+    def _flush(self, pending, final=False):
+        """Writes the pending documents; returns those to retry with the next batch."""
+        retry = OrderedDict()
+        if not pending:
+            return retry
+        documents = list(pending.values())
+        self.flushes += 1
+        try:
+            errors = self.es_manager.bulk_write(documents)
+            for index_name, doc_id, error in errors:
+                logger.error(f"Failed to index document {doc_id} into [{index_name}]: {error}")
+        except Exception as e:
+            logger.error(f"Bulk request with {len(documents)} documents failed: {e}")
+            errors = [(index_name, doc.get(self.es_manager.primary_key), str(e)) for index_name, doc in documents]
+
+        failed = {(index_name, doc_id): error for index_name, doc_id, error in errors}
+        self.indexed += len(documents) - len(errors)
+        logger.debug(f"Bulk flushed {len(documents)} documents, {len(errors)} failed")
+
+        if self.on_flush and len(errors) < len(documents):
+            try:
+                self.on_flush()
+            except Exception as e:
+                logger.error(f"Bulk flush callback failed: {e}")
+
+        for key, (index_name, doc) in pending.items():
+            error = failed.get((index_name, doc.get(self.es_manager.primary_key)))
+            attempts = self.attempts.pop(key, 0) + 1
+            if error is not None and not final and attempts <= self.max_retries and is_retryable(error):
+                retry[key] = (index_name, doc)
+                self.attempts[key] = attempts
+                self.retried += 1
+                continue
+            if error is not None:
+                self.failed += 1
+                if self.on_error:
+                    try:
+                        self.on_error(index_name, doc, error)
+                    except Exception as e:
+                        logger.error(f"Bulk error callback failed: {e}")
+            # 文档已经写出（或交给 on_error），记录不再需要携带编码
+            release = getattr(doc, "release", None)
+            if release is not None:
+                release()
+        if retry:
+            logger.warning(f"Retrying {len(retry)} documents with the next bulk request")
+        return retry
@@ -2,26 +2,114 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from elasticsearch import Elasticsearch, NotFoundError
+from elasticsearch import Elasticsearch, AsyncElasticsearch, NotFoundError, ConflictError
 from utils.log_utils import logger
+from utils.breaker_utils import CircuitBreaker
+from utils.metrics_utils import timed, es_request_duration, es_errors_total
+from utils.storage_utils import StorageBackend, apply_update_condition
+from utils.partition_utils import (
+    PARTITION_FORMATS, PartitionView, document_label, index_template, parse_partition_name, partition_label,
+    partition_name, range_start, write_alias
+)
+from utils.cache_utils import TTLCache
 import utils.time_utils as time_utils
+import inspect
+import queue
+import threading
 import time
 import json
     
 
+# write_to_es modes:
+#   read_modify_write - get, then update or index (2 round trips, 3 for new documents)
+#   upsert            - update with doc_as_upsert (1 round trip)
+#   create            - op_type=create, update only on conflict (1 round trip for new documents)
+WRITE_MODES = ("read_modify_write", "upsert", "create")
 
-class ElasticsearchManager:
+# Painless version of apply_update_condition, so the preserve-fields check runs inside ES
+PRESERVE_FIELDS_SCRIPT = """
+boolean preserve = true;
+for (entry in params.condition.entrySet()) {
+  if (!ctx._source.containsKey(entry.getKey()) || ctx._source[entry.getKey()] != entry.getValue()) {
+    preserve = false;
+    break;
+  }
+}
+for (entry in params.doc.entrySet()) {
+  if (preserve && params.condition.containsKey(entry.getKey())) {
+    continue;
+  }
+  ctx._source[entry.getKey()] = entry.getValue();
+}
+"""
 
-    def __init__(self, url=None, primary_key="id", user=None, password=None, connect_timeout=60, request_timeout=60):
+
+# scan(): end of one slice's pages
+_SLICE_DONE = object()
+
+# bulk_increment: add the counter fields to the existing document
+INCREMENT_SCRIPT = """
+for (field in params.fields) {
+  def current = ctx._source[field];
+  ctx._source[field] = (current == null ? 0 : current) + params.doc[field];
+}
+ctx._source.last_updated_at = params.doc.last_updated_at;
+"""
+
+
+def preserve_fields_script(data, update_condition):
+    return {
+        "source": PRESERVE_FIELDS_SCRIPT,
+        "lang": "painless",
+        "params": {"doc": data, "condition": update_condition},
+    }
+
+
+class ElasticsearchManager(StorageBackend):
+    """
+    Elasticsearch storage backend.
+
+    Indexes listed in partitions are time-partitioned: check_and_create_indexes installs
+    an index template generated from the mapping file and a first partition, writes go
+    through the write alias "<index>-write", and reads through the read alias "<index>"
+    that the template adds to every partition. rollover() moves the write alias to a new
+    partition when the day / month changes or rollover_conditions are met. Searches with
+    a lower bound on partition_field skip partitions closed before that bound.
+
+    Args:
+        partitions (dict, optional): index name -> partition interval ("day" or "month").
+        rollover_conditions (dict, optional): ES rollover conditions applied within one
+            interval, e.g. {"max_primary_shard_size": "30gb"}.
+        partition_field (str): Date field that time-range queries filter on.
+        partition_skew (float): Seconds a document timestamp may be ahead of its write time.
+        view_ttl (float): Seconds the list of partitions is cached.
+    """
+
+    def __init__(self, url=None, primary_key="id", user=None, password=None, connect_timeout=60, request_timeout=60, write_mode="upsert",
+                 partitions=None, rollover_conditions=None, partition_field="timestamp", partition_skew=300, view_ttl=60):
 
         if url is None:
             url = os.environ.get('ELASTICSEARCH_URL', "http://localhost:9200")
+        if write_mode not in WRITE_MODES:
+            raise ValueError(f"Unknown write mode: {write_mode}")
+        for interval in (partitions or {}).values():
+            if interval not in PARTITION_FORMATS:
+                raise ValueError(f"Unknown partition interval: {interval}")
 
         self.url = url
         self.primary_key = primary_key
         self.user = user
         self.password = password
         self.request_timeout = request_timeout
+        self.write_mode = write_mode
+        # number of ES requests issued by write_to_es, for benchmarking write modes
+        self.round_trips = 0
+
+        self.partitions = dict(partitions or {})
+        self.rollover_conditions = rollover_conditions or {}
+        self.partition_field = partition_field
+        self.partition_skew = partition_skew
+        self.partition_views = TTLCache(max_entries=64, ttl=view_ttl)
 
         try:
             # 尝试创建较新版本的Elasticsearch客户端
@@ -64,6 +152,8 @@ class ElasticsearchManager:
                     request_timeout=request_timeout,
                 )
 
+    def ping(self):
+        return self.es.ping()
 
     def check_and_create_indexes(self, indexes={}):
 
@@ -88,45 +178,294 @@ class ElasticsearchManager:
                 time.sleep(1)  # Reduce wait time to 1 second
 
         for index_name, mapping_file in indexes.items():
+            if index_name in self.partitions:
+                self._create_partitioned_index(index_name, mapping_file)
+                continue
             if not self.es.indices.exists(index=index_name):
                 with open(mapping_file, 'r') as f:
                     mapping = json.load(f)
-                self.es.indices.create(index=index_name, body=mapping)
-                logger.info(f"created index: {index_name}")
+                try:
+                    self.es.indices.create(index=index_name, body=mapping)
+                    logger.info(f"created index: {index_name}")
+                except Exception as e:
+                    # another worker process created the index in the meantime
+                    if 'resource_already_exists_exception' not in str(e):
+                        raise
+                    logger.info(f"index already exists: {index_name}")
             else:
                 logger.info(f"index already exists: {index_name}")
 
-    def write_to_es(self, index_name, data, update_condition=None):
+    def _create_partitioned_index(self, index_name, mapping_file):
+        if self.es.indices.exists(index=index_name) and not self.es.indices.exists_alias(name=index_name):
+            # an unpartitioned index created by an older version holds the read alias name
+            logger.warning(f"index {index_name} is not partitioned, writing to it directly until it is reindexed into partitions")
+            self.partitions.pop(index_name, None)
+            return
+
+        with open(mapping_file, 'r') as f:
+            mapping = json.load(f)
+        template = index_template(index_name, mapping)
+        try:
+            self.es.indices.put_index_template(name=index_name, **template)
+        except TypeError:
+            # Fallback for older Elasticsearch clients
+            self.es.indices.put_index_template(name=index_name, body=template)
+        logger.info(f"installed index template: {index_name} ({template['index_patterns'][0]})")
+
+        alias = write_alias(index_name)
+        if self.es.indices.exists_alias(name=alias):
+            logger.info(f"write alias already exists: {alias}")
+            return
+        first = partition_name(index_name, partition_label(time.time(), self.partitions[index_name]), 1)
+        try:
+            self.es.indices.create(index=first, body={"aliases": {alias: {}}})
+            logger.info(f"created partition: {first} (write alias {alias})")
+        except Exception as e:
+            # another worker process created the partition in the meantime
+            if 'resource_already_exists_exception' not in str(e):
+                raise
+            logger.info(f"partition already exists: {first}")
+        self.partition_views.invalidate()
+
+    def partition_view(self, index_name):
+        """PartitionView of a partitioned index, cached for view_ttl seconds and refreshed after rollovers."""
+        return self.partition_views.get_or_load(index_name, lambda: PartitionView(index_name, dict(self.es.indices.get(index=index_name))))
+
+    @timed(es_request_duration, "rollover", errors=es_errors_total)
+    def rollover(self, index_name):
+        """
+        Moves the write alias of a partitioned index to a new partition when the current
+        partition belongs to an earlier day / month, or when rollover_conditions are met.
+
+        The new partition name follows from the current one, so when several workers roll
+        over at the same time only one creates it and the others see it already exists.
+
+        Returns:
+            str: The new write index, or None when nothing rolled over.
+        """
+        interval = self.partitions.get(index_name)
+        if interval is None:
+            return None
+        self.partition_views.invalidate()
+        view = self.partition_view(index_name)
+        if view.write_index is None:
+            return None
+        label, generation = parse_partition_name(index_name, view.write_index)
+        current = partition_label(time.time(), interval)
+        request = {"alias": write_alias(index_name), "new_index": partition_name(index_name, current, generation + 1)}
+        if label == current:
+            if not self.rollover_conditions:
+                return None
+            request["conditions"] = self.rollover_conditions
+
+        try:
+            result = self.es.indices.rollover(**request)
+        except Exception as e:
+            if 'resource_already_exists_exception' not in str(e):
+                raise
+            logger.info(f"{index_name} was already rolled over to {request['new_index']}")
+            return None
+        finally:
+            self.partition_views.invalidate()
+        if not result.get('rolled_over'):
+            return None
+        logger.info(f"Rolled {index_name} over from {result.get('old_index')} to {request['new_index']}")
+        return request['new_index']
+
+    def _write_index(self, index_name, data=None):
+        """
+        Index a document is written to. A document of a partitioned index goes to the last
+        partition of the day / month of its partition_field, so a retried record finds the
+        first copy by id even when the write alias has moved on in between; documents
+        without a timestamp, or whose day / month has no partition, use the write alias.
+        Ids are therefore unique per partition: a retry only creates a second copy when a
+        rollover_conditions rollover within the same day / month happened in between.
+        """
+        if index_name not in self.partitions:
+            return index_name
+        label = document_label(data, self.partition_field, self.partitions[index_name]) if data is not None else None
+        if label is not None:
+            try:
+                partition = self.partition_view(index_name).partition_for(label)
+            except Exception as e:
+                logger.warning(f"Failed to list partitions of {index_name}, writing through the write alias: {e}")
+                partition = None
+            if partition is not None:
+                return partition
+        return write_alias(index_name)
+
+    def _search_index(self, index_name, query):
+        """
+        Index expression and search options for a query on index_name: for a partitioned
+        index with a lower time bound, the partitions that can match plus the write alias
+        (which covers a partition created after the cached view).
+        """
+        if index_name not in self.partitions:
+            return index_name, {}
+        since = range_start(query, self.partition_field)
+        if since is None:
+            return index_name, {}
+        try:
+            view = self.partition_view(index_name)
+        except Exception as e:
+            logger.warning(f"Failed to list partitions of {index_name}, searching all of them: {e}")
+            return index_name, {}
+        targets = view.search_targets(since - self.partition_skew * 1000) + [write_alias(index_name)]
+        # a partition deleted since the view was cached is skipped instead of failing the search
+        return ",".join(targets), {"ignore_unavailable": True}
+
+    @timed(es_request_duration, "write", errors=es_errors_total)
+    def write_to_es(self, index_name, data, update_condition=None, mode=None):
+        """
+        Writes one document, merging it into an existing document with the same id.
+
+        Args:
+            index_name (str): Target index.
+            data (dict): Document source; must contain the primary key.
+            update_condition (dict, optional): If every field/value pair matches the existing
+                document, the fields listed here keep their existing values.
+            mode (str, optional): One of WRITE_MODES. Defaults to the manager's write_mode.
+                The single-round-trip modes evaluate update_condition in a scripted upsert
+                instead of reading the document first.
+        """
+        mode = mode or self.write_mode
         last_updated_at = time_utils.current_iso8601_time()
         data['last_updated_at'] = last_updated_at
         doc_id = data.get(self.primary_key)
-        logger.debug(f"Writing data to Elasticsearch index: {index_name}")
+        index_name = self._write_index(index_name, data)
+        logger.debug(f"Writing data to Elasticsearch index: {index_name} (mode={mode})")
+
+        if mode == "read_modify_write":
+            self._read_modify_write(index_name, doc_id, data, update_condition)
+        elif update_condition:
+            self.round_trips += 1
+            self.es.update(index=index_name, id=doc_id, script=preserve_fields_script(data, update_condition), upsert=data)
+            logger.debug(f'[scripted upsert] to [{index_name}]: {data}')
+        elif mode == "create":
+            try:
+                self.round_trips += 1
+                self.es.create(index=index_name, id=doc_id, document=data)
+                logger.debug(f'[created] to [{index_name}]: {data}')
+            except ConflictError:
+                self.round_trips += 1
+                self.es.update(index=index_name, id=doc_id, doc=data)
+                logger.debug(f'[updated] to [{index_name}]: {data}')
+        else:
+            self.round_trips += 1
+            self.es.update(index=index_name, id=doc_id, doc=data, doc_as_upsert=True)
+            logger.debug(f'[upserted] to [{index_name}]: {data}')
+
+    def _read_modify_write(self, index_name, doc_id, data, update_condition):
         try:
             # Get existing document
+            self.round_trips += 1
             existing_doc = self.es.get(index=index_name, id=doc_id)
 
             # Check update condition if provided
             if update_condition:
-                should_preserve_fields = True
-                for field, value in update_condition.items():
-                    if field not in existing_doc['_source'] or existing_doc['_source'][field] != value:
-                        should_preserve_fields = False
-                        break
-
-                if should_preserve_fields:
-                    # Preserve fields listed in update_condition by copying their values from existing document
-                    for field in update_condition.keys():
-                        if field in existing_doc['_source']:
-                            data[field] = existing_doc['_source'][field]
-                    logger.info(f'[partial update] to [{index_name}]: {doc_id} - preserving fields: {list(update_condition.keys())}')
+                apply_update_condition(index_name, doc_id, existing_doc['_source'], data, update_condition)
 
             # Always update document, possibly with some preserved fields
+            self.round_trips += 1
             self.es.update(index=index_name, id=doc_id, doc=data)
             logger.debug(f'[updated] to [{index_name}]: {data}')
         except NotFoundError:
+            self.round_trips += 1
             self.es.index(index=index_name, id=doc_id, document=data)
             logger.info(f'[created] to [{index_name}]: {data}') 
 
+    def bulk_write(self, documents):
+        """
+        Writes many documents with a single _bulk request.
+
+        Follows write_mode like write_to_es: "create" sends create actions and re-sends only
+        the conflicting documents as partial updates; the other modes send every document as
+        a partial update with doc_as_upsert. Existing documents are merged, missing ones created.
+
+        Args:
+            documents (list): (index_name, data) tuples; data must contain the primary key.
+
+        Returns:
+            list: (index_name, doc_id, error) for every document that failed.
+        """
+        if self.write_mode == "create":
+            errors, conflicts = self._bulk(documents, "create")
+            if conflicts:
+                errors.extend(self._bulk(conflicts, "update")[0])
+            return errors
+        return self._bulk(documents, "update")[0]
+
+    @timed(es_request_duration, "bulk", errors=es_errors_total)
+    def _bulk(self, documents, action):
+        operations = []
+        for index_name, data in documents:
+            operations.append({action: {"_index": self._write_index(index_name, data), "_id": data.get(self.primary_key)}})
+            # documents received as JSON keep their encoding, which the client sends as is
+            source = getattr(data, "encoded", None)
+            if action == "update":
+                operations.append({"doc": data, "doc_as_upsert": True} if source is None else b'{"doc":' + source + b',"doc_as_upsert":true}')
+            else:
+                operations.append(data if source is None else source)
+
+        self.round_trips += 1
+        try:
+            result = self.es.bulk(operations=operations)
+        except TypeError:
+            # Fallback for older Elasticsearch clients
+            result = self.es.bulk(body=operations)
+
+        errors = []
+        conflicts = []
+        if result.get('errors'):
+            # bulk response items are in the same order as the operations
+            for (index_name, data), item in zip(documents, result.get('items', [])):
+                outcome = next(iter(item.values()))
+                if 'error' not in outcome:
+                    continue
+                if action == "create" and outcome.get('status') == 409:
+                    conflicts.append((index_name, data))
+                else:
+                    errors.append((index_name, data.get(self.primary_key), outcome['error']))
+        return errors, conflicts
+
+    @timed(es_request_duration, "bulk", errors=es_errors_total)
+    def bulk_increment(self, documents, fields):
+        """
+        Upserts documents with a single _bulk request, adding the values of fields to an
+        existing document with a scripted upsert instead of overwriting them.
+
+        Args:
+            documents (list): (index_name, data) tuples; data must contain the primary key.
+            fields (list): Numeric fields to add up, e.g. ["added", "removed", "count"].
+
+        Returns:
+            list: (index_name, doc_id, error) for every document that failed.
+        """
+        operations = []
+        for index_name, data in documents:
+            # several workers increment the same rollup documents concurrently
+            operations.append({"update": {"_index": self._write_index(index_name, data), "_id": data.get(self.primary_key), "retry_on_conflict": 5}})
+            operations.append({
+                "script": {"source": INCREMENT_SCRIPT, "lang": "painless", "params": {"fields": list(fields), "doc": data}},
+                "upsert": data,
+            })
+
+        self.round_trips += 1
+        try:
+            result = self.es.bulk(operations=operations)
+        except TypeError:
+            # Fallback for older Elasticsearch clients
+            result = self.es.bulk(body=operations)
+
+        errors = []
+        if result.get('errors'):
+            for (index_name, data), item in zip(documents, result.get('items', [])):
+                outcome = next(iter(item.values()))
+                if 'error' in outcome:
+                    errors.append((index_name, data.get(self.primary_key), outcome['error']))
+        return errors
+
+    @timed(es_request_duration, "search", errors=es_errors_total)
     def query_from_es(self, index_name, query, fields=None, sort=None, size=10000):
         """
         Executes a search query on the specified Elasticsearch index and returns the results.
@@ -160,8 +499,9 @@ class ElasticsearchManager:
             body["_source"] = fields
         if sort:
             body["sort"] = sort
+        index, options = self._search_index(index_name, query)
         try:
-            results = self.es.search(index=index_name, body=body, size=size)
+            results = self.es.search(index=index, body=body, size=size, **options)
             hits = results.get('hits', {}).get('hits', [])
             return [hit['_source'] for hit in hits]
         except NotFoundError:
@@ -172,6 +512,112 @@ class ElasticsearchManager:
             return []
     
 
+    def scan(self, index_name, query=None, fields=None, sort=None, page_size=1000, slices=None, keep_alive="1m"):
+        """
+        Yields the _source of every document matching the query, using a point in time
+        and search_after instead of one size-limited search. Requires Elasticsearch 7.10+.
+
+        Args:
+            index_name (str): The name of the Elasticsearch index to scan.
+            query (dict, optional): The Elasticsearch query DSL. Defaults to match_all.
+            fields (list, optional): _source fields to return. Defaults to all fields.
+            sort (list, optional): Sort conditions; defaults to index order (_shard_doc),
+                the cheapest order for exports.
+            page_size (int): Documents fetched per search request.
+            slices (int, optional): Scan this many slices of the point in time in parallel
+                threads. Documents are then yielded in no particular order.
+            keep_alive (str): How long the point in time is kept between two pages.
+
+        Example:
+            for doc in es.scan("linechanges", {"term": {"model": "gpt-4o"}}, fields=["id", "added"], slices=4):
+                writer.write(doc)
+        """
+        index, options = self._search_index(index_name, query)
+        pit_id = self.es.open_point_in_time(index=index, keep_alive=keep_alive, **options)['id']
+        try:
+            args = (pit_id, query, fields, sort, page_size, keep_alive)
+            if slices and slices > 1:
+                yield from self._scan_slices(args, slices)
+            else:
+                for page in self._scan_pages(*args):
+                    yield from page
+        finally:
+            try:
+                self.es.close_point_in_time(id=pit_id)
+            except Exception as e:
+                logger.warning(f"Failed to close point in time for '{index_name}': {e}")
+
+    def _scan_pages(self, pit_id, query, fields, sort, page_size, keep_alive, slice=None):
+        search_after = None
+        while True:
+            pit_id, hits = self._scan_page(pit_id, query, fields, sort, page_size, keep_alive, search_after, slice)
+            if not hits:
+                return
+            yield [hit['_source'] for hit in hits]
+            if len(hits) < page_size:
+                return
+            search_after = hits[-1]['sort']
+
+    @timed(es_request_duration, "scan", errors=es_errors_total)
+    def _scan_page(self, pit_id, query, fields, sort, page_size, keep_alive, search_after, slice):
+        kwargs = {
+            "query": query or {"match_all": {}},
+            "size": page_size,
+            "sort": sort or ["_shard_doc"],
+            "pit": {"id": pit_id, "keep_alive": keep_alive},
+            "track_total_hits": False,
+        }
+        if fields:
+            kwargs["source"] = fields
+        if search_after:
+            kwargs["search_after"] = search_after
+        if slice:
+            kwargs["slice"] = slice
+        result = self.es.search(**kwargs)
+        # the point in time id may change between pages
+        return result.get('pit_id', pit_id), result['hits']['hits']
+
+    def _scan_slices(self, args, slices):
+        # at most two pages per slice wait in the queue, the threads block until the caller catches up
+        pages = queue.Queue(maxsize=slices * 2)
+        stopping = threading.Event()
+
+        def put(item):
+            while not stopping.is_set():
+                try:
+                    pages.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def run(slice_id):
+            try:
+                for page in self._scan_pages(*args, slice={"id": slice_id, "max": slices}):
+                    if not put(page):
+                        return
+                put(_SLICE_DONE)
+            except Exception as e:
+                put(e)
+
+        threads = [threading.Thread(target=run, args=(i,), name=f"es-scan-{i}", daemon=True) for i in range(slices)]
+        for thread in threads:
+            thread.start()
+        try:
+            remaining = slices
+            while remaining:
+                item = pages.get()
+                if item is _SLICE_DONE:
+                    remaining -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield from item
+        finally:
+            stopping.set()
+            for thread in threads:
+                thread.join()
+
     def delete_indexes(self, index_names):
         if isinstance(index_names, str):
             index_names = [index_names]
@@ -185,6 +631,95 @@ class ElasticsearchManager:
             except Exception as e:
                 logger.error(f"Error deleting index '{index_name}': {e}")
     
+    def expire_partitions(self, index_name, before):
+        """
+        Deletes the partitions of a partitioned index that only hold documents older than
+        before (epoch ms): a partition stopped receiving writes when the next one was
+        created, so its timestamps are at most that time plus partition_skew. The write
+        index is never deleted.
+
+        Returns:
+            list: Names of the deleted partitions.
+        """
+        if index_name not in self.partitions:
+            return []
+        self.partition_views.invalidate()
+        view = self.partition_view(index_name)
+        expired = [name for name, _, _, closed in view.partitions
+                   if closed is not None and closed + self.partition_skew * 1000 < before and name != view.write_index]
+        dropped = []
+        for name in expired:
+            try:
+                self.es.indices.delete(index=name)
+            except NotFoundError:
+                continue
+            logger.info(f"Deleted expired partition {name} of {index_name}")
+            dropped.append(name)
+        self.partition_views.invalidate()
+        return dropped
+
+    def expire_documents(self, index_name, field, before, requests_per_second=None, poll_interval=10, timeout=None):
+        """
+        Deletes the documents of index_name whose field is older than before (epoch ms).
+
+        Whole partitions are dropped first (see expire_partitions). The remaining documents
+        are removed by a delete_by_query that runs as a background task in ES, split into
+        slices and throttled to requests_per_second documents per second, so the cleanup
+        neither holds an HTTP request open nor competes with ingest for the whole cluster.
+        The task is polled every poll_interval seconds and its progress is logged; after
+        timeout seconds polling stops and the task keeps running in ES.
+
+        Returns:
+            dict: {"dropped_indexes": [...], "deleted": n, "task": task id or None}
+        """
+        result = {"dropped_indexes": self.expire_partitions(index_name, before), "deleted": 0, "task": None}
+        if not self.es.indices.exists(index=index_name):
+            return result
+
+        query = {"range": {field: {"lt": before, "format": "epoch_millis"}}}
+        options = {"conflicts": "proceed", "slices": "auto", "wait_for_completion": False, "ignore_unavailable": True}
+        if requests_per_second:
+            options["requests_per_second"] = requests_per_second
+        try:
+            response = self.es.delete_by_query(index=index_name, query=query, **options)
+        except TypeError:
+            # Fallback for older Elasticsearch clients
+            response = self.es.delete_by_query(index=index_name, body={"query": query}, **options)
+        result["task"] = response["task"]
+        logger.info(f"Started delete_by_query task {result['task']} on {index_name} ({field} < {before})")
+
+        status = self.wait_for_task(result["task"], poll_interval, timeout)
+        if status is not None:
+            result["deleted"] = status.get("deleted", 0)
+            if status.get("failures"):
+                logger.warning(f"delete_by_query on {index_name} finished with {len(status['failures'])} failures: {status['failures'][:3]}")
+            logger.info(f"Deleted {result['deleted']} expired documents from {index_name}")
+        return result
+
+    def wait_for_task(self, task_id, poll_interval=10, timeout=None):
+        """
+        Polls a background task until it completes, logging its progress.
+
+        Returns:
+            dict: The response of the completed task, or None when timeout seconds passed first.
+
+        Raises:
+            RuntimeError: when the task failed.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            info = self.es.tasks.get(task_id=task_id)
+            if info.get("completed"):
+                if info.get("error"):
+                    raise RuntimeError(f"Task {task_id} failed: {info['error']}")
+                return info.get("response") or info.get("task", {}).get("status", {})
+            status = info.get("task", {}).get("status", {})
+            logger.info(f"Task {task_id}: {status.get('deleted', 0)} of {status.get('total', 0)} documents deleted")
+            if deadline is not None and time.monotonic() >= deadline:
+                logger.warning(f"Task {task_id} still running after {timeout}s, no longer waiting for it")
+                return None
+            time.sleep(poll_interval)
+
     def clear_project_data(self, project_indexes=None):
         """
         Clear all data from project-related indexes without deleting the indexes themselves.
@@ -253,6 +788,7 @@ class ElasticsearchManager:
             "total_failed": len(failed_indexes)
         }
     
+    @timed(es_request_duration, "count", errors=es_errors_total)
     def count_documents(self, index_name, query):
         """
         Counts the number of documents in the specified Elasticsearch index that match the query.
@@ -267,14 +803,15 @@ class ElasticsearchManager:
         Example:
             count = count_documents("projects", {"match_all": {}})
         """
+        index, options = self._search_index(index_name, query)
         try:
             # Compatibility with both ES 7.x (body param) and 8.x (query param)
             try:
-                result = self.es.count(index=index_name, query=query)
+                result = self.es.count(index=index, query=query, **options)
             except TypeError:
                 # Fallback for older Elasticsearch versions
                 body = {"query": query}
-                result = self.es.count(index=index_name, body=body)
+                result = self.es.count(index=index, body=body, **options)
                 
             return result.get('count', 0)
         except NotFoundError:
@@ -284,6 +821,186 @@ class ElasticsearchManager:
             logger.error(f"Error counting documents in Elasticsearch: {e}")
             return 0
 
+    @timed(es_request_duration, "aggregate", errors=es_errors_total)
+    def aggregate(self, index_name, query, group_by=None, sum_fields=(), size=1000):
+        """
+        Sums sum_fields per group_by value with a terms aggregation (sum aggregations
+        only when group_by is None); see StorageBackend.aggregate.
+
+        Example:
+            aggregate("linechanges", {"range": {"timestamp": {"gte": "now-7d"}}}, "model", ["added", "removed"])
+        """
+        sums = {field: {"sum": {"field": field}} for field in sum_fields}
+        if group_by:
+            terms = {"field": group_by, "size": size}
+            if sum_fields:
+                terms["order"] = {sum_fields[0]: "desc"}
+            aggs = {"groups": {"terms": terms, "aggs": sums}}
+        else:
+            aggs = sums
+
+        index, options = self._search_index(index_name, query)
+        try:
+            result = self.es.search(index=index, query=query, aggs=aggs, size=0, track_total_hits=True, **options)
+        except TypeError:
+            # Fallback for older Elasticsearch clients
+            result = self.es.search(index=index, body={"query": query, "aggs": aggs, "size": 0, "track_total_hits": True}, **options)
+
+        def row(key, doc_count, values):
+            data = {"key": key, "doc_count": doc_count}
+            for field in sum_fields:
+                value = values.get(field, {}).get("value") or 0
+                data[field] = int(value) if float(value).is_integer() else value
+            return data
+
+        aggregations = result.get('aggregations', {})
+        if group_by:
+            return [row(bucket['key'], bucket['doc_count'], bucket) for bucket in aggregations['groups']['buckets']]
+        return [row(None, result['hits']['total']['value'], aggregations)]
+
+
+class AsyncElasticsearchManager:
+    """
+    asyncio counterpart of ElasticsearchManager, used by async_server.py so that
+    ES round trips do not block the event loop. Requires `elasticsearch[async]`.
+    """
+
+    def __init__(self, url=None, primary_key="id", user=None, password=None, request_timeout=60, connections_per_node=10, write_mode="upsert", partitions=None,
+                 partition_field="timestamp", view_ttl=60):
+
+        if url is None:
+            url = os.environ.get('ELASTICSEARCH_URL', "http://localhost:9200")
+        if write_mode not in WRITE_MODES:
+            raise ValueError(f"Unknown write mode: {write_mode}")
+
+        self.url = url
+        self.primary_key = primary_key
+        self.request_timeout = request_timeout
+        self.write_mode = write_mode
+        # partitioned indexes are written through their write alias, see ElasticsearchManager
+        self.partitions = partitions if partitions is not None else {}
+        self.partition_field = partition_field
+        self.partition_views = TTLCache(max_entries=64, ttl=view_ttl)
+
+        options = {
+            "hosts": self.url,
+            "max_retries": 3,
+            "retry_on_timeout": True,
+            "request_timeout": request_timeout,
+            "connections_per_node": connections_per_node,
+        }
+        if user is not None and password is not None:
+            options["basic_auth"] = (user, password)
+        logger.info(f"Using async Elasticsearch client (request_timeout={request_timeout}s, connections_per_node={connections_per_node})")
+        self.es = AsyncElasticsearch(**options)
+
+    @timed(es_request_duration, "write", errors=es_errors_total)
+    async def write_to_es(self, index_name, data, update_condition=None, mode=None):
+        mode = mode or self.write_mode
+        data['last_updated_at'] = time_utils.current_iso8601_time()
+        doc_id = data.get(self.primary_key)
+        index_name = await self._write_index(index_name, data)
+        logger.debug(f"Writing data to Elasticsearch index: {index_name} (mode={mode})")
+
+        if mode == "read_modify_write":
+            try:
+                existing_doc = await self.es.get(index=index_name, id=doc_id)
+                if update_condition:
+                    apply_update_condition(index_name, doc_id, existing_doc['_source'], data, update_condition)
+                await self.es.update(index=index_name, id=doc_id, doc=data)
+                logger.debug(f'[updated] to [{index_name}]: {data}')
+            except NotFoundError:
+                await self.es.index(index=index_name, id=doc_id, document=data)
+                logger.info(f'[created] to [{index_name}]: {data}')
+        elif update_condition:
+            await self.es.update(index=index_name, id=doc_id, script=preserve_fields_script(data, update_condition), upsert=data)
+        elif mode == "create":
+            try:
+                await self.es.create(index=index_name, id=doc_id, document=data)
+            except ConflictError:
+                await self.es.update(index=index_name, id=doc_id, doc=data)
+        else:
+            await self.es.update(index=index_name, id=doc_id, doc=data, doc_as_upsert=True)
+
+    async def _write_index(self, index_name, data):
+        """Same routing as ElasticsearchManager._write_index, with the partition list loaded without blocking."""
+        if index_name not in self.partitions:
+            return index_name
+        label = document_label(data, self.partition_field, self.partitions[index_name])
+        if label is not None:
+            try:
+                view = self.partition_views.get(index_name)
+                if view is None:
+                    view = PartitionView(index_name, dict(await self.es.indices.get(index=index_name)))
+                    self.partition_views.set(index_name, view)
+                partition = view.partition_for(label)
+            except Exception as e:
+                logger.warning(f"Failed to list partitions of {index_name}, writing through the write alias: {e}")
+                partition = None
+            if partition is not None:
+                return partition
+        return write_alias(index_name)
+
+    async def close(self):
+        await self.es.close()
+
+
+def is_outage_error(e):
+    """
+    Whether an exception from the ES client indicates that the cluster is unhealthy.
+    Missing documents, version conflicts and other 4xx client errors do not count.
+    """
+    if isinstance(e, (NotFoundError, ConflictError)):
+        return False
+    status = getattr(getattr(e, 'meta', None), 'status', None) or getattr(e, 'status_code', None)
+    if isinstance(status, int) and 400 <= status < 500 and status != 429:
+        return False
+    return True
+
+
+class GuardedElasticsearchManager:
+    """
+    Wraps an ElasticsearchManager or AsyncElasticsearchManager so that every public
+    method call goes through a CircuitBreaker. While the circuit is open, calls raise
+    CircuitOpenError immediately instead of waiting on request timeouts and retries.
+    Methods returning a generator (scan) only send requests while they are iterated,
+    so every item is fetched through the breaker instead of the call itself.
+    Attributes that are not methods (es, primary_key, round_trips, ...) pass through.
+    """
+
+    def __init__(self, manager, breaker: CircuitBreaker):
+        self.manager = manager
+        self.breaker = breaker
+
+    def __getattr__(self, name):
+        attr = getattr(self.manager, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+        if inspect.isgeneratorfunction(attr):
+            def guarded_generator(*args, **kwargs):
+                return self._guarded_iter(attr(*args, **kwargs))
+            return guarded_generator
+        if inspect.iscoroutinefunction(attr):
+            async def guarded_async(*args, **kwargs):
+                return await self.breaker.call_async(attr, *args, is_failure=is_outage_error, **kwargs)
+            return guarded_async
+
+        def guarded(*args, **kwargs):
+            return self.breaker.call(attr, *args, is_failure=is_outage_error, **kwargs)
+        return guarded
+
+    def _guarded_iter(self, iterator):
+        # a failed page request counts as a failure, and iteration stops once the circuit opens
+        done = object()
+        try:
+            while True:
+                item = self.breaker.call(next, iterator, done, is_failure=is_outage_error)
+                if item is done:
+                    return
+                yield item
+        finally:
+            iterator.close()
+
 
 if __name__ == "__main__":
     es = ElasticsearchManager(url="http://192.168.50.221:9200")
@@ -0,0 +1,218 @@
+import zlib
+
+# Content-Encoding -> zlib wbits
+CONTENT_ENCODINGS = {
+    "gzip": 16 + zlib.MAX_WBITS,
+    "x-gzip": 16 + zlib.MAX_WBITS,
+    "deflate": zlib.MAX_WBITS,
+}
+
+# chunked 请求体中 chunk 头和 trailer 行的最大长度
+MAX_CHUNK_LINE = 1024
+
+
+class UnsupportedEncoding(ValueError):
+    """The request uses a Content-Encoding the server cannot decode."""
+
+
+class BodyTooLarge(ValueError):
+    """The request body exceeds the configured limit."""
+
+
+class IncompleteBody(ValueError):
+    """The connection closed before the whole request body was received."""
+
+
+def parse_content_encoding(content_encoding):
+    """
+    Codings of a Content-Encoding header in the order they were applied, without identity.
+
+    Raises:
+        UnsupportedEncoding: for a coding other than gzip / deflate / identity.
+    """
+    codings = [coding.strip().lower() for coding in (content_encoding or "").split(",") if coding.strip()]
+    for coding in codings:
+        if coding != "identity" and coding not in CONTENT_ENCODINGS:
+            raise UnsupportedEncoding(f"Unsupported Content-Encoding: {coding}")
+    return [coding for coding in codings if coding != "identity"]
+
+
+def parse_chunk_size(line):
+    """
+    Size of the next chunk of a chunked request body from its header line
+    (hex size, optionally followed by ;extensions).
+
+    Raises:
+        ValueError: for a malformed or overlong line.
+    """
+    if len(line) > MAX_CHUNK_LINE or not line.endswith(b"\n"):
+        raise ValueError("Invalid chunk header")
+    size = line.split(b";", 1)[0].strip()
+    try:
+        if not size or size.startswith((b"+", b"-", b"0x", b"0X")):
+            raise ValueError
+        return int(size, 16)
+    except ValueError:
+        raise ValueError("Invalid chunk header") from None
+
+
+class ContentDecoder:
+    """
+    Incremental decoder for a request body with a Content-Encoding (gzip, deflate or
+    identity, applied in the order listed in the header).
+
+    decode() takes the body as it arrives, chunk by chunk, and yields the decoded bytes
+    in pieces of at most piece_size, so neither a large body nor a small compressed body
+    that expands to gigabytes is ever held in memory at once. The decoded size is counted
+    for identity bodies too, so the decoder also enforces the limit of plain bodies.
+
+    Args:
+        content_encoding (str): Value of the Content-Encoding header, or None.
+        max_bytes (int): Limit of the decoded body.
+        piece_size (int): Largest piece yielded by decode().
+
+    Raises:
+        UnsupportedEncoding: for any other coding.
+    """
+
+    def __init__(self, content_encoding, max_bytes, piece_size=64 * 1024):
+        self.stages = [_Inflater(coding, piece_size) for coding in reversed(parse_content_encoding(content_encoding))]
+        self.max_bytes = max_bytes
+        self.size = 0
+
+    def decode(self, data):
+        """
+        Yields the decoded pieces of the next chunk of the body.
+
+        Raises:
+            BodyTooLarge: when the decoded body exceeds max_bytes.
+            ValueError: when the body is not valid compressed data.
+        """
+        for piece in self._run(0, data):
+            self.size += len(piece)
+            if self.size > self.max_bytes:
+                raise BodyTooLarge(f"Request body exceeds {self.max_bytes} bytes")
+            yield piece
+
+    def finish(self):
+        """
+        Checks that the body ended where the compressed data ends.
+
+        Raises:
+            ValueError: when the compressed data is truncated.
+        """
+        for stage in self.stages:
+            stage.finish()
+
+    def _run(self, index, data):
+        if index == len(self.stages):
+            if data:
+                yield data
+            return
+        for piece in self.stages[index].feed(data):
+            yield from self._run(index + 1, piece)
+
+
+class _Inflater:
+    """One gzip / deflate layer of a ContentDecoder."""
+
+    def __init__(self, coding, piece_size):
+        self.coding = coding
+        self.piece_size = piece_size
+        self.decompressor = None
+        self.head = b""        # 判断 deflate 数据是否带 zlib 头前收到的字节
+        self.complete = False  # 最近一个 gzip 成员（或 deflate 流）已经结束
+
+    def feed(self, data):
+        while data:
+            if self.decompressor is None:
+                wbits = CONTENT_ENCODINGS[self.coding]
+                if self.coding == "deflate":
+                    data = self.head + data
+                    if len(data) < 2:
+                        self.head = data
+                        return
+                    self.head = b""
+                    # 部分客户端发送不带 zlib 头的原始 deflate 数据
+                    if data[0] & 0x0F != 8 or (data[0] << 8 | data[1]) % 31:
+                        wbits = -zlib.MAX_WBITS
+                self.decompressor = zlib.decompressobj(wbits)
+                self.complete = False
+            elif self.decompressor.eof:
+                if self.coding == "deflate":
+                    return  # deflate 流结束后的数据被忽略
+                # gzip 允许多个成员首尾相接
+                self.decompressor = None
+                continue
+
+            try:
+                piece = self.decompressor.decompress(data, self.piece_size)
+            except zlib.error as e:
+                raise ValueError(f"Invalid {self.coding} body: {e}")
+            if piece:
+                yield piece
+            if self.decompressor.eof:
+                self.complete = True
+                data = self.decompressor.unused_data
+            else:
+                data = self.decompressor.unconsumed_tail
+                # 输入已经用完但输出恰好填满时，zlib 可能还有未输出的数据
+                while not data and len(piece) == self.piece_size and not self.decompressor.eof:
+                    piece = self.decompressor.decompress(b"", self.piece_size)
+                    if piece:
+                        yield piece
+                if self.decompressor.eof:
+                    self.complete = True
+                    data = self.decompressor.unused_data
+
+    def finish(self):
+        if not self.complete or self.head:
+            raise ValueError(f"Truncated {self.coding} body")
+
+
+class LineSplitter:
+    """
+    Splits a body into lines as its pieces arrive, so an NDJSON body can be processed
+    record by record. Only the current partial line is buffered; a line longer than
+    max_line is dropped while it streams in and reported as None.
+
+    Args:
+        max_line (int): Longest line returned, in bytes.
+    """
+
+    def __init__(self, max_line):
+        self.max_line = max_line
+        self.buffer = bytearray()
+        self.overflow = False  # 当前行已超过 max_line，丢弃到行尾
+
+    def feed(self, data):
+        """Returns the lines completed by data, without their line terminator."""
+        lines = []
+        start = 0
+        while True:
+            end = data.find(b"\n", start)
+            if end < 0:
+                break
+            lines.append(self._complete(data[start:end]))
+            start = end + 1
+        if not self.overflow:
+            self.buffer += data[start:]
+            if len(self.buffer) > self.max_line:
+                self.overflow = True
+                self.buffer.clear()
+        return lines
+
+    def close(self):
+        """Returns the last line when the body does not end with a newline."""
+        if self.overflow or self.buffer:
+            return [self._complete(b"")]
+        return []
+
+    def _complete(self, tail):
+        if self.overflow or len(self.buffer) + len(tail) > self.max_line:
+            line = None
+        else:
+            line = bytes(self.buffer + tail).rstrip(b"\r")
+        self.overflow = False
+        self.buffer.clear()
+        return line
@@ -0,0 +1,93 @@
+import json
+
+
+class EncodedDocument(dict):
+    """
+    A parsed JSON object that keeps its compact UTF-8 encoding, so the archive, the spool
+    and the _bulk body can reuse the bytes received from the client instead of serializing
+    the dict again.
+
+    Adding a missing key with item assignment or setdefault() prepends it to the encoding;
+    any other change (replacing or removing a key, update()) drops the encoding, after
+    which encode() serializes the dict as before.
+
+    Attributes:
+        encoded (bytes): Single-line JSON encoding of the document, or None.
+    """
+
+    __slots__ = ("encoded",)
+
+    def __init__(self, data, encoded):
+        super().__init__(data)
+        self.encoded = encoded
+
+    def __setitem__(self, key, value):
+        if self.encoded is not None:
+            if key in self:
+                self.encoded = None
+            else:
+                separator = b"," if self else b""
+                self.encoded = b"{" + dumps_compact({key: value})[1:-1] + separator + self.encoded[1:]
+        super().__setitem__(key, value)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def __delitem__(self, key):
+        self.encoded = None
+        super().__delitem__(key)
+
+    def pop(self, *args):
+        self.encoded = None
+        return super().pop(*args)
+
+    def popitem(self):
+        self.encoded = None
+        return super().popitem()
+
+    def clear(self):
+        self.encoded = None
+        super().clear()
+
+    def update(self, *args, **kwargs):
+        self.encoded = None
+        super().update(*args, **kwargs)
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def __reduce__(self):
+        return (EncodedDocument, (dict(self), self.encoded))
+
+
+def dumps_compact(value):
+    """Compact single-line UTF-8 JSON, the format of archive and spool lines."""
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def encode(document):
+    """The encoding carried by an EncodedDocument, or the compact JSON of any other value."""
+    encoded = getattr(document, "encoded", None)
+    return encoded if encoded is not None else dumps_compact(document)
+
+
+def loads_document(raw):
+    """
+    Parses a JSON body straight from bytes. A top-level object in UTF-8 is returned as an
+    EncodedDocument carrying raw itself when it fits on one line (what clients send with
+    JSON.stringify), or its compact encoding when it is pretty-printed, so it is serialized
+    at most once; anything else is returned as parsed by json.loads.
+
+    Raises:
+        ValueError: for invalid JSON or text that is not valid Unicode.
+    """
+    data = json.loads(raw)
+    if type(data) is not dict or json.detect_encoding(raw) != "utf-8":
+        return data
+    raw = raw.strip()
+    if b"\n" in raw or b"\r" in raw:
+        raw = dumps_compact(data)
+    return EncodedDocument(data, raw)
@@ -1,8 +1,26 @@
 import os
+import atexit
+import glob
+import gzip
+import json
 import logging
-from datetime import datetime
+import queue
+import random
+import shutil
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from logging.handlers import QueueHandler, QueueListener
 from utils.time_utils import current_time
-from config import is_debug_enabled
+from config import (
+    is_debug_enabled,
+    LOG_QUEUE_ENABLED,
+    LOG_QUEUE_SIZE,
+    LOG_COMPRESS_ROTATED,
+    LOG_SAMPLE_RATES,
+    LOG_RATE_LIMITS
+)
 
 # Get whether to enable debug
 debug = is_debug_enabled()
@@ -10,8 +28,154 @@ debug = is_debug_enabled()
 log_format = '%(asctime)s - [%(levelname)s] - %(message)s'
 logging.basicConfig(level=logging.INFO, format=log_format)
 
+# 当前进程的日志队列监听线程（LOG_QUEUE_ENABLED 时创建）
+_listener = None
 
-def configure_logger(log_path=None, with_date_folder=True):
+
+class LazyJSON:
+    """
+    Defers json.dumps until the log record is actually formatted.
+
+    Pass it as a logging argument, e.g. logger.debug("payload: %s", LazyJSON(data)):
+    when DEBUG is disabled the record is dropped before formatting and the payload
+    is never serialized.
+    """
+
+    __slots__ = ("data",)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return json.dumps(self.data, ensure_ascii=False, indent=2)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Per-message-type sampling and rate limiting.
+
+    The message type is the `log_type` passed via extra={"log_type": ...}; records
+    without one are never filtered. Records below WARNING are kept with the
+    probability in sample_rates[type]; records below ERROR are limited to
+    rate_limits[type] per second. The number of suppressed records is appended
+    to the next record of that type that gets through.
+    """
+
+    def __init__(self, sample_rates=None, rate_limits=None):
+        super().__init__()
+        self.sample_rates = sample_rates or {}
+        self.rate_limits = rate_limits or {}
+        self.lock = threading.Lock()
+        self.windows = {}  # log_type -> [window start second, count]
+        self.suppressed = {}
+
+    def filter(self, record):
+        log_type = getattr(record, "log_type", None)
+        if log_type is None or record.levelno >= logging.ERROR:
+            return True
+
+        keep = True
+        if record.levelno < logging.WARNING:
+            rate = self.sample_rates.get(log_type, 1.0)
+            keep = rate >= 1.0 or random.random() < rate
+
+        limit = self.rate_limits.get(log_type)
+        # 多个线程同时记录同一类型的日志，窗口和被抑制的计数都只在锁内修改
+        with self.lock:
+            if keep and limit:
+                now = int(time.monotonic())
+                window = self.windows.setdefault(log_type, [now, 0])
+                if window[0] != now:
+                    window[0], window[1] = now, 0
+                window[1] += 1
+                keep = window[1] <= limit
+            if not keep:
+                self.suppressed[log_type] = self.suppressed.get(log_type, 0) + 1
+                return False
+            suppressed = self.suppressed.pop(log_type, 0)
+
+        if suppressed:
+            record.msg = f"{record.getMessage()} ({suppressed} similar '{log_type}' messages suppressed)"
+            record.args = None
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops records instead of blocking or raising when the queue is full."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class DailyFileHandler(logging.FileHandler):
+    """
+    File handler writing to `<log_path>/<YYYY-MM-DD><suffix>.log` that switches to a
+    new file at midnight. The previous day's file is gzip-compressed in a
+    background thread when compress is enabled.
+    """
+
+    def __init__(self, log_path, suffix="", compress=True):
+        self.log_path = log_path
+        self.suffix = suffix
+        self.compress = compress
+        self.day = datetime.now().strftime('%Y-%m-%d')
+        self.rollover_at = self._next_midnight()
+        super().__init__(self._file_name(self.day), mode='a', delay=False)
+
+    def emit(self, record):
+        if record.created >= self.rollover_at:
+            self.rollover()
+        super().emit(record)
+
+    def rollover(self):
+        previous = self.baseFilename
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        self.day = datetime.now().strftime('%Y-%m-%d')
+        self.rollover_at = self._next_midnight()
+        self.baseFilename = os.path.abspath(self._file_name(self.day))
+        self.stream = self._open()
+        if self.compress and previous != self.baseFilename:
+            threading.Thread(target=compress_log_file, args=(previous,), name="log-compress", daemon=True).start()
+
+    def _file_name(self, day):
+        return f"{self.log_path}/{day}{self.suffix}.log"
+
+    @staticmethod
+    def _next_midnight():
+        now = datetime.now()
+        return (datetime(now.year, now.month, now.day) + timedelta(days=1)).timestamp()
+
+
+def compress_log_file(path):
+    """gzip a rotated log file next to the original and remove the original."""
+    try:
+        with open(path, "rb") as src, gzip.open(path + ".gz.tmp", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(path + ".gz.tmp", path + ".gz")
+        os.remove(path)
+    except OSError as e:
+        logging.getLogger(__name__).error(f"Failed to compress log file {path}: {e}")
+
+
+def compress_stale_logs(log_path, suffix=""):
+    """Compress `*.log` files left uncompressed from previous days (e.g. after a restart)."""
+    today = datetime.now().strftime('%Y-%m-%d')
+    for path in glob.glob(os.path.join(log_path, f"*{suffix}.log")):
+        name = os.path.basename(path)
+        if name[:10] < today and name[:10].count('-') == 2:
+            threading.Thread(target=compress_log_file, args=(path,), name="log-compress", daemon=True).start()
+
+
+def configure_logger(log_path=None, with_date_folder=True, use_queue=LOG_QUEUE_ENABLED):
     if log_path is None:
         log_path = os.environ.get('LOG_PATH', 'logs')
 
@@ -21,22 +185,92 @@ def configure_logger(log_path=None, with_date_folder=True):
     if not os.path.exists(log_path):
         os.makedirs(log_path)
 
-    log_file_name = f"{log_path}/{datetime.now().strftime('%Y-%m-%d')}.log"
-    file_handler = logging.FileHandler(log_file_name, mode='a')
-    file_handler.setLevel(logging.INFO)
+    logger = logging.getLogger(__name__)
+    # 调试模式下输出 DEBUG 日志（包括完整的请求内容），否则为 INFO
+    logger.setLevel(logging.DEBUG if debug else logging.INFO)
+    logger.addFilter(SamplingFilter(LOG_SAMPLE_RATES, LOG_RATE_LIMITS))
+    attach_handlers(logger, [build_file_handler(log_path)], use_queue)
+    if LOG_COMPRESS_ROTATED:
+        compress_stale_logs(log_path)
+
+    return logger
+
+
+def build_file_handler(log_path, suffix=""):
+    file_handler = DailyFileHandler(log_path, suffix=suffix, compress=LOG_COMPRESS_ROTATED)
     file_formatter = logging.Formatter(log_format)
     file_handler.setFormatter(file_formatter)
+    return file_handler
 
-    logger = logging.getLogger(__name__)
-    # 无论是否为调试模式，始终将日志级别设置为 INFO
-    logger.setLevel(logging.INFO)
-    logger.addHandler(file_handler)
 
+def attach_handlers(logger, handlers, use_queue=LOG_QUEUE_ENABLED):
+    """
+    Attach handlers to logger, either directly or behind a queue.
+
+    With use_queue the calling thread only enqueues the record; formatting and
+    file/console I/O run in a QueueListener thread. The console handler then
+    moves into the listener as well, so the logger stops propagating to the root
+    handler installed by basicConfig.
+    """
+    global _listener
+    if not use_queue:
+        for handler in handlers:
+            logger.addHandler(handler)
+        return
+
+    console_handler = logging.StreamHandler(sys.stderr)
+    console_handler.setFormatter(logging.Formatter(log_format))
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    _listener = QueueListener(log_queue, console_handler, *handlers, respect_handler_level=True)
+    _listener.start()
+    logger.addHandler(DroppingQueueHandler(log_queue))
+    logger.propagate = False
+
+
+def stop_logging():
+    """Drain the log queue and stop the listener thread (called at exit)."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def log_queue_stats():
+    """Records waiting in and dropped from the log queue of this process."""
+    for handler in logging.getLogger(__name__).handlers:
+        if isinstance(handler, DroppingQueueHandler):
+            return {"queued": handler.queue.qsize(), "dropped": handler.dropped}
+    return {"queued": 0, "dropped": 0}
+
+
+def configure_worker_logger(logger, worker_id, log_path=None):
+    """
+    Replace the file handler inherited from the parent process with a per-worker one,
+    so that pre-forked workers never interleave writes in the same log file.
+    The queue listener thread does not survive fork, so it is rebuilt in the worker.
+    """
+    global _listener
+    if log_path is None:
+        log_path = os.environ.get('LOG_PATH', 'logs')
+
+    for handler in list(logger.handlers):
+        if isinstance(handler, (logging.FileHandler, QueueHandler)):
+            logger.removeHandler(handler)
+            handler.close()
+    if _listener is not None:
+        # 父进程的监听线程不会被 fork 复制，只需关闭继承的文件句柄
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+    attach_handlers(logger, [build_file_handler(log_path, suffix=f".worker{worker_id}")])
     return logger
 
 
 logger = configure_logger(log_path="logs", with_date_folder=False)
 logger.info('-----------------Starting-----------------')
+atexit.register(stop_logging)
 
 
 if __name__ == '__main__':
@@ -44,4 +278,4 @@ if __name__ == '__main__':
     logger.info("test")
     logger.debug("test")
     logger.warning("test")
-    logger.error("test")
\ No newline at end of file
+    logger.error("test")
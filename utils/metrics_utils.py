@@ -0,0 +1,230 @@
+import functools
+import inspect
+import threading
+import time
+from bisect import bisect_left
+
+# 默认的延迟分桶（秒），覆盖从亚毫秒级的解析到秒级的 ES 请求
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with optional labels, e.g. requests_total{path, status}."""
+
+    type = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = dict(self.values)
+        for labels, value in sorted(values.items()):
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+
+class Histogram:
+    """
+    Cumulative histogram with fixed buckets, e.g. stage_duration_seconds{stage}.
+
+    observe() is one bisect plus a few increments under a lock, cheap enough to
+    record every request.
+    """
+
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.series = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [0] * (len(self.buckets) + 3)
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self.lock:
+            series = {labels: list(values) for labels, values in self.series.items()}
+        for labels, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), values):
+                cumulative += count
+                yield self.name + "_bucket", _format_labels(self.labelnames, labels, [("le", _format_value(bound))]), cumulative
+            yield self.name + "_sum", _format_labels(self.labelnames, labels), values[-2]
+            yield self.name + "_count", _format_labels(self.labelnames, labels), values[-1]
+
+
+class CallbackMetric:
+    """
+    Gauge or counter whose value is read from a callback at scrape time, for
+    values that are already tracked elsewhere (queue sizes, bytes written).
+    The callback returns a number, or a dict of label tuple -> number; None skips the metric.
+    """
+
+    def __init__(self, name, help, callback, labelnames=(), type="gauge"):
+        self.name = name
+        self.help = help
+        self.callback = callback
+        self.labelnames = tuple(labelnames)
+        self.type = type
+
+    def samples(self):
+        value = self.callback()
+        if value is None:
+            return
+        if not isinstance(value, dict):
+            value = {(): value}
+        for labels, sample in sorted(value.items()):
+            yield self.name, _format_labels(self.labelnames, labels), sample
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+class MetricsRegistry:
+    """Holds the metrics of this process and renders them in the Prometheus text format."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name, help, callback, labelnames=(), type="gauge"):
+        return self.register(CallbackMetric(name, help, callback, labelnames, type))
+
+    def render(self, const_labels=()):
+        """
+        Args:
+            const_labels: (name, value) pairs added to every sample, e.g. the worker id.
+        """
+        lines = []
+        for metric in self.metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                lines.append(f"# {metric.name} unavailable: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in samples:
+                if const_labels:
+                    extra = _format_labels((), (), const_labels)[1:-1]
+                    labels = "{" + extra + ("," + labels[1:-1] if labels else "") + "}"
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def timed(histogram, *labels, errors=None):
+    """
+    Decorator recording the duration of every call in histogram (sync or async
+    functions). errors, if given, is a Counter incremented with the same labels
+    when the call raises.
+    """
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    if errors is not None:
+                        errors.inc(*labels)
+                    raise
+                finally:
+                    histogram.observe(time.perf_counter() - started, *labels)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                if errors is not None:
+                    errors.inc(*labels)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - started, *labels)
+        return wrapper
+    return decorator
+
+
+registry = MetricsRegistry()
+
+# 接收服务器
+requests_total = registry.counter(
+    "linechanges_requests_total", "HTTP requests by method, path and response status.", ("method", "path", "status"))
+request_duration = registry.histogram(
+    "linechanges_request_duration_seconds", "Total time to handle an HTTP request.", ("method", "path"))
+stage_duration = registry.histogram(
+    "linechanges_stage_duration_seconds",
+    "Time spent in each ingest stage: read, parse, auth, file, es (enqueue time when the spool or bulk writer is used).",
+    ("stage",))
+records_total = registry.counter(
+    "linechanges_records_total", "Ingested records by outcome (accepted, rejected, failed).", ("outcome",))
+
+# 存储后端请求（Elasticsearch 或 SQLite，见 STORAGE_BACKEND）
+es_request_duration = registry.histogram(
+    "linechanges_es_request_duration_seconds", "Storage backend call duration by operation.", ("operation",))
+es_errors_total = registry.counter(
+    "linechanges_es_errors_total", "Storage backend calls that raised, by operation.", ("operation",))
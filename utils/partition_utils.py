@@ -0,0 +1,122 @@
+import re
+import time
+from utils.time_utils import to_epoch_millis
+
+# 分区粒度 -> 分区索引名中的日期格式
+PARTITION_FORMATS = {"day": "%Y.%m.%d", "month": "%Y.%m"}
+
+
+def partition_label(epoch, interval):
+    return time.strftime(PARTITION_FORMATS[interval], time.gmtime(epoch))
+
+
+def document_label(doc, field, interval):
+    """Partition label of the day / month of doc[field], or None when it is missing or not a date."""
+    epoch_ms = to_epoch_millis(doc.get(field))
+    if epoch_ms is None:
+        return None
+    try:
+        return partition_label(epoch_ms / 1000, interval)
+    except (OverflowError, OSError, ValueError):
+        return None
+
+
+def write_alias(index_name):
+    """Alias that always points at the partition currently written to."""
+    return f"{index_name}-write"
+
+
+def partition_name(index_name, label, generation):
+    """e.g. linechanges-2025.08.15-000003; the generation keeps increasing across labels, like ES rollover."""
+    return f"{index_name}-{label}-{generation:06d}"
+
+
+def parse_partition_name(index_name, name):
+    """Returns (label, generation) for a partition of index_name, or None."""
+    match = re.fullmatch(re.escape(index_name) + r"-([0-9.]+)-(\d{6,})", name)
+    if match is None:
+        return None
+    return match.group(1), int(match.group(2))
+
+
+def index_template(index_name, mapping):
+    """
+    Composable index template applying the mappings and settings of a mapping file to
+    every partition of index_name, and adding each partition to the read alias index_name.
+    """
+    template = {key: mapping[key] for key in ("mappings", "settings") if key in mapping}
+    template["aliases"] = {index_name: {}}
+    return {"index_patterns": [f"{index_name}-*"], "template": template, "priority": 100}
+
+
+def range_start(query, field):
+    """
+    Lower bound (epoch ms) that query puts on field, from a range clause at the top level
+    or in the must / filter clauses of a bool query; None when the query has no such bound.
+    """
+    if not isinstance(query, dict):
+        return None
+    if "range" in query:
+        bounds = query["range"].get(field)
+        if not isinstance(bounds, dict):
+            return None
+        for key in ("gte", "gt"):
+            if key in bounds:
+                return to_epoch_millis(bounds[key])
+        return None
+    if "bool" in query:
+        starts = []
+        for key in ("must", "filter"):
+            clauses = query["bool"].get(key, [])
+            for clause in clauses if isinstance(clauses, list) else [clauses]:
+                start = range_start(clause, field)
+                if start is not None:
+                    starts.append(start)
+        return max(starts) if starts else None
+    return None
+
+
+class PartitionView:
+    """
+    Snapshot of the partitions behind the read alias of a partitioned index, built from
+    the response of GET /<alias> (aliases and settings of every partition).
+
+    A partition only receives writes until the write alias moves to the next partition,
+    so every document in it was written before the next partition was created; its
+    timestamp is at most that creation time plus the clock skew accepted at ingest.
+    Partitions closed before a query's time range can therefore be skipped, even
+    though late records (e.g. replayed from the spool) land in the current partition.
+    Records routed by partition_for() to the last partition of their own day / month
+    keep that bound as well, since that partition was closed after the day / month ended.
+
+    Attributes:
+        partitions (list): (name, label, created ms, closed ms or None) in generation order.
+        write_index (str): Partition the write alias points at, or None.
+    """
+
+    def __init__(self, index_name, indices):
+        partitions = []
+        self.write_index = None
+        for name, info in indices.items():
+            parsed = parse_partition_name(index_name, name)
+            if parsed is None:
+                continue
+            label, generation = parsed
+            created = int(info.get("settings", {}).get("index", {}).get("creation_date", 0))
+            partitions.append((generation, name, label, created))
+            if write_alias(index_name) in info.get("aliases", {}):
+                self.write_index = name
+        partitions.sort()
+        self.partitions = []
+        for i, (_, name, label, created) in enumerate(partitions):
+            closed = partitions[i + 1][3] if i + 1 < len(partitions) else None
+            self.partitions.append((name, label, created, closed))
+
+    def partition_for(self, label):
+        """Last partition of label (the day / month a document belongs to), or None when there is none."""
+        names = [name for name, partition_label, _, _ in self.partitions if partition_label == label]
+        return names[-1] if names else None
+
+    def search_targets(self, since):
+        """Partitions that can hold documents with a timestamp at or after since (epoch ms)."""
+        return [name for name, _, _, closed in self.partitions if closed is None or closed >= since]
@@ -0,0 +1,83 @@
+import os
+import signal
+import socket
+import time
+from utils.log_utils import logger, stop_logging
+
+
+def reuse_port_supported():
+    return hasattr(socket, "SO_REUSEPORT") and hasattr(os, "fork")
+
+
+class PreforkSupervisor:
+    """
+    Forks N worker processes and restarts any that exit unexpectedly.
+
+    Every worker binds its own listening socket with SO_REUSEPORT, so the kernel
+    load-balances incoming connections across workers without a shared accept lock.
+    `worker_main(worker_id)` runs in the child and should only return on shutdown.
+    """
+
+    def __init__(self, num_workers, worker_main, restart_backoff=1.0):
+        self.num_workers = num_workers
+        self.worker_main = worker_main
+        self.restart_backoff = restart_backoff
+        self.workers = {}  # pid -> (worker_id, started_at)
+        self.stopping = False
+
+    def spawn(self, worker_id):
+        pid = os.fork()
+        if pid == 0:
+            # 子进程：SIGTERM/SIGINT 转为 KeyboardInterrupt，让工作进程有机会刷新缓冲后退出
+            signal.signal(signal.SIGTERM, signal.default_int_handler)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            exit_code = 0
+            try:
+                self.worker_main(worker_id)
+            except KeyboardInterrupt:
+                pass
+            except Exception as e:
+                logger.error(f"Worker {worker_id} crashed: {e}")
+                exit_code = 1
+            finally:
+                # os._exit 不会执行 atexit，先把队列中的日志写完
+                stop_logging()
+                os._exit(exit_code)
+        self.workers[pid] = (worker_id, time.monotonic())
+        logger.info(f"Started worker {worker_id} (pid {pid})")
+
+    def stop(self, signum=None, frame=None):
+        self.stopping = True
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        for worker_id in range(self.num_workers):
+            self.spawn(worker_id)
+
+        while self.workers:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            if pid not in self.workers:
+                continue
+            worker_id, started_at = self.workers.pop(pid)
+            if self.stopping:
+                continue
+
+            logger.warning(f"Worker {worker_id} (pid {pid}) exited with status {status}, restarting")
+            # 避免启动即崩溃的工作进程导致疯狂重启
+            if time.monotonic() - started_at < self.restart_backoff:
+                time.sleep(self.restart_backoff)
+            self.spawn(worker_id)
+
+        logger.info("All workers stopped.")
@@ -0,0 +1,266 @@
+import re
+import sys
+from datetime import datetime
+from json.encoder import encode_basestring
+from utils.json_utils import dumps_compact
+from utils.storage_utils import load_mapping_properties
+from utils.token_utils import parse_iso_epoch
+
+# 不在映射中、但由客户端发送或写入流程设置的字段
+PIPELINE_FIELDS = {"token": "keyword", "last_updated_at": "date"}
+
+INTEGER_TYPES = ("integer", "long", "short", "byte")
+
+# ES 默认日期格式 strict_date_optional_time 的日期部分，后面可以跟 T 和时间
+ISO_DATE = re.compile(r"\d{4}-\d{2}-\d{2}(?:T|$)")
+
+# 未设置的字段（与 JSON null 区分）
+MISSING = object()
+
+
+class InvalidRecord(ValueError):
+    """A record is not a JSON object, or a field does not match its mapped type."""
+
+
+def keyword_value(field, value):
+    # ES 会把数字转换为 keyword，这里提前转换，保证存入的值与查询结果一致
+    if type(value) is str:
+        return value
+    if type(value) in (int, float):
+        return str(value)
+    raise InvalidRecord(f"Field {field} must be a string")
+
+
+def integer_value(field, value):
+    if type(value) is int:
+        return value
+    if type(value) is float and value.is_integer():
+        return int(value)
+    if type(value) is str:
+        try:
+            return int(value)
+        except ValueError:
+            pass
+    raise InvalidRecord(f"Field {field} must be an integer")
+
+
+def number_value(field, value):
+    if type(value) in (int, float):
+        return value
+    raise InvalidRecord(f"Field {field} must be a number")
+
+
+def date_value(field, value):
+    # ISO 8601 字符串或 epoch 毫秒（整数或数字字符串），与 ES 默认的 strict_date_optional_time||epoch_millis 一致
+    if type(value) is int or (type(value) is str and value.isdigit()):
+        return value
+    if type(value) is str and ISO_DATE.match(value):
+        try:
+            parse_iso_epoch(value)
+            return value
+        except ValueError:
+            pass
+        try:
+            # 不带时区或只有日期的值
+            datetime.fromisoformat(value.replace("Z", "+00:00"))
+            return value
+        except ValueError:
+            pass
+    raise InvalidRecord(f"Field {field} must be a date string or epoch milliseconds")
+
+
+def boolean_value(field, value):
+    if type(value) is bool:
+        return value
+    raise InvalidRecord(f"Field {field} must be a boolean")
+
+
+def interned_keyword_value(field, value):
+    return sys.intern(keyword_value(field, value))
+
+
+# 映射类型 -> 校验/转换函数；其余类型（object、nested 等）原样保存
+CONVERTERS = {
+    "keyword": keyword_value,
+    "text": keyword_value,
+    "date": date_value,
+    "float": number_value,
+    "double": number_value,
+    "boolean": boolean_value,
+    **{type: integer_value for type in INTEGER_TYPES},
+}
+
+
+class Record:
+    """
+    Base of the record types built by record_type(): one slot per mapped field instead
+    of a dict per record, so records queued for batching stay small.
+
+    Values are validated (and coerced like Elasticsearch would, e.g. "12" for an
+    integer) once in from_document(); strings of the interned fields are shared
+    between records. Fields outside the mapping are kept in the extra dict, at most
+    MAX_EXTRA_FIELDS of them.
+
+    A record reads and updates like a dict (get, [], in, keys, items, setdefault, update)
+    for the token check, dedup, rollups and the coalescing of queued writes. It carries
+    its compact JSON encoding in encoded, which json_utils.encode, the archive, the spool
+    and _bulk use as the document source: the bytes received from the client when no
+    value had to be coerced, otherwise serialized from the slots once. Setting a missing
+    field prepends it to the encoding like EncodedDocument; replacing a value drops the
+    encoding, which is then rebuilt on the next access. The last consumer (the bulk writer
+    once the document is flushed) calls release() so the record no longer holds both.
+    """
+
+    __slots__ = ("extra", "_encoded")
+
+    FIELDS = ()
+    CONVERTERS = {}
+    PREFIXES = ()
+    MAX_EXTRA_FIELDS = 32
+
+    @classmethod
+    def from_document(cls, document):
+        """
+        Builds a record from a parsed JSON object (a dict or an EncodedDocument).
+
+        Raises:
+            InvalidRecord: when document is not an object, a field has the wrong type,
+                or there are more than MAX_EXTRA_FIELDS unmapped fields.
+        """
+        if not isinstance(document, dict):
+            raise InvalidRecord("Record must be a JSON object")
+        record = cls.__new__(cls)
+        encoded = getattr(document, "encoded", None)
+        extra = None
+        for key, value in document.items():
+            convert = cls.CONVERTERS.get(key)
+            if convert is None:
+                if extra is None:
+                    extra = {}
+                extra[key] = value
+                continue
+            if value is not None:
+                converted = convert(key, value)
+                if type(converted) is not type(value):
+                    encoded = None
+                value = converted
+            setattr(record, key, value)
+        if extra and len(extra) > cls.MAX_EXTRA_FIELDS:
+            raise InvalidRecord(f"Record has more than {cls.MAX_EXTRA_FIELDS} unmapped fields")
+        record.extra = extra
+        record._encoded = encoded
+        return record
+
+    @property
+    def encoded(self):
+        if self._encoded is None:
+            self._encoded = self._encode()
+        return self._encoded
+
+    def release(self):
+        """Drops the encoding once it has been written; a later access serializes the slots again."""
+        self._encoded = None
+
+    def _encode(self):
+        parts = []
+        for field, prefix in self.PREFIXES:
+            value = getattr(self, field, MISSING)
+            if value is MISSING:
+                continue
+            if type(value) is str:
+                parts.append(prefix + encode_basestring(value).encode("utf-8"))
+            elif type(value) is int:
+                parts.append(prefix + str(value).encode())
+            else:
+                parts.append(prefix + dumps_compact(value))
+        if self.extra:
+            for key, value in self.extra.items():
+                parts.append(dumps_compact(key) + b":" + dumps_compact(value))
+        return b"{" + b",".join(parts) + b"}"
+
+    def get(self, key, default=None):
+        if key in self.CONVERTERS:
+            return getattr(self, key, default)
+        return self.extra.get(key, default) if self.extra else default
+
+    def __getitem__(self, key):
+        value = self.get(key, MISSING)
+        if value is MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key, MISSING) is not MISSING
+
+    def __setitem__(self, key, value):
+        if self._encoded is not None:
+            if key in self:
+                self._encoded = None
+            else:
+                separator = b"," if len(self._encoded) > 2 else b""
+                self._encoded = b"{" + dumps_compact({key: value})[1:-1] + separator + self._encoded[1:]
+        if key in self.CONVERTERS:
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, other=(), **kwargs):
+        for key, value in (other.items() if hasattr(other, "items") else other):
+            self[key] = value
+        for key, value in kwargs.items():
+            self[key] = value
+
+    def keys(self):
+        return [field for field in self.FIELDS if hasattr(self, field)] + list(self.extra or ())
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def to_dict(self):
+        """Plain dict of the record, for clients that serialize documents themselves."""
+        return dict(self.items())
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+def record_type(mapping_file, name="LineChangeRecord", interned=(), max_extra_fields=32):
+    """
+    Builds a Record subclass with one slot per field of an Elasticsearch mapping file
+    (plus PIPELINE_FIELDS); fields that are not identifiers, or that would shadow a
+    method of Record, are kept in extra.
+
+    Args:
+        mapping_file (str): Mapping whose "properties" define the fields and their types.
+        name (str): Name of the class.
+        interned (tuple): Keyword fields whose values are interned with sys.intern.
+        max_extra_fields (int): Unmapped fields accepted per record.
+    """
+    properties = {**load_mapping_properties(mapping_file), **PIPELINE_FIELDS}
+    fields = tuple(field for field in properties if field.isidentifier() and not hasattr(Record, field))
+    converters = {}
+    for field in fields:
+        convert = CONVERTERS.get(properties[field], lambda field, value: value)
+        if field in interned and convert is keyword_value:
+            convert = interned_keyword_value
+        converters[field] = convert
+    return type(name, (Record,), {
+        "__slots__": fields,
+        "FIELDS": fields,
+        "CONVERTERS": converters,
+        "PREFIXES": tuple((field, dumps_compact(field) + b":") for field in fields),
+        "MAX_EXTRA_FIELDS": max_extra_fields,
+    })
@@ -0,0 +1,249 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import argparse
+import fnmatch
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from utils.archive_utils import SEGMENT_SUFFIX, COMPRESSED_SUFFIX, compress_segment, migrate_files
+from utils.log_utils import logger, compress_log_file
+
+DAY_SECONDS = 86400
+
+# 目录类型 -> 过期删除的文件
+DIRECTORY_PATTERNS = {
+    "archive": ("*.json", "*" + SEGMENT_SUFFIX, "*" + COMPRESSED_SUFFIX),
+    "logs": ("*.log", "*.log.gz"),
+}
+
+
+def compress_keeping_mtime(compress, path, compressed_path):
+    """
+    Compresses path with compress(path) and gives the result the modification time of
+    the original, so that max_age_days still counts from the last write.
+    Returns True when path was compressed.
+    """
+    mtime = os.path.getmtime(path)
+    compress(path)
+    if os.path.exists(path) or not os.path.exists(compressed_path):
+        return False
+    os.utime(compressed_path, (mtime, mtime))
+    return True
+
+
+class RetentionJob:
+    """
+    Periodically applies retention policies to storage indexes and local directories.
+
+    Index policies map an index name to {"field": date field, "max_age_days": n}; the
+    documents older than max_age_days are removed with StorageBackend.expire_documents
+    (whole partitions first, then a throttled delete_by_query task on Elasticsearch).
+    A policy without max_age_days keeps the data.
+
+    Directory policies map a directory to {"kind": "archive" | "logs",
+    "compress_after_days": n, "max_age_days": n}:
+      - archive: legacy *.json files are folded into compressed segments and segments
+        left uncompressed (e.g. after a crash) are gzip'ed once compress_after_days old;
+        a segment is only touched when it was opened more than segment_max_age seconds
+        before that, so it can no longer receive writes (the archive rotates it first).
+      - logs: *.log files of earlier days are gzip'ed, including the date folders.
+    Files not modified for max_age_days are deleted; empty subdirectories are removed.
+
+    Args:
+        get_storage (callable): Returns the storage backend, or None while it is unavailable.
+        index_policies (dict): index name -> policy.
+        directory_policies (dict): directory -> policy.
+        interval (float): Seconds between two runs.
+        delete_options (dict): Extra arguments for expire_documents, e.g. requests_per_second.
+        segment_max_age (float): ARCHIVE_SEGMENT_MAX_AGE_SECONDS of the archive writers.
+        initial_delay (float): Seconds before the first run, so it does not compete with startup.
+    """
+
+    def __init__(self, get_storage, index_policies=None, directory_policies=None, interval=3600, delete_options=None,
+                 segment_max_age=3600, initial_delay=60):
+        self.get_storage = get_storage
+        self.index_policies = index_policies or {}
+        self.directory_policies = directory_policies or {}
+        self.interval = interval
+        self.delete_options = delete_options or {}
+        self.segment_max_age = segment_max_age
+        self.initial_delay = initial_delay
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+
+        self.runs = 0
+        self.failures = 0
+        self.last_run_at = None
+        self.deleted = {"documents": 0, "indexes": 0, "files": 0}
+        self.compacted_files = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="retention", daemon=True)
+        self.thread.start()
+        logger.info(f"Retention job started (interval={self.interval}s, indexes={list(self.index_policies)}, directories={list(self.directory_policies)})")
+        return self
+
+    def close(self, timeout=5):
+        """Stops the scheduler; a delete_by_query task already started keeps running in ES."""
+        if self.thread is None:
+            return
+        self.stopping.set()
+        self.thread.join(timeout)
+        self.thread = None
+
+    def stats(self):
+        with self.lock:
+            return {
+                "runs": self.runs,
+                "failures": self.failures,
+                "last_run_at": self.last_run_at,
+                "deleted": dict(self.deleted),
+                "compacted_files": self.compacted_files,
+            }
+
+    def _run(self):
+        delay = self.initial_delay
+        while not self.stopping.wait(delay):
+            self.run_once()
+            delay = self.interval
+
+    def run_once(self):
+        """Applies every policy once; a failing policy is logged and does not stop the others."""
+        started = time.time()
+        for directory, policy in self.directory_policies.items():
+            self._apply("directory", directory, lambda: self.apply_directory_policy(directory, policy))
+        for index_name, policy in self.index_policies.items():
+            if policy.get("max_age_days") is not None:
+                self._apply("index", index_name, lambda: self.apply_index_policy(index_name, policy))
+        with self.lock:
+            self.runs += 1
+            self.last_run_at = datetime.fromtimestamp(started).isoformat(timespec="seconds")
+        logger.info(f"Retention run completed in {time.time() - started:.1f}s: {self.stats()}")
+
+    def _apply(self, kind, name, apply):
+        try:
+            apply()
+        except Exception as e:
+            with self.lock:
+                self.failures += 1
+            logger.error(f"Retention of {kind} {name} failed: {e}")
+
+    def apply_index_policy(self, index_name, policy):
+        storage = self.get_storage()
+        if storage is None:
+            logger.info(f"Storage unavailable, retention of {index_name} skipped")
+            return None
+        before = int((time.time() - policy["max_age_days"] * DAY_SECONDS) * 1000)
+        result = storage.expire_documents(index_name, policy.get("field", "timestamp"), before, **self.delete_options)
+        with self.lock:
+            self.deleted["indexes"] += len(result.get("dropped_indexes", []))
+            self.deleted["documents"] += result.get("deleted", 0)
+        return result
+
+    def apply_directory_policy(self, directory, policy):
+        if not os.path.isdir(directory):
+            return
+        kind = policy.get("kind", "archive")
+        if kind not in DIRECTORY_PATTERNS:
+            raise ValueError(f"Unknown directory kind: {kind}")
+        # 先删除过期文件，避免把即将过期的文件合并或压缩成新文件
+        if policy.get("max_age_days") is not None:
+            self._expire_files(directory, DIRECTORY_PATTERNS[kind], policy["max_age_days"] * DAY_SECONDS, recursive=kind == "logs")
+        compress_after = policy.get("compress_after_days")
+        if compress_after is not None:
+            if kind == "archive":
+                self._compact_archive(directory, compress_after * DAY_SECONDS)
+            else:
+                self._compress_logs(directory, compress_after)
+
+    def _compact_archive(self, directory, min_age):
+        compacted = migrate_files(directory, delete=True, min_age=min_age)["migrated"]
+
+        now = time.time()
+        opened_before = datetime.fromtimestamp(now - min_age - self.segment_max_age).strftime("%Y%m%d_%H%M%S")
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            # 段文件名以打开时间开头，例如 20250815_103000_123456_w0.ndjson
+            if name.endswith(SEGMENT_SUFFIX) and name[:15] < opened_before and os.path.getmtime(path) < now - min_age:
+                compacted += compress_keeping_mtime(compress_segment, path, path[:-len(SEGMENT_SUFFIX)] + COMPRESSED_SUFFIX)
+        with self.lock:
+            self.compacted_files += compacted
+
+    def _compress_logs(self, directory, days):
+        last_day = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+        compacted = 0
+        for root, _, names in os.walk(directory):
+            for name in names:
+                # 日志文件名以日期开头，例如 2025-08-15.worker0.log
+                if name.endswith(".log") and name[:10].count("-") == 2 and name[:10] < last_day:
+                    path = os.path.join(root, name)
+                    compacted += compress_keeping_mtime(compress_log_file, path, path + ".gz")
+        with self.lock:
+            self.compacted_files += compacted
+
+    def _expire_files(self, directory, patterns, max_age, recursive):
+        cutoff = time.time() - max_age
+        deleted = 0
+        # 递归时自底向上遍历，先清空日期目录再尝试删除目录本身
+        for root, _, names in os.walk(directory, topdown=not recursive):
+            for name in names:
+                path = os.path.join(root, name)
+                if not any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns):
+                    continue
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        deleted += 1
+                except FileNotFoundError:
+                    continue
+            if root != directory:
+                try:
+                    os.rmdir(root)  # 只删除已清空的日期目录
+                except OSError:
+                    pass
+            if not recursive:
+                break
+        if deleted:
+            logger.info(f"Deleted {deleted} files older than {max_age / DAY_SECONDS:g} days from {directory}")
+        with self.lock:
+            self.deleted["files"] += deleted
+
+
+if __name__ == "__main__":
+    from config import (
+        STORAGE_BACKEND, SQLITE_PATH, ES_PARTITION_INTERVAL, TOKEN_TIME_WINDOW_MINUTES, ARCHIVE_SEGMENT_MAX_AGE_SECONDS,
+        INDEX_NAME_LINECHANGES, MAPPING_FILE_LINECHANGES, INDEX_NAME_ROLLUP, MAPPING_FILE_ROLLUP,
+        RETENTION_INDEX_POLICIES, RETENTION_DIRECTORY_POLICIES, RETENTION_DELETE_OPTIONS
+    )
+
+    parser = argparse.ArgumentParser(description="Apply the retention policies once (e.g. from cron)")
+    parser.add_argument("--skip-indexes", action="store_true", help="只处理本地目录，不删除索引中的数据")
+    args = parser.parse_args()
+
+    storage = None
+    if not args.skip_indexes:
+        if STORAGE_BACKEND == "sqlite":
+            from utils.sqlite_utils import SQLiteManager
+            storage = SQLiteManager(SQLITE_PATH)
+            # 读取已有表的列定义
+            storage.check_and_create_indexes({INDEX_NAME_LINECHANGES: MAPPING_FILE_LINECHANGES, INDEX_NAME_ROLLUP: MAPPING_FILE_ROLLUP})
+        else:
+            from utils.es_utils import ElasticsearchManager
+            storage = ElasticsearchManager(
+                partitions={INDEX_NAME_LINECHANGES: ES_PARTITION_INTERVAL} if ES_PARTITION_INTERVAL else None,
+                partition_skew=TOKEN_TIME_WINDOW_MINUTES * 60
+            )
+
+    job = RetentionJob(
+        lambda: storage,
+        index_policies={} if args.skip_indexes else RETENTION_INDEX_POLICIES,
+        directory_policies=RETENTION_DIRECTORY_POLICIES,
+        delete_options=RETENTION_DELETE_OPTIONS,
+        segment_max_age=ARCHIVE_SEGMENT_MAX_AGE_SECONDS
+    )
+    job.run_once()
+    print(json.dumps(job.stats()))
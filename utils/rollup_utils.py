@@ -0,0 +1,184 @@
+import hashlib
+import threading
+import time
+from utils.log_utils import logger
+import utils.time_utils as time_utils
+
+# 聚合粒度 -> 桶长度（秒）
+INTERVAL_SECONDS = {"minute": 60, "hour": 3600, "day": 86400}
+
+# 聚合维度与累加字段
+DIMENSIONS = ("githubUsername", "model", "language", "gitUrl")
+COUNTERS = ("added", "removed", "count")
+
+
+def bucket_start(epoch, interval):
+    seconds = INTERVAL_SECONDS[interval]
+    start = int(epoch // seconds * seconds)
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(start))
+
+
+def rollup_id(interval, timestamp, key):
+    """Deterministic document id, so every flush and worker upserts the same rollup row."""
+    raw = "\x1f".join((interval, timestamp) + tuple("" if value is None else str(value) for value in key))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+class RollupAggregator:
+    """
+    In-memory pre-aggregation of line-change records for dashboards.
+
+    add() sums added / removed lines and counts records per time bucket (one row per
+    configured interval: minute, hour or day) and per githubUsername / model / language /
+    gitUrl. A daemon thread hands the pending rows to flush every flush_interval seconds
+    (or as soon as max_keys rows are pending); flush applies them as increments, so rows
+    from several flushes and worker processes add up in the rollup index.
+
+    Rows whose flush fails are merged back into the pending rows and retried on the next
+    flush. A flush that fails after the backend applied it (e.g. a timeout) can count
+    those rows twice; the raw index stays the source of truth.
+
+    Timestamps are read like the record layer and Elasticsearch read them (epoch
+    milliseconds or ISO 8601). Records whose timestamp cannot be parsed are counted
+    in invalid_timestamps and left out of the rollups rather than bucketed at the
+    current time.
+
+    Args:
+        flush (callable): Called as flush(documents) with (index_name, doc) tuples; returns
+            (index_name, doc_id, error) for every row that failed, like bulk_write.
+        index_name (str): Rollup index the rows are written to.
+        intervals (tuple): Bucket sizes, keys of INTERVAL_SECONDS.
+        flush_interval (float): Seconds between flushes.
+        max_keys (int): Flush early when this many rows are pending.
+    """
+
+    def __init__(self, flush, index_name, intervals=("hour",), flush_interval=10.0, max_keys=100000):
+        for interval in intervals:
+            if interval not in INTERVAL_SECONDS:
+                raise ValueError(f"Unknown rollup interval: {interval}")
+        self.flush = flush
+        self.index_name = index_name
+        self.intervals = tuple(intervals)
+        self.flush_interval = flush_interval
+        self.max_keys = max_keys
+        self.lock = threading.Lock()
+        self.pending = {}  # (interval, bucket timestamp, dimension values) -> [added, removed, count]
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = None
+
+        self.records = 0
+        self.invalid_timestamps = 0
+        self.flushed_rows = 0
+        self.failed_flushes = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="rollup-flusher", daemon=True)
+        self.thread.start()
+        logger.info(f"Rollup aggregator started (intervals={self.intervals}, flush_interval={self.flush_interval}s)")
+        return self
+
+    def add(self, record):
+        """Adds one line-change record; returns False and skips it when its timestamp cannot be parsed."""
+        millis = time_utils.to_epoch_millis(record.get("timestamp"))
+        if millis is None:
+            with self.lock:
+                self.invalid_timestamps += 1
+            logger.warning(f"Record {record.get('id')} has an invalid timestamp {record.get('timestamp')!r}, not added to rollups")
+            return False
+        epoch = millis / 1000
+        key = tuple(record.get(field) for field in DIMENSIONS)
+        added, removed = to_int(record.get("added")), to_int(record.get("removed"))
+        with self.lock:
+            for interval in self.intervals:
+                row = (interval, bucket_start(epoch, interval), key)
+                counters = self.pending.get(row)
+                if counters is None:
+                    counters = self.pending[row] = [0, 0, 0]
+                counters[0] += added
+                counters[1] += removed
+                counters[2] += 1
+            self.records += 1
+            full = len(self.pending) >= self.max_keys
+        if full:
+            self.wakeup.set()
+        return True
+
+    def close(self, timeout=30):
+        """Flush the pending rows and stop the flusher thread."""
+        if self.thread is None:
+            return
+        self.stopping.set()
+        self.wakeup.set()
+        self.thread.join(timeout)
+        self.thread = None
+
+    def stats(self):
+        with self.lock:
+            pending = len(self.pending)
+        return {
+            "pending_rows": pending,
+            "records": self.records,
+            "invalid_timestamps": self.invalid_timestamps,
+            "flushed_rows": self.flushed_rows,
+            "failed_flushes": self.failed_flushes,
+        }
+
+    def _run(self):
+        while not self.stopping.is_set():
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            if not self._flush():
+                # 写入失败后等待一个完整周期再重试，max_keys 不会触发连续重试
+                self.stopping.wait(self.flush_interval)
+        self._flush()
+
+    def _flush(self):
+        """Returns False when the flush request failed as a whole."""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return True
+
+        updated_at = time_utils.current_iso8601_time()
+        documents = []
+        rows = {}
+        for (interval, timestamp, key), counters in pending.items():
+            doc = dict(zip(DIMENSIONS, key))
+            doc.update(zip(COUNTERS, counters))
+            doc.update(id=rollup_id(interval, timestamp, key), interval=interval, timestamp=timestamp, last_updated_at=updated_at)
+            documents.append((self.index_name, doc))
+            rows[doc["id"]] = (interval, timestamp, key)
+
+        try:
+            errors = self.flush(documents)
+        except Exception as e:
+            logger.warning(f"Rollup flush of {len(documents)} rows failed, retrying later: {e}")
+            self.failed_flushes += 1
+            self._requeue(pending)
+            return False
+
+        for index_name, doc_id, error in errors:
+            logger.error(f"Failed to write rollup {doc_id} into [{index_name}]: {error}")
+        failed = {rows[doc_id]: pending[rows[doc_id]] for _, doc_id, _ in errors if doc_id in rows}
+        self._requeue(failed)
+        self.flushed_rows += len(documents) - len(failed)
+        logger.debug(f"Rollup flushed {len(documents)} rows, {len(failed)} failed")
+        return True
+
+    def _requeue(self, rows):
+        with self.lock:
+            for row, counters in rows.items():
+                current = self.pending.get(row)
+                if current is None:
+                    self.pending[row] = counters
+                else:
+                    for i, value in enumerate(counters):
+                        current[i] += value
@@ -0,0 +1,281 @@
+import functools
+import glob
+import json
+import os
+import threading
+import time
+from utils.archive_utils import SegmentArchive, SEGMENT_SUFFIX, segment_sequence
+from utils.log_utils import logger
+from utils.json_utils import EncodedDocument, dumps_compact, encode
+import utils.time_utils as time_utils
+
+CHECKPOINT_FILE = "checkpoint.json"
+DEAD_LETTER_FILE = "dead_letter.jsonl"
+
+# bulk item errors worth retrying later instead of dead-lettering
+RETRYABLE_ERROR_TYPES = {
+    "es_rejected_execution_exception",
+    "circuit_breaking_exception",
+    "unavailable_shards_exception",
+    "cluster_block_exception",
+}
+
+
+@functools.lru_cache(maxsize=64)
+def entry_prefix(index_name):
+    """Start of a spool line up to the document: {"index":"<index_name>","doc":"""
+    return b'{"index":' + dumps_compact(index_name) + b',"doc":'
+
+
+def segment_order(name):
+    """
+    Sort key of a spool segment: its sequence number. Segments named by time, left by
+    versions before numbered segments, come first in name order.
+    """
+    sequence = segment_sequence(name)
+    return (0, 0, name) if sequence is None else (1, sequence, "")
+
+
+class DurableSpool:
+    """
+    Disk-backed FIFO queue of (index_name, doc) entries between ingest and the ES writer.
+
+    Entries are appended to NDJSON segments (written by SegmentArchive, uncompressed).
+    A consumer reads batches from the checkpoint, and commit() persists the position
+    atomically once the batch has been handled; fully consumed segments are deleted.
+    A crash between read and commit only causes the batch to be read again.
+
+    Segments are numbered in the order they are opened and the checkpoint records the
+    sequence of its segment, so the order does not depend on the wall clock and numbers
+    are never reused after the consumed segments have been deleted.
+
+    Entries are written as {"index":...,"doc":<document>} with the encoded bytes of an
+    EncodedDocument spliced in, and read back as EncodedDocuments carrying the same bytes,
+    so a document received from a client is not serialized again before _bulk.
+    """
+
+    def __init__(self, directory, max_bytes=16 * 1024 * 1024, fsync_every=100, fsync_interval=1.0):
+        self.directory = directory
+        self.checkpoint_path = os.path.join(directory, CHECKPOINT_FILE)
+        os.makedirs(directory, exist_ok=True)
+        self.segment, self.sequence, self.offset = self._load_checkpoint()
+        # 新段的编号接在已有段和检查点之后，段被删除后也不会重复使用
+        sequences = [segment_sequence(name) for name in self.segments()] + [self.sequence]
+        next_sequence = max((sequence for sequence in sequences if sequence is not None), default=-1) + 1
+        self.writer = SegmentArchive(directory, max_bytes=max_bytes, fsync_every=fsync_every, fsync_interval=fsync_interval, compress=False, sequence=next_sequence).start()
+
+    def append(self, index_name, doc):
+        doc.setdefault('last_updated_at', time_utils.current_iso8601_time())
+        self.writer.append_encoded(entry_prefix(index_name) + encode(doc) + b"}")
+
+    def close(self):
+        self.writer.close()
+
+    def segments(self):
+        return sorted((os.path.basename(path) for path in glob.glob(os.path.join(self.directory, "*" + SEGMENT_SUFFIX))), key=segment_order)
+
+    def read_batch(self, max_entries):
+        """
+        Read up to max_entries entries after the checkpoint.
+
+        Returns:
+            tuple: (entries, position) where entries is a list of (index_name, doc) and
+            position is the (segment, offset) to pass to commit().
+        """
+        entries = []
+        segment, offset = self.segment, self.offset
+        segments = self.segments()
+        if segment is None or segment not in segments:
+            # 首次启动或检查点所在段已被删除：从最早的段开始
+            later = [name for name in segments if segment is None or segment_order(name) > segment_order(segment)]
+            if not later:
+                return entries, (segment, offset)
+            segment, offset = later[0], 0
+
+        while len(entries) < max_entries:
+            path = os.path.join(self.directory, segment)
+            with open(path, "rb") as f:
+                f.seek(offset)
+                while len(entries) < max_entries:
+                    line = f.readline()
+                    if not line.endswith(b"\n"):
+                        # 写入方尚未写完这一行（或已到段末尾）
+                        break
+                    offset += len(line)
+                    try:
+                        entry = json.loads(line)
+                        index_name, doc = entry["index"], entry["doc"]
+                        prefix = entry_prefix(index_name)
+                        if line.startswith(prefix) and line.endswith(b"}\n"):
+                            doc = EncodedDocument(doc, line[len(prefix):-2])
+                        entries.append((index_name, doc))
+                    except (ValueError, KeyError) as e:
+                        logger.error(f"Skipping corrupt spool entry in {segment} at offset {offset - len(line)}: {e}")
+                at_end = not line
+                has_partial_tail = bool(line) and not line.endswith(b"\n")
+
+            later = [name for name in segments if segment_order(name) > segment_order(segment)]
+            if len(entries) >= max_entries or not later:
+                break
+            if at_end or has_partial_tail:
+                if has_partial_tail:
+                    # 崩溃留下的不完整行：后面已有新段，说明不会再被补全
+                    logger.error(f"Skipping truncated spool entry at the end of {segment}")
+                segment, offset = later[0], 0
+        return entries, (segment, offset)
+
+    def commit(self, position):
+        """Persist the checkpoint and delete segments that are fully consumed."""
+        segment, offset = position
+        if segment is None:
+            return
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"segment": segment, "sequence": segment_sequence(segment), "offset": offset}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+        self.segment, self.offset = segment, offset
+        if segment_sequence(segment) is not None:
+            self.sequence = segment_sequence(segment)
+
+        for name in self.segments():
+            if segment_order(name) < segment_order(segment) and name != self.writer.segment_name:
+                os.remove(os.path.join(self.directory, name))
+
+    def pending_bytes(self):
+        """Approximate number of spooled bytes not yet committed."""
+        total = 0
+        for name in self.segments():
+            if self.segment is not None and segment_order(name) < segment_order(self.segment):
+                continue
+            try:
+                size = os.path.getsize(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            total += size - self.offset if name == self.segment else size
+        return total
+
+    def dead_letter(self, index_name, doc, error):
+        with open(os.path.join(self.directory, DEAD_LETTER_FILE), "a", encoding="utf-8") as f:
+            f.write(json.dumps({"index": index_name, "doc": doc, "error": error}, ensure_ascii=False) + "\n")
+
+    def _load_checkpoint(self):
+        try:
+            with open(self.checkpoint_path, "r") as f:
+                checkpoint = json.load(f)
+            segment = checkpoint["segment"]
+            sequence = checkpoint.get("sequence")
+            if sequence is None and segment is not None:
+                sequence = segment_sequence(segment)
+            return segment, sequence, checkpoint["offset"]
+        except FileNotFoundError:
+            return None, None, 0
+        except (ValueError, KeyError) as e:
+            logger.error(f"Invalid spool checkpoint {self.checkpoint_path}, replaying from the oldest segment: {e}")
+            return None, None, 0
+
+
+class SpoolReplayer:
+    """
+    Background thread that drains a DurableSpool into Elasticsearch.
+
+    write_batch(documents) must return the per-document errors like
+    ElasticsearchManager.bulk_write, and raise while ES is unreachable. Failed
+    batches are retried with exponential backoff and the checkpoint only moves
+    once a batch has been written, so an outage just makes the spool grow.
+    Replay is throttled to max_rate documents per second so a large backlog
+    does not overload the cluster when it comes back.
+    """
+
+    def __init__(self, spool, write_batch, primary_key="id", batch_size=500, max_rate=2000, max_backoff=60, idle_interval=0.2):
+        self.spool = spool
+        self.write_batch = write_batch
+        self.primary_key = primary_key
+        self.batch_size = batch_size
+        self.max_rate = max_rate
+        self.max_backoff = max_backoff
+        self.idle_interval = idle_interval
+        self.stopping = threading.Event()
+        self.thread = None
+
+        self.replayed = 0
+        self.requeued = 0
+        self.dead_lettered = 0
+        self.failed_batches = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="spool-replayer", daemon=True)
+        self.thread.start()
+        logger.info(f"Spool replayer started (batch_size={self.batch_size}, max_rate={self.max_rate}/s)")
+        return self
+
+    def close(self, timeout=10):
+        if self.thread is None:
+            return
+        self.stopping.set()
+        self.thread.join(timeout)
+        self.thread = None
+
+    def stats(self):
+        return {
+            "pending_bytes": self.spool.pending_bytes(),
+            "replayed": self.replayed,
+            "requeued": self.requeued,
+            "dead_lettered": self.dead_lettered,
+            "failed_batches": self.failed_batches,
+        }
+
+    def _run(self):
+        backoff = 1.0
+        while not self.stopping.is_set():
+            entries, position = self.spool.read_batch(self.batch_size)
+            if not entries:
+                if position != (self.spool.segment, self.spool.offset):
+                    self.spool.commit(position)
+                self.stopping.wait(self.idle_interval)
+                continue
+
+            started = time.monotonic()
+            try:
+                self._replay(entries)
+            except Exception as e:
+                self.failed_batches += 1
+                logger.warning(f"Spool replay failed, retrying in {backoff:.0f}s: {e}")
+                self.stopping.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+
+            backoff = 1.0
+            self.spool.commit(position)
+            # 限制回放速率，避免 ES 恢复后被积压数据压垮
+            min_duration = len(entries) / self.max_rate if self.max_rate else 0
+            self.stopping.wait(max(0.0, min_duration - (time.monotonic() - started)))
+
+    def _replay(self, entries):
+        # 同一批次内对同一文档的多次写入合并为一次
+        pending = {}
+        for index_name, doc in entries:
+            key = (index_name, doc.get(self.primary_key))
+            if key in pending:
+                pending[key][1].update(doc)
+            else:
+                pending[key] = (index_name, doc)
+        documents = list(pending.values())
+
+        errors = self.write_batch(documents)
+        failed = {(index_name, doc_id): error for index_name, doc_id, error in errors}
+        for key, (index_name, doc) in pending.items():
+            if key not in failed:
+                continue
+            error = failed[key]
+            error_type = error.get("type") if isinstance(error, dict) else None
+            if error_type in RETRYABLE_ERROR_TYPES:
+                # 可重试的错误重新追加到队尾，稍后再写
+                self.spool.append(index_name, doc)
+                self.requeued += 1
+            else:
+                logger.error(f"Dead-lettering document {key[1]} for [{index_name}]: {error}")
+                self.spool.dead_letter(index_name, doc, error)
+                self.dead_lettered += 1
+        self.replayed += len(documents) - len(failed)
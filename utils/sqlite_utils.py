@@ -0,0 +1,492 @@
+import fnmatch
+import json
+import os
+import sqlite3
+import threading
+from urllib.request import pathname2url
+
+from utils.json_utils import encode
+from utils.log_utils import logger
+from utils.metrics_utils import timed, es_request_duration, es_errors_total
+from utils.storage_utils import StorageBackend, apply_update_condition, load_mapping_properties
+import utils.time_utils as time_utils
+from utils.time_utils import to_epoch_millis
+
+# Elasticsearch 字段类型 -> SQLite 列类型；date 字段保存为 epoch 毫秒，便于范围查询与排序
+COLUMN_TYPES = {
+    "keyword": "TEXT",
+    "text": "TEXT",
+    "date": "INTEGER",
+    "integer": "INTEGER",
+    "long": "INTEGER",
+    "short": "INTEGER",
+    "byte": "INTEGER",
+    "boolean": "INTEGER",
+    "float": "REAL",
+    "double": "REAL",
+}
+
+def quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def json_path(field):
+    """SQL string literal of the JSON path of a field, e.g. '$."model"' or '$."a"."b"' for "a.b"."""
+    path = '$' + ''.join('.' + json.dumps(part) for part in field.split('.'))
+    return "'" + path.replace("'", "''") + "'"
+
+
+def project(source, fields):
+    """Keeps the fields of source matching fields (wildcards allowed), like _source filtering."""
+    if not fields:
+        return source
+    return {key: value for key, value in source.items() if any(fnmatch.fnmatchcase(key, field) for field in fields)}
+
+
+class SQLiteManager(StorageBackend):
+    """
+    Embedded storage backend: one SQLite table per index, for deployments without
+    an Elasticsearch cluster.
+
+    Every mapped field becomes a column (date fields as epoch milliseconds) and the
+    full document is kept as JSON in the _source column, so unmapped fields can still
+    be returned and queried. indexed_fields get a B-tree index each. Writes merge into
+    the existing row like an Elasticsearch partial update, and bulk_write inserts the
+    whole batch in one transaction.
+
+    query_from_es / count_documents accept the subset of the query DSL used for
+    line-change metrics: match_all, term, terms, match, range, exists, prefix, ids
+    and bool (must / filter / should / must_not). Other queries log an error and
+    return [] / 0, like a failed Elasticsearch request.
+
+    The connection is shared by the request, replay and bulk writer threads behind a
+    lock; WAL mode lets pre-fork workers write to the same database file.
+    """
+
+    def __init__(self, path, primary_key="id", indexed_fields=(), busy_timeout=30):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.primary_key = primary_key
+        self.indexed_fields = tuple(indexed_fields)
+        self.lock = threading.Lock()
+        self.tables = {}  # index name -> {column: Elasticsearch type}
+        self.conn = sqlite3.connect(path, timeout=busy_timeout, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        logger.info(f"Using SQLite storage at {path}")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def ping(self):
+        with self.lock:
+            self.conn.execute("SELECT 1").fetchone()
+        return True
+
+    def check_and_create_indexes(self, indexes={}):
+        for index_name, mapping_file in indexes.items():
+            self._create_table(index_name, load_mapping_properties(mapping_file))
+
+    def _create_table(self, index_name, properties):
+        columns = {field: type for field, type in properties.items() if type in COLUMN_TYPES}
+        columns.setdefault(self.primary_key, "keyword")
+        definitions = []
+        for field, type in columns.items():
+            definition = f"{quote(field)} {COLUMN_TYPES[type]}"
+            if field == self.primary_key:
+                definition += " PRIMARY KEY"
+            definitions.append(definition)
+        definitions.append("_source TEXT NOT NULL")
+
+        with self.lock:
+            exists = self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (index_name,)).fetchone()
+            self.conn.execute(f"CREATE TABLE IF NOT EXISTS {quote(index_name)} ({', '.join(definitions)})")
+            for field in self.indexed_fields:
+                if field in columns:
+                    self.conn.execute(
+                        f"CREATE INDEX IF NOT EXISTS {quote(f'idx_{index_name}_{field}')} "
+                        f"ON {quote(index_name)} ({quote(field)})")
+            # 以已有表的实际列为准（映射文件新增字段不会自动加列）
+            existing = {row[1] for row in self.conn.execute(f"PRAGMA table_info({quote(index_name)})")}
+        self.tables[index_name] = {field: type for field, type in columns.items() if field in existing}
+        logger.info(f"{'table already exists' if exists else 'created table'}: {index_name}")
+
+    def _columns(self, index_name):
+        columns = self.tables.get(index_name)
+        if columns is None:
+            # 与 ES 的自动创建索引一致：未知索引只有主键和 _source 两列
+            self._create_table(index_name, {})
+            columns = self.tables[index_name]
+        return columns
+
+    def _upsert_sql(self, index_name, columns):
+        table = quote(index_name)
+        names = list(columns)
+        assignments = []
+        for field in names:
+            if field == self.primary_key:
+                continue
+            # 文档中出现的字段（包括 null）覆盖原值，未出现的字段保留原值，与 json_patch 合并 _source 一致
+            assignments.append(
+                f"{quote(field)} = CASE WHEN json_type(excluded._source, {json_path(field)}) IS NULL "
+                f"THEN {table}.{quote(field)} ELSE excluded.{quote(field)} END")
+        assignments.append(f"_source = json_patch({table}._source, excluded._source)")
+        return self._insert_sql(index_name, names, assignments)
+
+    def _insert_sql(self, index_name, names, assignments):
+        return (
+            f"INSERT INTO {quote(index_name)} ({', '.join(quote(name) for name in names)}, _source) "
+            f"VALUES ({', '.join('?' for _ in names)}, ?) "
+            f"ON CONFLICT({quote(self.primary_key)}) DO UPDATE SET {', '.join(assignments)}"
+        )
+
+    def _row(self, columns, data):
+        row = []
+        for field, type in columns.items():
+            value = data.get(field)
+            if type == "date":
+                value = to_epoch_millis(value)
+            elif isinstance(value, (dict, list)):
+                value = json.dumps(value, ensure_ascii=False)
+            row.append(value)
+        row.append(encode(data).decode("utf-8"))
+        return row
+
+    @timed(es_request_duration, "write", errors=es_errors_total)
+    def write_to_es(self, index_name, data, update_condition=None, mode=None):
+        """
+        Writes one document, merging it into an existing row with the same id.
+        mode is accepted for compatibility with ElasticsearchManager and ignored.
+        """
+        data['last_updated_at'] = time_utils.current_iso8601_time()
+        doc_id = data.get(self.primary_key)
+        columns = self._columns(index_name)
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                if update_condition:
+                    existing = self.conn.execute(
+                        f"SELECT _source FROM {quote(index_name)} WHERE {quote(self.primary_key)} = ?", (doc_id,)).fetchone()
+                    if existing:
+                        apply_update_condition(index_name, doc_id, json.loads(existing[0]), data, update_condition)
+                self.conn.execute(self._upsert_sql(index_name, columns), self._row(columns, data))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        logger.debug(f'[upserted] to [{index_name}]: {data}')
+
+    @timed(es_request_duration, "bulk", errors=es_errors_total)
+    def bulk_write(self, documents):
+        """
+        Writes (index_name, data) tuples in a single transaction. Documents without the
+        primary key are reported as errors; any other failure rolls back and raises, so
+        the spool replayer retries the whole batch.
+        """
+        errors = []
+        batches = {}
+        for index_name, data in documents:
+            if data.get(self.primary_key) is None:
+                errors.append((index_name, None, f"missing {self.primary_key}"))
+                continue
+            batches.setdefault(index_name, []).append(data)
+
+        statements = []
+        for index_name, batch in batches.items():
+            columns = self._columns(index_name)
+            statements.append((self._upsert_sql(index_name, columns), [self._row(columns, data) for data in batch]))
+
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                for sql, rows in statements:
+                    self.conn.executemany(sql, rows)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return errors
+
+    @timed(es_request_duration, "bulk", errors=es_errors_total)
+    def bulk_increment(self, documents, fields):
+        """
+        Upserts (index_name, data) tuples in a single transaction, adding the values of
+        fields to an existing row; the other fields are merged like bulk_write.
+        """
+        batches = {}
+        for index_name, data in documents:
+            batches.setdefault(index_name, []).append(data)
+
+        statements = []
+        for index_name, batch in batches.items():
+            columns = self._columns(index_name)
+            statements.append((self._increment_sql(index_name, columns, fields), [self._row(columns, data) for data in batch]))
+
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                for sql, rows in statements:
+                    self.conn.executemany(sql, rows)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return []
+
+    def _increment_sql(self, index_name, columns, fields):
+        table = quote(index_name)
+        names = list(columns)
+        assignments = []
+        totals = []
+        for field in fields:
+            path = json_path(field)
+            total = f"COALESCE(json_extract({table}._source, {path}), 0) + COALESCE(json_extract(excluded._source, {path}), 0)"
+            if field in columns:
+                assignments.append(f"{quote(field)} = {total}")
+            totals.append(f"{path}, {total}")
+        # 在 DO UPDATE 中引用的列都是更新前的值，计数字段按 _source 中的原值累加
+        source = f"json_patch({table}._source, excluded._source)"
+        if totals:
+            source = f"json_set({source}, {', '.join(totals)})"
+        assignments.append(f"_source = {source}")
+        return self._insert_sql(index_name, names, assignments)
+
+    @timed(es_request_duration, "search", errors=es_errors_total)
+    def query_from_es(self, index_name, query, fields=None, sort=None, size=10000):
+        """
+        Executes a query DSL search on the table of index_name, see ElasticsearchManager.query_from_es.
+
+        Returns:
+            list: The _source of each matching document, restricted to fields when given.
+        """
+        try:
+            columns = self.tables.get(index_name)
+            if columns is None:
+                logger.warning(f"Index '{index_name}' not found.")
+                return []
+            where, params = self._translate(query, columns)
+            sql = f"SELECT _source FROM {quote(index_name)} WHERE {where}{self._order_by(sort, columns)} LIMIT ?"
+            with self.lock:
+                rows = self.conn.execute(sql, params + [size]).fetchall()
+        except Exception as e:
+            logger.error(f"Error querying SQLite: {e}")
+            return []
+        return [project(json.loads(row[0]), fields) for row in rows]
+
+    def scan(self, index_name, query=None, fields=None, sort=None, page_size=1000, slices=None, keep_alive=None):
+        """
+        Yields the _source of every matching document, fetching page_size rows at a time.
+
+        The rows are read in one read transaction on a separate read-only connection,
+        which sees a consistent snapshot like an Elasticsearch point in time and does
+        not hold the writer lock between pages. slices and keep_alive are accepted for
+        compatibility with ElasticsearchManager.scan and ignored.
+        """
+        columns = self.tables.get(index_name)
+        if columns is None:
+            raise ValueError(f"no such index [{index_name}]")
+        where, params = self._translate(query, columns)
+        uri = "file:" + pathname2url(os.path.abspath(self.path)) + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, isolation_level=None, check_same_thread=False)
+        try:
+            conn.execute("BEGIN")
+            cursor = conn.execute(
+                f"SELECT _source FROM {quote(index_name)} WHERE {where}{self._order_by(sort, columns)}", params)
+            while True:
+                rows = cursor.fetchmany(page_size)
+                if not rows:
+                    return
+                for row in rows:
+                    yield project(json.loads(row[0]), fields)
+        finally:
+            conn.close()
+
+    @timed(es_request_duration, "count", errors=es_errors_total)
+    def count_documents(self, index_name, query):
+        """Counts the documents of index_name matching the query DSL query."""
+        try:
+            columns = self.tables.get(index_name)
+            if columns is None:
+                logger.warning(f"Index '{index_name}' not found.")
+                return 0
+            where, params = self._translate(query, columns)
+            with self.lock:
+                return self.conn.execute(f"SELECT COUNT(*) FROM {quote(index_name)} WHERE {where}", params).fetchone()[0]
+        except Exception as e:
+            logger.error(f"Error counting documents in SQLite: {e}")
+            return 0
+
+    @timed(es_request_duration, "aggregate", errors=es_errors_total)
+    def aggregate(self, index_name, query, group_by=None, sum_fields=(), size=1000):
+        """Sums sum_fields per group_by value with GROUP BY; see StorageBackend.aggregate."""
+        columns = self.tables.get(index_name)
+        if columns is None:
+            raise ValueError(f"no such index [{index_name}]")
+        where, params = self._translate(query, columns)
+        sums = [f"SUM({self._field(field, columns)[0]})" for field in sum_fields]
+        select = ", ".join(["COUNT(*)"] + sums)
+        if group_by:
+            key = self._field(group_by, columns)[0]
+            sql = (f"SELECT {key}, {select} FROM {quote(index_name)} WHERE ({where}) AND {key} IS NOT NULL "
+                   f"GROUP BY {key} ORDER BY {sums[0] if sums else 'COUNT(*)'} DESC LIMIT ?")
+            params = params + [size]
+        else:
+            sql = f"SELECT NULL, {select} FROM {quote(index_name)} WHERE {where}"
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+
+        results = []
+        for row in rows:
+            data = {"key": row[0], "doc_count": row[1]}
+            data.update((field, value or 0) for field, value in zip(sum_fields, row[2:]))
+            results.append(data)
+        return results
+
+    def expire_documents(self, index_name, field, before, batch_size=10000, **options):
+        """
+        Deletes the rows whose field is older than before (epoch ms), batch_size rows per
+        statement so the write lock is released between batches; see StorageBackend.expire_documents.
+        """
+        columns = self.tables.get(index_name)
+        if columns is None:
+            return {"dropped_indexes": [], "deleted": 0}
+        where, params = self._translate({"range": {field: {"lt": before}}}, columns)
+        sql = f"DELETE FROM {quote(index_name)} WHERE rowid IN (SELECT rowid FROM {quote(index_name)} WHERE {where} LIMIT ?)"
+        deleted = 0
+        while True:
+            with self.lock:
+                count = self.conn.execute(sql, params + [batch_size]).rowcount
+            deleted += count
+            if count < batch_size:
+                break
+        logger.info(f"Deleted {deleted} expired documents from {index_name}")
+        return {"dropped_indexes": [], "deleted": deleted}
+
+    def delete_indexes(self, index_names):
+        if isinstance(index_names, str):
+            index_names = [index_names]
+
+        for index_name in index_names:
+            with self.lock:
+                self.conn.execute(f"DROP TABLE IF EXISTS {quote(index_name)}")
+            self.tables.pop(index_name, None)
+            logger.info(f"Index '{index_name}' deleted successfully.")
+
+    def _field(self, field, columns):
+        """Returns (SQL expression, is_date) for a query field."""
+        if field.endswith(".keyword"):
+            field = field[:-len(".keyword")]
+        if field == "_id":
+            field = self.primary_key
+        if field in columns:
+            return quote(field), columns[field] == "date"
+        return f"json_extract(_source, {json_path(field)})", False
+
+    def _value(self, value, is_date):
+        if is_date:
+            millis = to_epoch_millis(value)
+            if millis is None:
+                raise ValueError(f"failed to parse date field [{value}]")
+            return millis
+        if isinstance(value, bool):
+            return int(value)
+        return value
+
+    def _translate(self, query, columns):
+        """Translates a query DSL clause into (SQL condition, parameters)."""
+        if not query:
+            return "1", []
+        (kind, body), = query.items()
+
+        if kind == "match_all":
+            return "1", []
+        if kind == "match_none":
+            return "0", []
+        if kind in ("term", "match", "match_phrase"):
+            (field, value), = body.items()
+            if isinstance(value, dict):
+                value = value.get("value", value.get("query"))
+            expression, is_date = self._field(field, columns)
+            return f"{expression} = ?", [self._value(value, is_date)]
+        if kind == "terms":
+            (field, values), = body.items()
+            if not values:
+                return "0", []
+            expression, is_date = self._field(field, columns)
+            return f"{expression} IN ({', '.join('?' for _ in values)})", [self._value(v, is_date) for v in values]
+        if kind == "ids":
+            values = body.get("values", [])
+            if not values:
+                return "0", []
+            return f"{quote(self.primary_key)} IN ({', '.join('?' for _ in values)})", list(values)
+        if kind == "range":
+            (field, bounds), = body.items()
+            expression, is_date = self._field(field, columns)
+            conditions, params = [], []
+            for op, sql_op in (("gte", ">="), ("gt", ">"), ("lte", "<="), ("lt", "<")):
+                if op in bounds:
+                    conditions.append(f"{expression} {sql_op} ?")
+                    params.append(self._value(bounds[op], is_date))
+            return " AND ".join(conditions) or "1", params
+        if kind == "exists":
+            expression, _ = self._field(body["field"], columns)
+            return f"{expression} IS NOT NULL", []
+        if kind == "prefix":
+            (field, value), = body.items()
+            if isinstance(value, dict):
+                value = value.get("value")
+            expression, _ = self._field(field, columns)
+            escaped = value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            return f"{expression} LIKE ? ESCAPE '\\'", [escaped + "%"]
+        if kind == "bool":
+            return self._translate_bool(body, columns)
+        raise ValueError(f"unsupported query type [{kind}]")
+
+    def _translate_bool(self, body, columns):
+        def clauses(key):
+            value = body.get(key, [])
+            return value if isinstance(value, list) else [value]
+
+        conditions, params = [], []
+        for clause in clauses("must") + clauses("filter"):
+            sql, clause_params = self._translate(clause, columns)
+            conditions.append(f"({sql})")
+            params.extend(clause_params)
+        for clause in clauses("must_not"):
+            sql, clause_params = self._translate(clause, columns)
+            conditions.append(f"NOT ({sql})")
+            params.extend(clause_params)
+
+        should = clauses("should")
+        # 与 ES 一致：存在 must/filter 时 should 只影响评分，否则至少匹配一个
+        minimum = body.get("minimum_should_match", 0 if (body.get("must") or body.get("filter")) else 1)
+        if should and int(minimum) > 0:
+            if int(minimum) > 1:
+                raise ValueError("minimum_should_match greater than 1 is not supported")
+            parts = []
+            for clause in should:
+                sql, clause_params = self._translate(clause, columns)
+                parts.append(f"({sql})")
+                params.extend(clause_params)
+            conditions.append("(" + " OR ".join(parts) + ")")
+        return " AND ".join(conditions) or "1", params
+
+    def _order_by(self, sort, columns):
+        if not sort:
+            return ""
+        terms = []
+        for item in sort if isinstance(sort, list) else [sort]:
+            if isinstance(item, str):
+                field, order = item, "asc"
+            else:
+                (field, spec), = item.items()
+                order = spec.get("order", "asc") if isinstance(spec, dict) else spec
+            if field in ("_score", "_doc"):
+                continue
+            expression, _ = self._field(field, columns)
+            terms.append(f"{expression} {'DESC' if str(order).lower() == 'desc' else 'ASC'}")
+        return " ORDER BY " + ", ".join(terms) if terms else ""
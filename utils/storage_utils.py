@@ -0,0 +1,125 @@
+import json
+from abc import ABC, abstractmethod
+from utils.log_utils import logger
+
+
+class StorageBackend(ABC):
+    """
+    Interface shared by the storage backends (ElasticsearchManager, SQLiteManager).
+
+    The ingest pipeline (spool replayer, BulkWriter, store_record) and the query helpers
+    only use the methods below, so any backend can be selected with STORAGE_BACKEND.
+    Method names follow ElasticsearchManager, which was the only backend originally;
+    queries use the Elasticsearch query DSL and sorts, e.g. {"term": {"model": "gpt-4o"}}.
+
+    Attributes:
+        primary_key (str): Document field used as the unique id.
+    """
+
+    primary_key = "id"
+
+    @abstractmethod
+    def ping(self):
+        """Returns True when the backend is reachable."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def check_and_create_indexes(self, indexes={}):
+        """Creates the missing indexes; indexes maps index name -> mapping file."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def write_to_es(self, index_name, data, update_condition=None, mode=None):
+        """Writes one document, merging it into an existing document with the same id."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def bulk_write(self, documents):
+        """
+        Writes (index_name, data) tuples in one batch, merging existing documents.
+
+        Returns:
+            list: (index_name, doc_id, error) for every document that failed.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def bulk_increment(self, documents, fields):
+        """
+        Upserts (index_name, data) tuples, adding the numeric fields listed in fields to
+        the values of an existing document instead of replacing them (used for rollups).
+
+        Returns:
+            list: (index_name, doc_id, error) for every document that failed.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def query_from_es(self, index_name, query, fields=None, sort=None, size=10000):
+        """Returns the sources of the documents matching query; [] on errors."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def scan(self, index_name, query=None, fields=None, sort=None, page_size=1000, slices=None, keep_alive="1m"):
+        """
+        Generator over the sources of every document matching query, read page_size
+        documents at a time from a consistent snapshot, so memory use does not depend
+        on the number of matches.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def count_documents(self, index_name, query):
+        """Returns the number of documents matching query; 0 on errors."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def aggregate(self, index_name, query, group_by=None, sum_fields=(), size=1000):
+        """
+        Sums sum_fields over the documents matching query, per value of group_by (or
+        over all of them when group_by is None), largest first by the first sum field.
+        Unlike query_from_es, errors are raised so callers do not cache empty results.
+
+        Returns:
+            list: {"key": group value, "doc_count": n, <field>: sum, ...} per group.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def expire_documents(self, index_name, field, before, **options):
+        """
+        Deletes the documents whose date field is older than before (epoch ms); used by
+        the retention job. Backend specific options (throttling, polling) may be ignored.
+
+        Returns:
+            dict: {"dropped_indexes": [...], "deleted": n, ...}
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_indexes(self, index_names):
+        raise NotImplementedError
+
+
+def apply_update_condition(index_name, doc_id, existing_source, data, update_condition):
+    """
+    Copy the fields listed in update_condition from the existing document into data,
+    but only when every condition field in the existing document matches its expected value.
+    """
+    for field, value in update_condition.items():
+        if field not in existing_source or existing_source[field] != value:
+            return
+
+    # Preserve fields listed in update_condition by copying their values from existing document
+    for field in update_condition.keys():
+        if field in existing_source:
+            data[field] = existing_source[field]
+    logger.info(f'[partial update] to [{index_name}]: {doc_id} - preserving fields: {list(update_condition.keys())}')
+
+
+def load_mapping_properties(mapping_file):
+    """Returns {field: type} from the "properties" of an Elasticsearch mapping file."""
+    with open(mapping_file, 'r') as f:
+        mapping = json.load(f)
+    properties = mapping.get("mappings", mapping).get("properties", {})
+    return {field: spec.get("type", "object") for field, spec in properties.items()}
@@ -0,0 +1,65 @@
+import threading
+import time
+import pytest
+from utils.admission_utils import AdmissionController, QUEUE_FULL, QUEUE_TIMEOUT, Rejected
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_admits_up_to_max_in_flight():
+    admission = AdmissionController(max_in_flight=2, max_queued=0)
+    releases = [admission.admit(), admission.admit()]
+    with pytest.raises(Rejected) as rejected:
+        admission.admit()
+    assert (rejected.value.reason, rejected.value.status) == (QUEUE_FULL, 429)
+    for release in releases:
+        release()
+    admission.admit()()
+    assert admission.stats()["admitted"] == 3
+    assert admission.stats()["in_flight"] == 0
+
+
+def test_queued_request_gets_released_slot():
+    admission = AdmissionController(max_in_flight=1, max_queued=1, queue_timeout=5)
+    release = admission.admit()
+    admitted = []
+    waiter = threading.Thread(target=lambda: admitted.append(admission.admit()))
+    waiter.start()
+    wait_until(lambda: admission.queued == 1)
+    assert admission.pressure() == 1.0
+
+    # 等待队列已满，新的请求立即被拒绝
+    with pytest.raises(Rejected) as rejected:
+        admission.admit()
+    assert rejected.value.status == 429
+
+    release()
+    waiter.join()
+    assert len(admitted) == 1 and admission.in_flight == 1
+    admitted[0]()
+    assert admission.stats()["rejected"] == {QUEUE_FULL: 1, QUEUE_TIMEOUT: 0}
+
+
+def test_queue_timeout_is_rejected_with_503():
+    admission = AdmissionController(max_in_flight=1, max_queued=1, queue_timeout=0.05)
+    release = admission.admit()
+    with pytest.raises(Rejected) as rejected:
+        admission.admit()
+    assert (rejected.value.reason, rejected.value.status) == (QUEUE_TIMEOUT, 503)
+    assert admission.queued == 0
+    release()
+
+
+def test_retry_after_follows_backlog_and_is_clamped():
+    admission = AdmissionController(max_in_flight=2, max_queued=10, max_retry_after=30)
+    assert admission.retry_after() == 1
+    admission.service_time = 4.0
+    admission.in_flight, admission.queued = 2, 4
+    assert admission.retry_after() == 12
+    admission.service_time = 100.0
+    assert admission.retry_after() == 30
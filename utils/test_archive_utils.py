@@ -0,0 +1,44 @@
+import os
+from utils import archive_utils
+from utils.archive_utils import SegmentArchive, read_segment
+
+
+def test_tick_fsyncs_idle_segment(tmp_path, monkeypatch):
+    synced = []
+    monkeypatch.setattr(archive_utils.os, "fsync", lambda fd: synced.append(fd))
+    archive = SegmentArchive(str(tmp_path), fsync_every=100, fsync_interval=60, compress=False)
+    archive.append({"id": 1})
+    assert archive.unsynced == 1
+
+    archive.tick()
+    assert synced == []
+
+    archive.synced_at -= 60
+    archive.tick()
+    assert len(synced) == 1 and archive.unsynced == 0
+    archive.close()
+
+
+def test_tick_rotates_and_compresses_old_segment(tmp_path):
+    archive = SegmentArchive(str(tmp_path), max_age=3600, compress=True)
+    name = archive.append({"id": 1})
+    archive.opened_at -= 3600
+
+    archive.tick()
+    assert archive.file is None
+    for thread in list(archive_utils.threading.enumerate()):
+        if thread.name == "archive-compress":
+            thread.join()
+    compressed = os.path.join(str(tmp_path), name[:-len(archive_utils.SEGMENT_SUFFIX)] + archive_utils.COMPRESSED_SUFFIX)
+    assert list(read_segment(compressed)) == [{"id": 1}]
+
+    # 下一条记录写入新的段文件
+    assert archive.append({"id": 2}) != name
+    archive.close()
+
+
+def test_start_and_close_flusher(tmp_path):
+    archive = SegmentArchive(str(tmp_path), fsync_interval=0.01, compress=False).start()
+    archive.append({"id": 1})
+    archive.close()
+    assert archive.thread is None and archive.file is None
@@ -0,0 +1,126 @@
+import asyncio
+import threading
+import pytest
+from utils.breaker_utils import CircuitBreaker, CircuitOpenError, CLOSED, OPEN, HALF_OPEN
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class Outage(Exception):
+    pass
+
+
+def fail():
+    raise Outage("down")
+
+
+def test_closed_open_half_open_closed():
+    clock = FakeClock()
+    states = []
+    breaker = CircuitBreaker("es", failure_threshold=2, reset_timeout=30, on_state_change=states.append, clock=clock)
+
+    with pytest.raises(Outage):
+        breaker.call(fail)
+    assert breaker.state == CLOSED
+    with pytest.raises(Outage):
+        breaker.call(fail)
+    assert breaker.state == OPEN
+
+    # 打开状态下快速失败，不调用被保护的函数
+    calls = []
+    clock.now += 29.9
+    with pytest.raises(CircuitOpenError):
+        breaker.call(calls.append, 1)
+    assert calls == [] and breaker.rejected == 1
+
+    clock.now += 0.1
+    assert breaker.call(lambda: "ok") == "ok"
+    assert states == [OPEN, HALF_OPEN, CLOSED]
+    assert breaker.stats() == {"state": CLOSED, "consecutive_failures": 0, "rejected": 1}
+
+
+def test_success_resets_consecutive_failures():
+    breaker = CircuitBreaker("es", failure_threshold=2, clock=FakeClock())
+    with pytest.raises(Outage):
+        breaker.call(fail)
+    breaker.call(lambda: None)
+    with pytest.raises(Outage):
+        breaker.call(fail)
+    assert breaker.state == CLOSED
+
+
+def test_failed_trial_reopens_circuit():
+    clock = FakeClock()
+    breaker = CircuitBreaker("es", failure_threshold=1, reset_timeout=10, clock=clock)
+    breaker.trip()
+    clock.now += 10
+    assert breaker.allow()
+    # 试探请求进行中时其余请求仍然快速失败
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN and breaker.opened_at == clock.now
+    assert not breaker.allow()
+
+
+def test_client_errors_do_not_count_as_failures():
+    breaker = CircuitBreaker("es", failure_threshold=1, clock=FakeClock())
+    with pytest.raises(KeyError):
+        breaker.call({}.__getitem__, "missing", is_failure=lambda e: not isinstance(e, KeyError))
+    assert breaker.state == CLOSED
+
+
+def test_probe_moves_open_circuit_to_half_open():
+    healthy = []
+    clock = FakeClock()
+    breaker = CircuitBreaker("es", reset_timeout=1, probe=lambda: bool(healthy), clock=clock)
+    breaker.trip()
+    # 有探测时 reset_timeout 不再生效，只有探测成功才允许试探请求
+    clock.now += 60
+    assert not breaker.allow()
+    breaker._probe_once()
+    assert breaker.state == OPEN
+
+    healthy.append(True)
+    breaker._probe_once()
+    assert breaker.state == HALF_OPEN
+    assert breaker.call(lambda: "ok") == "ok"
+    assert breaker.state == CLOSED
+
+
+def test_probe_thread_closes_circuit():
+    healthy = threading.Event()
+    closed = threading.Event()
+    breaker = CircuitBreaker("es", probe=healthy.is_set, probe_interval=0.01,
+                             on_state_change=lambda state: state == HALF_OPEN and closed.set())
+    breaker.start_probe()
+    try:
+        breaker.trip()
+        healthy.set()
+        assert closed.wait(5)
+        breaker.call(lambda: None)
+        assert breaker.state == CLOSED
+    finally:
+        breaker.stop_probe()
+    assert breaker.probe_thread is None
+
+
+def test_async_calls_fail_fast_while_open():
+    breaker = CircuitBreaker("es", failure_threshold=1, clock=FakeClock())
+
+    async def failing():
+        raise Outage("down")
+
+    async def scenario():
+        with pytest.raises(Outage):
+            await breaker.call_async(failing)
+        with pytest.raises(CircuitOpenError):
+            await breaker.call_async(failing)
+
+    asyncio.run(scenario())
+    assert breaker.rejected == 1
@@ -0,0 +1,48 @@
+from utils.cache_utils import TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = TTLCache(max_entries=10, ttl=5, clock=clock)
+    cache.set("a", 1)
+    clock.now = 4.9
+    assert cache.get("a") == 1
+    clock.now = 5
+    assert cache.get("a") is None
+    assert cache.stats() == {"entries": 0, "hits": 1, "misses": 1, "evictions": 0, "invalidations": 0}
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(max_entries=2, ttl=60, clock=FakeClock())
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert cache.evictions == 1
+
+
+def test_invalidate_drops_entries_and_stale_loads():
+    cache = TTLCache(max_entries=10, ttl=60, clock=FakeClock())
+    cache.set("a", 1)
+    cache.invalidate()
+    assert cache.get("a") is None
+
+    # 加载期间缓存失效，加载结果不会写入缓存
+    def slow_query():
+        cache.invalidate()
+        return "stale"
+    assert cache.get_or_load("b", slow_query) == "stale"
+    assert cache.get("b") is None
+    assert cache.get_or_load("b", lambda: "fresh") == "fresh"
+    assert cache.get_or_load("b", lambda: "unused") == "fresh"
+    assert cache.invalidations == 2
@@ -0,0 +1,35 @@
+from utils.dedup_utils import DuplicateFilter, content_digest, content_id
+
+RECORD = {"sessionId": "s1", "responseId": "r1", "file": "a.py", "timestamp": "2026-10-18T08:00:00.000Z"}
+
+
+def test_digest_is_stable_and_depends_on_content():
+    assert content_digest(dict(RECORD)) == content_digest(dict(RECORD))
+    assert len(content_digest(RECORD)) == 20
+    assert content_digest(RECORD) != content_digest({**RECORD, "file": "b.py"})
+    assert content_id(RECORD) == content_digest(RECORD).hex()
+
+
+def test_digest_ignores_other_fields():
+    assert content_digest({**RECORD, "added": 3}) == content_digest(RECORD)
+
+
+def test_digest_requires_session_and_response_id():
+    assert content_digest({}) is None
+    assert content_digest({"file": "a.py", "timestamp": RECORD["timestamp"]}) is None
+    assert content_digest({**RECORD, "sessionId": None}) is None
+    assert content_id({key: value for key, value in RECORD.items() if key != "responseId"}) is None
+    # 可选字段缺失时仍然可以识别
+    assert content_digest({"sessionId": "s1", "responseId": "r1"}) is not None
+
+
+def test_duplicate_filter_window():
+    window = DuplicateFilter(max_entries=2)
+    assert window.claim(b"a")
+    assert not window.claim(b"a")
+    window.release(b"a")
+    assert window.claim(b"a")
+    window.claim(b"b")
+    window.claim(b"c")
+    assert window.claim(b"a")
+    assert window.stats() == {"entries": 2, "duplicates": 1}
@@ -0,0 +1,124 @@
+import threading
+import time
+import pytest
+from utils.es_bulk_utils import BulkWriter, is_retryable
+
+REJECTED = {"type": "es_rejected_execution_exception", "reason": "queue is full"}
+MAPPING = {"type": "mapper_parsing_exception", "reason": "failed to parse field [added]"}
+
+
+class StubManager:
+    primary_key = "id"
+
+    def __init__(self):
+        self.batches = []
+        self.failures = []  # 每个元素对应一次 bulk_write：{id: error} 或一个异常
+        self.flushed = threading.Condition()
+
+    def bulk_write(self, documents):
+        with self.flushed:
+            self.batches.append([(index_name, dict(doc)) for index_name, doc in documents])
+            self.flushed.notify_all()
+        failure = self.failures.pop(0) if self.failures else {}
+        if isinstance(failure, Exception):
+            raise failure
+        return [(index_name, doc["id"], failure[doc["id"]]) for index_name, doc in documents if doc["id"] in failure]
+
+    def wait_for_batches(self, count, timeout=5):
+        with self.flushed:
+            assert self.flushed.wait_for(lambda: len(self.batches) >= count, timeout)
+        return self.batches
+
+
+def ids(batch):
+    return [doc["id"] for _, doc in batch]
+
+
+@pytest.fixture
+def manager():
+    return StubManager()
+
+
+def test_repeated_writes_are_coalesced(manager):
+    writer = BulkWriter(manager, max_docs=100, max_age=60)
+    writer.submit("linechanges", {"id": "a", "added": 1})
+    writer.submit("linechanges", {"id": "b", "added": 2})
+    writer.submit("linechanges", {"id": "a", "removed": 3})
+    writer.start().close()
+    batch, = manager.batches
+    assert ids(batch) == ["a", "b"]
+    assert {key: batch[0][1][key] for key in ("added", "removed")} == {"added": 1, "removed": 3}
+    assert (writer.indexed, writer.coalesced, writer.flushes) == (2, 1, 1)
+
+
+def test_flush_by_docs(manager):
+    writer = BulkWriter(manager, max_docs=2, max_age=60).start()
+    for doc_id in "abc":
+        writer.submit("linechanges", {"id": doc_id})
+    assert ids(manager.wait_for_batches(1)[0]) == ["a", "b"]
+    writer.close()
+    assert [ids(batch) for batch in manager.batches] == [["a", "b"], ["c"]]
+
+
+def test_flush_by_bytes(manager):
+    # submit() 加上 last_updated_at 后每个文档约 80 字节，第二个文档使批次超过上限
+    writer = BulkWriter(manager, max_docs=100, max_bytes=120, max_age=60).start()
+    writer.submit("linechanges", {"id": "a", "file": "x" * 20})
+    writer.submit("linechanges", {"id": "b", "file": "x" * 20})
+    assert ids(manager.wait_for_batches(1)[0]) == ["a", "b"]
+    writer.close()
+
+
+def test_flush_by_age(manager):
+    writer = BulkWriter(manager, max_docs=100, max_age=0.05).start()
+    started = time.monotonic()
+    writer.submit("linechanges", {"id": "a"})
+    assert ids(manager.wait_for_batches(1)[0]) == ["a"]
+    assert time.monotonic() - started >= 0.05
+    writer.close()
+
+
+def test_full_queue_rejects_documents(manager):
+    writer = BulkWriter(manager, queue_size=1)
+    assert writer.submit("linechanges", {"id": "a"})
+    assert not writer.submit("linechanges", {"id": "b"})
+    assert writer.dropped == 1
+    writer.start().close()
+    assert [ids(batch) for batch in manager.batches] == [["a"]]
+
+
+def test_transient_errors_are_retried_with_next_batch(manager):
+    errors = []
+    flushes = []
+    manager.failures = [{"a": REJECTED, "b": MAPPING}, ConnectionError("unavailable")]
+    writer = BulkWriter(manager, max_docs=3, max_age=0.05,
+                        on_error=lambda index_name, doc, error: errors.append((doc["id"], error)),
+                        on_flush=lambda: flushes.append(True)).start()
+    for doc_id in "abc":
+        writer.submit("linechanges", {"id": doc_id})
+
+    batches = manager.wait_for_batches(3)
+    writer.close()
+    # 被拒绝的 a 随后两个批次重试，映射错误的 b 不重试
+    assert [ids(batch) for batch in batches] == [["a", "b", "c"], ["a"], ["a"]]
+    assert errors == [("b", MAPPING)]
+    assert (writer.indexed, writer.failed, writer.retried) == (2, 1, 2)
+    assert len(flushes) == 2
+
+
+def test_retries_are_limited(manager):
+    errors = []
+    manager.failures = [{"a": REJECTED}] * 3
+    writer = BulkWriter(manager, max_age=0.01, max_retries=2,
+                        on_error=lambda index_name, doc, error: errors.append(doc["id"])).start()
+    writer.submit("linechanges", {"id": "a"})
+    manager.wait_for_batches(3)
+    writer.close()
+    assert len(manager.batches) == 3
+    assert errors == ["a"] and writer.attempts == {}
+
+
+def test_is_retryable():
+    assert is_retryable("ConnectionError: unavailable")
+    assert is_retryable(REJECTED)
+    assert not is_retryable(MAPPING)
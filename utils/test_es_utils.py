@@ -0,0 +1,201 @@
+import threading
+import pytest
+from benchmark.fake_es import start_fake_es
+from utils.breaker_utils import CircuitBreaker, CircuitOpenError, CLOSED, OPEN
+from utils.es_utils import ElasticsearchManager, GuardedElasticsearchManager, WRITE_MODES
+
+
+class Outage(Exception):
+    pass
+
+
+class FakeManager:
+    def __init__(self, pages):
+        self.pages = pages
+        self.requests = 0
+        self.closed = False
+
+    def scan(self, index_name):
+        try:
+            for page in self.pages:
+                self.requests += 1
+                if isinstance(page, Exception):
+                    raise page
+                yield from page
+        finally:
+            self.closed = True
+
+    def ping(self):
+        return True
+
+
+def test_scan_pages_go_through_breaker():
+    breaker = CircuitBreaker("es", failure_threshold=1)
+    manager = FakeManager([[1, 2], Outage("down"), [3]])
+    guarded = GuardedElasticsearchManager(manager, breaker)
+
+    docs = guarded.scan("linechanges")
+    assert manager.requests == 0
+    assert next(docs) == 1 and next(docs) == 2
+    with pytest.raises(Outage):
+        next(docs)
+    assert breaker.state == OPEN
+    assert manager.closed
+
+
+def test_scan_stops_when_circuit_opens():
+    breaker = CircuitBreaker("es", failure_threshold=1)
+    manager = FakeManager([[1, 2], [3]])
+    guarded = GuardedElasticsearchManager(manager, breaker)
+
+    docs = guarded.scan("linechanges")
+    assert next(docs) == 1
+    breaker.trip()
+    with pytest.raises(CircuitOpenError):
+        next(docs)
+    assert manager.closed
+
+
+def test_complete_scan_and_plain_calls():
+    breaker = CircuitBreaker("es")
+    guarded = GuardedElasticsearchManager(FakeManager([[1, 2], [3]]), breaker)
+    assert list(guarded.scan("linechanges")) == [1, 2, 3]
+    assert guarded.ping()
+    breaker.trip()
+    with pytest.raises(CircuitOpenError):
+        guarded.ping()
+
+
+def test_guarded_manager_fails_fast_until_reset_timeout():
+    now = [0.0]
+    breaker = CircuitBreaker("es", failure_threshold=2, reset_timeout=30, clock=lambda: now[0])
+    manager = FakeManager([])
+
+    def refused():
+        raise ConnectionError("refused")
+    manager.ping = refused
+    guarded = GuardedElasticsearchManager(manager, breaker)
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            guarded.ping()
+    assert breaker.state == OPEN
+
+    manager.ping = lambda: True
+    with pytest.raises(CircuitOpenError):
+        guarded.ping()
+    now[0] = 30
+    assert guarded.ping()
+    assert breaker.state == CLOSED
+
+
+@pytest.fixture(scope="module")
+def fake_es():
+    server, url = start_fake_es()
+    yield server, url
+    server.shutdown()
+    server.server_close()
+
+
+def final_documents(server, index_name):
+    docs = server.store.indices[index_name]
+    return {doc_id: {key: value for key, value in doc.items() if key != "last_updated_at"} for doc_id, doc in docs.items()}
+
+
+def test_write_modes_produce_the_same_documents(fake_es):
+    server, url = fake_es
+    results = {}
+    for mode in WRITE_MODES:
+        manager = ElasticsearchManager(url, write_mode=mode)
+        index_name = f"write-{mode}"
+        # 新文档、重复 id 覆盖字段、重复 id 只带部分字段
+        manager.write_to_es(index_name, {"id": "a", "added": 1, "model": "gpt-4o"})
+        manager.write_to_es(index_name, {"id": "a", "added": 5})
+        manager.write_to_es(index_name, {"id": "a", "removed": 2})
+        # 条件满足时保留条件字段（单次请求的模式通过 Painless 脚本化 upsert 判断），不满足时覆盖
+        manager.write_to_es(index_name, {"id": "b", "reviewed": True, "added": 1}, update_condition={"reviewed": True})
+        manager.write_to_es(index_name, {"id": "b", "reviewed": False, "added": 9}, update_condition={"reviewed": True})
+        manager.write_to_es(index_name, {"id": "c", "reviewed": False, "added": 1})
+        manager.write_to_es(index_name, {"id": "c", "reviewed": True, "added": 9}, update_condition={"reviewed": True})
+        results[mode] = final_documents(server, index_name)
+
+    assert results["create"] == {
+        "a": {"id": "a", "added": 5, "model": "gpt-4o", "removed": 2},
+        "b": {"id": "b", "reviewed": True, "added": 9},
+        "c": {"id": "c", "reviewed": True, "added": 9},
+    }
+    assert results["upsert"] == results["create"]
+    assert results["read_modify_write"] == results["create"]
+
+
+def test_bulk_write_modes_produce_the_same_documents(fake_es):
+    server, url = fake_es
+    results = {}
+    for mode in WRITE_MODES:
+        manager = ElasticsearchManager(url, write_mode=mode)
+        index_name = f"bulk-{mode}"
+        assert manager.bulk_write([(index_name, {"id": "a", "added": 1, "model": "gpt-4o"}), (index_name, {"id": "b", "added": 2})]) == []
+        assert manager.bulk_write([(index_name, {"id": "a", "removed": 3}), (index_name, {"id": "c", "added": 4})]) == []
+        results[mode] = final_documents(server, index_name)
+
+    assert results["create"] == {
+        "a": {"id": "a", "added": 1, "model": "gpt-4o", "removed": 3},
+        "b": {"id": "b", "added": 2},
+        "c": {"id": "c", "added": 4},
+    }
+    assert results["upsert"] == results["create"]
+    assert results["read_modify_write"] == results["create"]
+
+
+@pytest.fixture(scope="module")
+def scan_manager(fake_es):
+    server, url = fake_es
+    manager = ElasticsearchManager(url)
+    docs = [("scan", {"id": f"doc-{i:02d}", "model": "gpt-4o" if i % 2 else "claude", "added": i}) for i in range(25)]
+    assert manager.bulk_write(docs) == []
+    searches = []
+    search = manager.es.search
+    manager.es.search = lambda **kwargs: searches.append(kwargs) or search(**kwargs)
+    manager.searches = searches
+    return server, manager
+
+
+def test_scan_pages_with_search_after(scan_manager):
+    server, manager = scan_manager
+    manager.searches.clear()
+    docs = list(manager.scan("scan", fields=["id"], page_size=10))
+    assert docs == [{"id": f"doc-{i:02d}"} for i in range(25)]
+    assert len(manager.searches) == 3
+    assert [request.get("search_after") for request in manager.searches] == [None, [9], [19]]
+    assert server.store.pits == {}
+
+    odd = list(manager.scan("scan", {"term": {"model": "gpt-4o"}}, page_size=5))
+    assert [doc["added"] for doc in odd] == list(range(1, 25, 2))
+    assert server.store.pits == {}
+
+
+def test_scan_closes_point_in_time_when_caller_stops(scan_manager):
+    server, manager = scan_manager
+    manager.searches.clear()
+    docs = manager.scan("scan", page_size=10)
+    assert next(docs)["id"] == "doc-00"
+    assert len(server.store.pits) == 1
+    docs.close()
+    assert server.store.pits == {}
+    assert len(manager.searches) == 1
+
+
+def test_scan_slices(scan_manager):
+    server, manager = scan_manager
+    manager.searches.clear()
+    docs = list(manager.scan("scan", fields=["id"], page_size=4, slices=3))
+    assert sorted(doc["id"] for doc in docs) == [f"doc-{i:02d}" for i in range(25)]
+    assert {request["slice"]["id"] for request in manager.searches} == {0, 1, 2}
+    assert all(request["slice"]["max"] == 3 for request in manager.searches)
+    assert server.store.pits == {}
+
+    # 提前结束时切片线程全部退出
+    docs = manager.scan("scan", page_size=1, slices=3)
+    next(docs)
+    docs.close()
+    assert server.store.pits == {}
+    assert not [thread for thread in threading.enumerate() if thread.name.startswith("es-scan-")]
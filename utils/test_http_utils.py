@@ -0,0 +1,95 @@
+import gzip
+import zlib
+import pytest
+from utils.http_utils import (
+    BodyTooLarge, ContentDecoder, LineSplitter, UnsupportedEncoding, parse_chunk_size, parse_content_encoding,
+)
+
+
+def decode(decoder, body, chunk_size=7):
+    pieces = []
+    for i in range(0, len(body), chunk_size):
+        pieces.extend(decoder.decode(body[i:i + chunk_size]))
+    decoder.finish()
+    return pieces
+
+
+def test_parse_content_encoding():
+    assert parse_content_encoding(None) == []
+    assert parse_content_encoding("identity") == []
+    assert parse_content_encoding("deflate, GZIP") == ["deflate", "gzip"]
+    with pytest.raises(UnsupportedEncoding):
+        parse_content_encoding("br")
+
+
+def test_parse_chunk_size():
+    assert parse_chunk_size(b"1a\r\n") == 26
+    assert parse_chunk_size(b"0;ext=1\r\n") == 0
+    for line in (b"\r\n", b"-1\r\n", b"0x10\r\n", b"zz\r\n", b"10", b"1" * 2000 + b"\n"):
+        with pytest.raises(ValueError):
+            parse_chunk_size(line)
+
+
+def test_identity_body_is_passed_through_and_limited():
+    assert b"".join(decode(ContentDecoder(None, 100), b"x" * 100)) == b"x" * 100
+    with pytest.raises(BodyTooLarge):
+        decode(ContentDecoder(None, 99), b"x" * 100)
+
+
+def test_gzip_body_in_small_chunks_and_pieces():
+    body = b"".join(b"line %d\n" % i for i in range(10000))
+    pieces = decode(ContentDecoder("gzip", len(body), piece_size=1024), gzip.compress(body))
+    assert b"".join(pieces) == body
+    assert max(len(piece) for piece in pieces) <= 1024
+
+
+def test_concatenated_gzip_members():
+    compressed = gzip.compress(b"first\n") + gzip.compress(b"second\n")
+    assert b"".join(decode(ContentDecoder("gzip", 100), compressed)) == b"first\nsecond\n"
+
+
+def test_deflate_with_and_without_zlib_header():
+    body = b'{"a": 1}' * 100
+    raw = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    for compressed in (zlib.compress(body), raw.compress(body) + raw.flush()):
+        assert b"".join(decode(ContentDecoder("deflate", len(body)), compressed, chunk_size=1)) == body
+
+
+def test_stacked_encodings():
+    body = b"stacked" * 50
+    compressed = gzip.compress(zlib.compress(body))
+    assert b"".join(decode(ContentDecoder("deflate, gzip", len(body)), compressed)) == body
+
+
+def test_decompression_bomb_stops_at_limit():
+    decoder = ContentDecoder("gzip", 1024 * 1024, piece_size=64 * 1024)
+    decoded = 0
+    with pytest.raises(BodyTooLarge):
+        for piece in decoder.decode(gzip.compress(b" " * 50_000_000)):
+            decoded += len(piece)
+    assert decoded <= 1024 * 1024
+
+
+def test_truncated_and_invalid_bodies():
+    with pytest.raises(ValueError):
+        decode(ContentDecoder("gzip", 1000), gzip.compress(b"truncated")[:-4])
+    with pytest.raises(ValueError):
+        decode(ContentDecoder("gzip", 1000), b"not gzip at all")
+
+
+def test_line_splitter_across_pieces():
+    lines = LineSplitter(max_line=10)
+    assert lines.feed(b"ab") == []
+    assert lines.feed(b"c\r\nde\nf") == [b"abc", b"de"]
+    assert lines.close() == [b"f"]
+    assert lines.close() == []
+
+
+def test_line_splitter_reports_long_lines_as_none():
+    lines = LineSplitter(max_line=4)
+    assert lines.feed(b"12345") == []
+    assert lines.feed(b"678\nok\n") == [None, b"ok"]
+    assert lines.feed(b"1234\n12") == [b"1234"]
+    assert lines.feed(b"345\n") == [None]
+    assert lines.feed(b"toolong") == []
+    assert lines.close() == [None]
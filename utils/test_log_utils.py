@@ -0,0 +1,47 @@
+import logging
+import re
+import threading
+from utils.log_utils import SamplingFilter
+
+
+def make_record(log_type, level=logging.INFO):
+    record = logging.LogRecord("test", level, __file__, 1, "message", None, None)
+    record.log_type = log_type
+    return record
+
+
+def test_records_without_type_and_errors_are_kept():
+    sampling = SamplingFilter(sample_rates={"request": 0.0}, rate_limits={"request": 1})
+    assert sampling.filter(logging.LogRecord("test", logging.INFO, __file__, 1, "message", None, None))
+    assert sampling.filter(make_record("request", logging.ERROR))
+
+
+def test_suppressed_count_is_appended_to_next_record():
+    sampling = SamplingFilter(sample_rates={"request": 0.0})
+    assert not sampling.filter(make_record("request"))
+    assert not sampling.filter(make_record("request"))
+    warning = make_record("request", logging.WARNING)
+    assert sampling.filter(warning)
+    assert warning.getMessage() == "message (2 similar 'request' messages suppressed)"
+
+
+def test_concurrent_records_are_all_accounted_for():
+    sampling = SamplingFilter(sample_rates={"request": 0.5}, rate_limits={"request": 100})
+    kept = []
+    lock = threading.Lock()
+
+    def log(count):
+        for _ in range(count):
+            record = make_record("request")
+            if sampling.filter(record):
+                with lock:
+                    kept.append(record.getMessage())
+
+    threads = [threading.Thread(target=log, args=(2000,)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    reported = sum(int(match.group(1)) for message in kept for match in [re.search(r"\((\d+) similar", message)] if match)
+    assert len(kept) + reported + sampling.suppressed.get("request", 0) == 8 * 2000
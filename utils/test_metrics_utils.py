@@ -0,0 +1,63 @@
+import asyncio
+import pytest
+from utils.metrics_utils import MetricsRegistry, timed
+
+
+def test_counter_and_label_escaping():
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Requests.", ("path",))
+    requests.inc('/a"b\\c\nd')
+    requests.inc("/", amount=2)
+    assert registry.render() == (
+        "# HELP requests_total Requests.\n"
+        "# TYPE requests_total counter\n"
+        'requests_total{path="/"} 2\n'
+        'requests_total{path="/a\\"b\\\\c\\nd"} 1\n'
+    )
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    duration = registry.histogram("duration_seconds", "Duration.", ("stage",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        duration.observe(value, "parse")
+    assert registry.render().splitlines()[2:] == [
+        'duration_seconds_bucket{stage="parse",le="0.1"} 2',
+        'duration_seconds_bucket{stage="parse",le="1.0"} 3',
+        'duration_seconds_bucket{stage="parse",le="+Inf"} 4',
+        'duration_seconds_sum{stage="parse"} 2.65',
+        'duration_seconds_count{stage="parse"} 4',
+    ]
+
+
+def test_const_labels_and_callbacks():
+    registry = MetricsRegistry()
+    registry.counter("plain_total", "Plain.").inc()
+    registry.callback("queue_depth", "Depth.", lambda: {("log",): 3}, ("queue",))
+    registry.callback("skipped", "Not available yet.", lambda: None)
+    registry.callback("broken", "Raises.", lambda: 1 / 0)
+    lines = registry.render([("worker", 1)]).splitlines()
+    assert 'plain_total{worker="1"} 1' in lines
+    assert 'queue_depth{worker="1",queue="log"} 3' in lines
+    assert "# TYPE skipped gauge" in lines
+    assert lines[-1] == "# broken unavailable: division by zero"
+
+
+def test_timed_records_duration_and_errors():
+    registry = MetricsRegistry()
+    duration = registry.histogram("call_seconds", "Calls.", ("operation",))
+    errors = registry.counter("call_errors_total", "Errors.", ("operation",))
+
+    @timed(duration, "bulk", errors=errors)
+    def failing():
+        raise ValueError("bad")
+
+    @timed(duration, "bulk", errors=errors)
+    async def succeeding():
+        return 1
+
+    with pytest.raises(ValueError):
+        failing()
+    assert asyncio.run(succeeding()) == 1
+    assert duration.series[("bulk",)][-1] == 2
+    assert errors.values == {("bulk",): 1}
@@ -0,0 +1,30 @@
+from utils.partition_utils import PartitionView, document_label, write_alias
+
+
+def view():
+    return PartitionView("linechanges", {
+        "linechanges-2026.10.17-000001": {"settings": {"index": {"creation_date": "1000"}}},
+        "linechanges-2026.10.17-000002": {"settings": {"index": {"creation_date": "2000"}}},
+        "linechanges-2026.10.18-000003": {"settings": {"index": {"creation_date": "3000"}}, "aliases": {write_alias("linechanges"): {}}},
+        "other-2026.10.18-000001": {},
+    })
+
+
+def test_document_label():
+    assert document_label({"timestamp": "2026-10-17T23:59:59.000Z"}, "timestamp", "day") == "2026.10.17"
+    assert document_label({"timestamp": 1792281600000}, "timestamp", "month") == "2026.10"
+    assert document_label({}, "timestamp", "day") is None
+    assert document_label({"timestamp": "yesterday"}, "timestamp", "day") is None
+
+
+def test_partition_for_uses_last_partition_of_label():
+    partitions = view()
+    assert partitions.write_index == "linechanges-2026.10.18-000003"
+    assert partitions.partition_for("2026.10.17") == "linechanges-2026.10.17-000002"
+    assert partitions.partition_for("2026.10.18") == "linechanges-2026.10.18-000003"
+    assert partitions.partition_for("2026.10.16") is None
+
+
+def test_search_targets():
+    partitions = view()
+    assert partitions.search_targets(2500) == ["linechanges-2026.10.17-000002", "linechanges-2026.10.18-000003"]
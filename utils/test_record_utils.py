@@ -0,0 +1,85 @@
+import json
+import pytest
+from utils.json_utils import encode, loads_document
+from utils.record_utils import InvalidRecord, date_value, record_type
+from config import MAPPING_FILE_LINECHANGES, RECORD_INTERNED_FIELDS
+
+LineChangeRecord = record_type(MAPPING_FILE_LINECHANGES, "LineChangeRecord", RECORD_INTERNED_FIELDS, max_extra_fields=2)
+
+DOCUMENT = {
+    "timestamp": "2026-10-18T08:00:00.000Z",
+    "sessionId": "s1",
+    "model": "gpt-4o",
+    "language": "python",
+    "added": 3,
+    "removed": 1,
+}
+
+
+def parse(document):
+    return LineChangeRecord.from_document(loads_document(json.dumps(document).encode()))
+
+
+def test_fields_are_slots_and_unmapped_fields_extra():
+    record = parse({**DOCUMENT, "custom": [1]})
+    assert not hasattr(record, "__dict__")
+    assert record.added == 3 and record["model"] == "gpt-4o"
+    assert record.extra == {"custom": [1]}
+    assert record.to_dict() == {**DOCUMENT, "custom": [1]}
+    assert "custom" in record and "version" not in record
+    assert record.get("version", 1) == 1
+
+
+def test_values_are_coerced_like_elasticsearch():
+    record = parse({**DOCUMENT, "added": "12", "removed": 2.0, "sessionId": 7})
+    assert (record.added, record.removed, record.sessionId) == (12, 2, "7")
+    assert json.loads(encode(record)) == {**DOCUMENT, "added": 12, "removed": 2, "sessionId": "7"}
+
+
+def test_interned_fields_share_strings():
+    first, second = parse(DOCUMENT), parse(DOCUMENT)
+    assert first.model is second.model
+
+
+@pytest.mark.parametrize("document", [
+    [1, 2],
+    {**DOCUMENT, "added": "many"},
+    {**DOCUMENT, "added": 1.5},
+    {**DOCUMENT, "model": {"name": "gpt"}},
+    {**DOCUMENT, "timestamp": "yesterday"},
+    {**DOCUMENT, "timestamp": "2026-02-30T00:00:00Z"},
+    {**DOCUMENT, "timestamp": True},
+    {**DOCUMENT, "a": 1, "b": 2, "c": 3},
+])
+def test_invalid_documents_are_rejected(document):
+    with pytest.raises(InvalidRecord):
+        LineChangeRecord.from_document(document)
+
+
+def test_date_values():
+    for value in ("2026-10-18T08:00:00.000Z", "2026-10-18T08:00:00+08:00", "2026-10-18", "2026-10-18T08:00", "1792281600000", 1792281600000):
+        assert date_value("timestamp", value) == value
+    for value in ("now", "", "18/10/2026", "2026-10-18 08:00:00", "2026-10-18T25:00:00Z", 1.5):
+        with pytest.raises(InvalidRecord):
+            date_value("timestamp", value)
+
+
+def test_client_bytes_are_reused_until_released():
+    raw = json.dumps(DOCUMENT, separators=(",", ":")).encode()
+    record = LineChangeRecord.from_document(loads_document(raw))
+    record["id"] = "abc"
+    assert encode(record) == b'{"id":"abc",' + raw[1:]
+    assert encode(record) is encode(record)
+
+    record.release()
+    assert record._encoded is None
+    record["last_updated_at"] = "2026-10-18T08:00:01+08:00"
+    assert json.loads(encode(record)) == {**DOCUMENT, "id": "abc", "last_updated_at": "2026-10-18T08:00:01+08:00"}
+
+
+def test_update_and_setdefault():
+    record = parse(DOCUMENT)
+    record.update({"added": 5}, custom="x")
+    assert record.setdefault("removed", 9) == 1
+    assert record.setdefault("id", "new") == "new"
+    assert json.loads(encode(record)) == {**DOCUMENT, "added": 5, "custom": "x", "id": "new"}
@@ -0,0 +1,91 @@
+import os
+import time
+from datetime import datetime, timedelta
+from utils.archive_utils import read_segment
+from utils.retention_utils import DAY_SECONDS, RetentionJob
+
+
+def write(path, content=b"{}\n", age=0):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def names(directory):
+    return sorted(os.path.relpath(os.path.join(root, name), directory)
+                  for root, _, files in os.walk(directory) for name in files)
+
+
+def test_expire_files_only_removes_old_matching_files(tmp_path):
+    directory = str(tmp_path)
+    old = 10 * DAY_SECONDS
+    write(os.path.join(directory, "old.log"), age=old)
+    write(os.path.join(directory, "2026-10", "old.log.gz"), age=old)
+    write(os.path.join(directory, "recent.log"), age=DAY_SECONDS)
+    write(os.path.join(directory, "notes.txt"), age=old)
+    job = RetentionJob(lambda: None)
+
+    job._expire_files(directory, ("*.log", "*.log.gz"), 5 * DAY_SECONDS, recursive=True)
+    assert names(directory) == ["notes.txt", "recent.log"]
+    # 清空的日期目录一并删除
+    assert not os.path.exists(os.path.join(directory, "2026-10"))
+    assert job.stats()["deleted"]["files"] == 2
+
+
+def test_expire_files_does_not_descend_into_archive_subdirectories(tmp_path):
+    directory = str(tmp_path)
+    write(os.path.join(directory, "old.json"), age=10 * DAY_SECONDS)
+    write(os.path.join(directory, "nested", "old.json"), age=10 * DAY_SECONDS)
+    RetentionJob(lambda: None)._expire_files(directory, ("*.json",), DAY_SECONDS, recursive=False)
+    assert names(directory) == [os.path.join("nested", "old.json")]
+
+
+def test_compress_logs_skips_today(tmp_path):
+    directory = str(tmp_path)
+    today = datetime.now().strftime("%Y-%m-%d")
+    yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+    earlier = (datetime.now() - timedelta(days=2)).strftime("%Y-%m-%d")
+    write(os.path.join(directory, f"{today}.log"))
+    write(os.path.join(directory, f"{yesterday}.worker0.log"))
+    write(os.path.join(directory, "2026-01", f"{earlier}.log"), age=2 * DAY_SECONDS)
+    write(os.path.join(directory, "app.log"))
+    job = RetentionJob(lambda: None)
+
+    job._compress_logs(directory, 1)
+    assert names(directory) == sorted([f"{today}.log", f"{yesterday}.worker0.log", os.path.join("2026-01", f"{earlier}.log.gz"), "app.log"])
+    # 压缩后的文件保留原文件的修改时间
+    compressed = os.path.join(directory, "2026-01", f"{earlier}.log.gz")
+    assert os.path.getmtime(compressed) < time.time() - DAY_SECONDS
+
+    # compress_after_days 为 0 时压缩今天之前的所有日志，今天的日志仍在写入
+    job._compress_logs(directory, 0)
+    assert names(directory) == sorted([f"{today}.log", f"{yesterday}.worker0.log.gz", os.path.join("2026-01", f"{earlier}.log.gz"), "app.log"])
+    assert job.stats()["compacted_files"] == 2
+
+
+def test_compact_archive_skips_segments_still_open(tmp_path):
+    directory = str(tmp_path)
+    now = datetime.now()
+    # 打开时间早于 compress_after + segment_max_age 的段才会压缩
+    old = (now - timedelta(days=1, hours=2)).strftime("%Y%m%d_%H%M%S_%f") + ".ndjson"
+    recent = (now - timedelta(days=1, minutes=30)).strftime("%Y%m%d_%H%M%S_%f") + ".ndjson"
+    write(os.path.join(directory, old), b'{"id":1}\n', age=DAY_SECONDS + 3600)
+    write(os.path.join(directory, recent), b'{"id":2}\n', age=DAY_SECONDS + 3600)
+    job = RetentionJob(lambda: None, segment_max_age=3600)
+
+    job._compact_archive(directory, DAY_SECONDS)
+    compressed = old[:-len(".ndjson")] + ".ndjson.gz"
+    assert names(directory) == sorted([compressed, recent])
+    assert list(read_segment(os.path.join(directory, compressed))) == [{"id": 1}]
+
+
+def test_directory_policy_without_max_age_keeps_files(tmp_path):
+    directory = str(tmp_path)
+    write(os.path.join(directory, "2020-01-01.log.gz"), age=3650 * DAY_SECONDS)
+    job = RetentionJob(lambda: None, directory_policies={directory: {"kind": "logs", "compress_after_days": 1, "max_age_days": None}})
+    job.run_once()
+    assert names(directory) == ["2020-01-01.log.gz"]
+    assert job.stats()["failures"] == 0
@@ -0,0 +1,84 @@
+import threading
+from utils.rollup_utils import RollupAggregator, rollup_id
+
+
+def record(timestamp, added=1, removed=0, user="alice"):
+    return {"timestamp": timestamp, "added": added, "removed": removed,
+            "githubUsername": user, "model": "m", "language": "python", "gitUrl": "g"}
+
+
+def rows(aggregator):
+    return {(interval, timestamp, key[0]): counters for (interval, timestamp, key), counters in aggregator.pending.items()}
+
+
+def test_records_are_bucketed_by_interval():
+    aggregator = RollupAggregator(lambda documents: [], "rollup", intervals=("minute", "hour"))
+    aggregator.add(record("2026-10-18T08:00:59+08:00", added=2, removed=1))
+    aggregator.add(record("2026-10-18T08:01:00+08:00", added="3"))
+    # epoch 毫秒与 ISO 8601 落入同一时间桶
+    aggregator.add(record(1792281630000))
+    assert rows(aggregator) == {
+        ("minute", "2026-10-18T00:00:00Z", "alice"): [3, 1, 2],
+        ("minute", "2026-10-18T00:01:00Z", "alice"): [3, 0, 1],
+        ("hour", "2026-10-18T00:00:00Z", "alice"): [6, 1, 3],
+    }
+
+
+def test_invalid_timestamps_are_counted_and_skipped():
+    aggregator = RollupAggregator(lambda documents: [], "rollup")
+    assert aggregator.add(record("yesterday")) is False
+    assert aggregator.add(record(None)) is False
+    assert aggregator.add(record("2026-10-18T08:00:00Z")) is True
+    stats = aggregator.stats()
+    assert (stats["records"], stats["invalid_timestamps"], stats["pending_rows"]) == (1, 2, 1)
+
+
+def test_failed_rows_are_merged_into_pending_rows():
+    failures = []
+
+    def flush(documents):
+        return [(index_name, doc["id"], "rejected") for index_name, doc in documents if failures]
+
+    aggregator = RollupAggregator(flush, "rollup")
+    aggregator.add(record("2026-10-18T08:00:00Z", added=2))
+    failures.append(True)
+    assert aggregator._flush()
+    assert rows(aggregator) == {("hour", "2026-10-18T08:00:00Z", "alice"): [2, 0, 1]}
+
+    # 重新排队的行与之后新增的同一行累加
+    aggregator.add(record("2026-10-18T08:30:00Z", added=5, removed=1))
+    assert rows(aggregator) == {("hour", "2026-10-18T08:00:00Z", "alice"): [7, 1, 2]}
+
+    def unavailable(documents):
+        raise ConnectionError("down")
+    aggregator.flush = unavailable
+    assert aggregator._flush() is False
+    assert aggregator.failed_flushes == 1
+    assert rows(aggregator) == {("hour", "2026-10-18T08:00:00Z", "alice"): [7, 1, 2]}
+
+    flushed = []
+    aggregator.flush = lambda documents: flushed.extend(documents) or []
+    assert aggregator._flush()
+    (index_name, doc), = flushed
+    assert index_name == "rollup"
+    assert doc["id"] == rollup_id("hour", "2026-10-18T08:00:00Z", ("alice", "m", "python", "g"))
+    assert (doc["added"], doc["removed"], doc["count"], doc["interval"]) == (7, 1, 2, "hour")
+    assert aggregator.pending == {}
+
+
+def test_flush_starts_when_max_pending_rows_is_reached():
+    flushed = threading.Event()
+    documents = []
+
+    def flush(batch):
+        documents.extend(batch)
+        flushed.set()
+        return []
+
+    aggregator = RollupAggregator(flush, "rollup", flush_interval=60, max_keys=2).start()
+    aggregator.add(record("2026-10-18T08:00:00Z", user="alice"))
+    assert not flushed.wait(0.1)
+    aggregator.add(record("2026-10-18T08:00:00Z", user="bob"))
+    assert flushed.wait(5)
+    assert sorted(doc["githubUsername"] for _, doc in documents) == ["alice", "bob"]
+    aggregator.close()
@@ -0,0 +1,93 @@
+import json
+import os
+from utils.archive_utils import segment_name, segment_sequence
+from utils.spool_utils import DurableSpool, segment_order
+
+
+def docs(entries):
+    return [(index_name, dict(doc)) for index_name, doc in entries]
+
+
+def test_segment_sequence():
+    assert segment_sequence(segment_name(7)) == 7
+    assert segment_sequence(segment_name(7, "_w0")) == 7
+    assert segment_sequence("20261018_120000_000000.ndjson") is None
+    assert segment_order("20991231_235959_999999.ndjson") < segment_order(segment_name(0))
+    assert segment_order(segment_name(9)) < segment_order(segment_name(10))
+
+
+def test_read_commit_and_reopen(tmp_path):
+    spool = DurableSpool(str(tmp_path))
+    spool.append("linechanges", {"id": "a", "last_updated_at": "t"})
+    spool.append("linechanges", {"id": "b", "last_updated_at": "t"})
+
+    entries, position = spool.read_batch(1)
+    assert docs(entries) == [("linechanges", {"id": "a", "last_updated_at": "t"})]
+    spool.commit(position)
+    spool.close()
+
+    # 重新打开后从检查点继续，已提交的记录不会再读到
+    spool = DurableSpool(str(tmp_path))
+    entries, position = spool.read_batch(10)
+    assert docs(entries) == [("linechanges", {"id": "b", "last_updated_at": "t"})]
+    spool.close()
+
+
+def test_uncommitted_batch_is_read_again(tmp_path):
+    spool = DurableSpool(str(tmp_path))
+    spool.append("linechanges", {"id": "a", "last_updated_at": "t"})
+    spool.read_batch(10)
+    spool.close()
+
+    spool = DurableSpool(str(tmp_path))
+    entries, _ = spool.read_batch(10)
+    assert [doc["id"] for _, doc in entries] == ["a"]
+    spool.close()
+
+
+def test_segments_are_read_in_sequence_and_deleted_after_commit(tmp_path):
+    spool = DurableSpool(str(tmp_path), max_bytes=1)
+    for doc_id in "abc":
+        spool.append("linechanges", {"id": doc_id, "last_updated_at": "t"})
+    assert spool.segments() == [segment_name(0), segment_name(1), segment_name(2)]
+
+    entries, position = spool.read_batch(10)
+    assert [doc["id"] for _, doc in entries] == ["a", "b", "c"]
+    spool.commit(position)
+    assert spool.segments() == [segment_name(2)]
+    assert spool.pending_bytes() == 0
+    spool.close()
+
+
+def test_sequence_is_not_reused_after_segments_are_deleted(tmp_path):
+    spool = DurableSpool(str(tmp_path), max_bytes=1)
+    spool.append("linechanges", {"id": "a", "last_updated_at": "t"})
+    spool.append("linechanges", {"id": "b", "last_updated_at": "t"})
+    spool.close()
+    spool = DurableSpool(str(tmp_path))
+    spool.commit(spool.read_batch(10)[1])
+    spool.close()
+    # 所有段都已消费，新段的编号必须排在检查点之后
+    for name in spool.segments():
+        os.remove(os.path.join(str(tmp_path), name))
+    with open(os.path.join(str(tmp_path), "checkpoint.json")) as f:
+        assert json.load(f)["sequence"] == 1
+
+    spool = DurableSpool(str(tmp_path))
+    spool.append("linechanges", {"id": "c", "last_updated_at": "t"})
+    assert spool.writer.segment_name == segment_name(2)
+    entries, _ = spool.read_batch(10)
+    assert [doc["id"] for _, doc in entries] == ["c"]
+    spool.close()
+
+
+def test_legacy_segments_are_replayed_first(tmp_path):
+    with open(os.path.join(str(tmp_path), "20991231_235959_999999.ndjson"), "wb") as f:
+        f.write(b'{"index":"linechanges","doc":{"id":"old"}}\n')
+    spool = DurableSpool(str(tmp_path))
+    spool.append("linechanges", {"id": "new", "last_updated_at": "t"})
+    entries, position = spool.read_batch(10)
+    assert [doc["id"] for _, doc in entries] == ["old", "new"]
+    spool.commit(position)
+    assert spool.segments() == [segment_name(0)]
+    spool.close()
@@ -0,0 +1,90 @@
+import pytest
+from utils.sqlite_utils import SQLiteManager
+from utils.storage_utils import StorageBackend
+
+PROPERTIES = {"id": "keyword", "model": "keyword", "added": "integer", "timestamp": "date"}
+
+
+@pytest.fixture
+def manager(tmp_path):
+    manager = SQLiteManager(str(tmp_path / "metrics.db"))
+    manager._create_table("linechanges", PROPERTIES)
+    manager.bulk_write([
+        ("linechanges", {"id": "a", "model": "gpt-4o", "added": 1, "timestamp": "2026-10-01T00:00:00Z", "extra": {"x": 1}}),
+        ("linechanges", {"id": "b", "model": "gpt-4o", "added": 5, "timestamp": "2026-10-10T00:00:00Z"}),
+        ("linechanges", {"id": "c", "model": "claude", "added": 9, "timestamp": "2026-10-18T00:00:00Z"}),
+    ])
+    yield manager
+    manager.close()
+
+
+def ids(manager, query):
+    return sorted(doc["id"] for doc in manager.query_from_es("linechanges", query))
+
+
+def test_storage_backend_is_abstract():
+    with pytest.raises(TypeError):
+        StorageBackend()
+
+
+def test_translate_term_terms_range_and_exists(manager):
+    columns = manager.tables["linechanges"]
+    assert manager._translate({"term": {"model.keyword": "claude"}}, columns) == ('"model" = ?', ["claude"])
+    assert manager._translate({"range": {"timestamp": {"gte": 0, "lt": "1970-01-01T00:00:01Z"}}}, columns) == (
+        '"timestamp" >= ? AND "timestamp" < ?', [0, 1000])
+
+    assert ids(manager, {"term": {"model": "gpt-4o"}}) == ["a", "b"]
+    assert ids(manager, {"term": {"model": {"value": "claude"}}}) == ["c"]
+    assert ids(manager, {"terms": {"id": ["a", "c", "z"]}}) == ["a", "c"]
+    assert ids(manager, {"terms": {"id": []}}) == []
+    assert ids(manager, {"range": {"added": {"gt": 1, "lte": 9}}}) == ["b", "c"]
+    assert ids(manager, {"range": {"timestamp": {"gte": "2026-10-10T08:00:00+08:00"}}}) == ["b", "c"]
+    # 映射之外的字段从 _source 中读取
+    assert ids(manager, {"exists": {"field": "extra"}}) == ["a"]
+    assert ids(manager, {"term": {"extra.x": 1}}) == ["a"]
+    with pytest.raises(ValueError):
+        manager._translate({"range": {"timestamp": {"gte": "not a date"}}}, columns)
+    assert manager.query_from_es("linechanges", {"fuzzy": {"model": "gpt"}}) == []
+
+
+def test_translate_bool(manager):
+    assert ids(manager, {"bool": {"filter": [{"term": {"model": "gpt-4o"}}], "must_not": {"term": {"id": "a"}}}}) == ["b"]
+    assert ids(manager, {"bool": {"should": [{"term": {"id": "a"}}, {"term": {"id": "c"}}]}}) == ["a", "c"]
+    # 存在 filter 时 should 不参与过滤
+    assert ids(manager, {"bool": {"filter": {"term": {"model": "gpt-4o"}}, "should": {"term": {"id": "a"}}}}) == ["a", "b"]
+    assert manager.count_documents("linechanges", {"bool": {"must": [{"exists": {"field": "model"}}, {"range": {"added": {"gte": 5}}}]}}) == 2
+
+
+def test_upsert_merges_fields_like_partial_update(manager):
+    manager.write_to_es("linechanges", {"id": "a", "added": 2, "extra": {"y": 2}, "note": None})
+    doc, = manager.query_from_es("linechanges", {"ids": {"values": ["a"]}})
+    # 新文档中的字段覆盖原值（包括 null），未出现的字段保留，嵌套对象按 json_patch 合并
+    assert (doc["model"], doc["added"], doc["extra"]) == ("gpt-4o", 2, {"x": 1, "y": 2})
+    assert "note" not in doc
+    assert ids(manager, {"range": {"added": {"lte": 2}}}) == ["a"]
+
+
+def test_bulk_increment_adds_counters(manager):
+    manager._create_table("rollup", {"id": "keyword", "added": "integer", "count": "integer"})
+    row = {"id": "r", "githubUsername": "alice", "added": 3, "count": 1}
+    assert manager.bulk_increment([("rollup", dict(row)), ("rollup", dict(row))], ["added", "count"]) == []
+    doc, = manager.query_from_es("rollup", {"match_all": {}})
+    assert (doc["added"], doc["count"], doc["githubUsername"]) == (6, 2, "alice")
+    assert manager.aggregate("rollup", None, sum_fields=["added", "count"]) == [{"key": None, "doc_count": 1, "added": 6, "count": 2}]
+
+
+def test_scan_pages_through_a_snapshot(manager):
+    pages = manager.scan("linechanges", {"match_all": {}}, fields=["id"], sort=[{"added": "desc"}], page_size=2)
+    assert next(pages) == {"id": "c"}
+    # 扫描开始后的写入不可见
+    manager.write_to_es("linechanges", {"id": "d", "added": 0})
+    assert list(pages) == [{"id": "b"}, {"id": "a"}]
+    with pytest.raises(ValueError):
+        list(manager.scan("missing"))
+
+
+def test_expire_documents_in_batches(manager):
+    before = 1792281600000  # 2026-10-18T00:00:00Z
+    assert manager.expire_documents("linechanges", "timestamp", before, batch_size=1) == {"dropped_indexes": [], "deleted": 2}
+    assert ids(manager, {"match_all": {}}) == ["c"]
+    assert manager.expire_documents("missing", "timestamp", before) == {"dropped_indexes": [], "deleted": 0}
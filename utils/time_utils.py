@@ -1,6 +1,12 @@
 from datetime import datetime
 import time
 from datetime import datetime, timezone, timedelta
+import re
+from utils.token_utils import parse_iso_epoch
+
+# Elasticsearch 日期运算的子集: now、now-1h、now+30m ...
+DATE_MATH = re.compile(r"^now(?:([+-])(\d+)([smhdw]))?$")
+UNIT_SECONDS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
 
 def current_time(format="%Y-%m-%d %H:%M:%S.%f", cutoff=3):
     ret = datetime.now().strftime(format)
@@ -66,6 +72,39 @@ def days_between_someday_and_today(someday):
     return (today - someday_date).days
 
 
+def to_epoch_millis(value):
+    """
+    Converts a date value the way Elasticsearch accepts it: numbers are epoch
+    milliseconds, strings are ISO 8601 (naive means UTC) or "now", "now-1h", ...
+    Returns None for values that cannot be parsed.
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    if not isinstance(value, str):
+        return None
+    match = DATE_MATH.match(value)
+    if match:
+        sign, amount, unit = match.groups()
+        seconds = time.time()
+        if sign:
+            delta = int(amount) * UNIT_SECONDS[unit]
+            seconds += delta if sign == '+' else -delta
+        return int(seconds * 1000)
+    try:
+        return int(parse_iso_epoch(value) * 1000)
+    except ValueError:
+        pass
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp() * 1000)
+
+
 if __name__ == "__main__":
     # 获取当前时间和时区信息
     now = datetime.now()
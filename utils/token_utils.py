@@ -0,0 +1,176 @@
+import hmac
+import threading
+import time
+from datetime import datetime
+
+DAYS_IN_MONTH = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+
+def compute_minute_token(timestamp: str) -> str:
+    """
+    根据timestamp计算token，严格按照提供的TypeScript算法实现
+    function computeMinuteToken(timestamp: string): string {
+      try {
+        const minutePart = timestamp.slice(0, 16);
+        let hash = 0x811c9dc5;
+        for (let i = 0; i < minutePart.length; i++) {
+          hash ^= minutePart.charCodeAt(i);
+          hash = (hash >>> 0) * 0x01000193;
+        }
+        return (hash >>> 0).toString(16).padStart(8, '0');
+      } catch {
+        return '00000000';
+      }
+    }
+    """
+    try:
+        # Extract the first 16 chars of ISO string: 'YYYY-MM-DDTHH:MM'
+        minute_part = timestamp[:16]
+
+        # FNV-1a 32-bit hash with JavaScript-like floating point behavior
+        hash_val = 0x811c9dc5
+        for char in minute_part:
+            hash_val = hash_val ^ ord(char)
+            # 模拟JavaScript的浮点乘法然后截断
+            # JavaScript中所有数字运算都是浮点数，可能导致精度差异
+            hash_val = int((float(hash_val) * 0x01000193)) & 0xFFFFFFFF
+
+        # JavaScript: (hash >>> 0).toString(16).padStart(8, '0')
+        return format(hash_val, '08x')
+    except Exception:
+        return '00000000'
+
+
+def days_from_civil(year, month, day):
+    """Days since 1970-01-01 for a proleptic Gregorian date (H. Hinnant's algorithm)."""
+    year -= month <= 2
+    era = year // 400
+    yoe = year - era * 400
+    doy = (153 * (month + (-3 if month > 2 else 9)) + 2) // 5 + day - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+
+def parse_iso_epoch(timestamp: str) -> float:
+    """
+    Parse an ISO 8601 timestamp with a UTC offset into epoch seconds.
+
+    The extension sends 'YYYY-MM-DDTHH:MM:SS(.fff)Z'; that shape (and '+HH:MM'
+    offsets) is parsed with plain slicing and integer math. Anything else falls
+    back to datetime.fromisoformat. Raises ValueError for invalid or naive timestamps.
+    """
+    n = len(timestamp)
+    if n >= 20 and timestamp[4] == '-' and timestamp[7] == '-' and timestamp[10] == 'T' and timestamp[13] == ':' and timestamp[16] == ':':
+        pos = 19
+        fraction = 0.0
+        if timestamp[pos] == '.':
+            end = pos + 1
+            while end < n and timestamp[end].isdigit():
+                end += 1
+            fraction = float(timestamp[pos:end])
+            pos = end
+        tz = timestamp[pos:]
+        if tz == 'Z':
+            offset = 0
+        elif len(tz) == 6 and tz[0] in '+-' and tz[3] == ':' and tz[1:3].isdigit() and tz[4:].isdigit():
+            offset = (int(tz[1:3]) * 60 + int(tz[4:])) * 60
+            if tz[0] == '-':
+                offset = -offset
+        else:
+            offset = None
+
+        fields = (timestamp[0:4], timestamp[5:7], timestamp[8:10], timestamp[11:13], timestamp[14:16], timestamp[17:19])
+        if offset is not None and all(field.isdigit() for field in fields):
+            year, month, day, hour, minute, second = map(int, fields)
+            if 1 <= month <= 12 and hour < 24 and minute < 60 and second < 60:
+                leap = month == 2 and year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+                if 1 <= day <= DAYS_IN_MONTH[month - 1] + leap:
+                    return days_from_civil(year, month, day) * 86400 + hour * 3600 + minute * 60 + second + fraction - offset
+
+    provided_time = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+    if provided_time.tzinfo is None:
+        raise ValueError(f"timestamp without UTC offset: {timestamp}")
+    return provided_time.timestamp()
+
+
+class MinuteTokenTable:
+    """
+    Rolling table of the tokens that can currently be valid.
+
+    Only the minute buckets within window_minutes of now can pass the time window
+    check, so their tokens are precomputed and kept in a dict keyed by the
+    'YYYY-MM-DDTHH:MM' prefix the token is derived from, together with the epoch
+    of that minute; for timestamps in the extension's 'Z' format the window check
+    is then the minute epoch plus the seconds field. The table is rebuilt
+    (reusing the tokens still in range) when the current minute changes; readers
+    always see a complete dict because the new one is swapped in by assignment.
+    Minute prefixes outside the table (e.g. timestamps with a non-UTC offset)
+    fall back to parse_iso_epoch and to computing the hash.
+    """
+
+    def __init__(self, window_minutes, clock=time.time):
+        self.window_minutes = window_minutes
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.minute = None
+        self.tokens = {}
+        self.misses = 0
+
+    def expected_token(self, timestamp: str) -> str:
+        """Token the client should have sent for this timestamp."""
+        if not isinstance(timestamp, str):
+            return compute_minute_token(timestamp)
+        minute_part = timestamp[:16]
+        entry = self.current_tokens().get(minute_part)
+        if entry is None:
+            self.misses += 1
+            return compute_minute_token(minute_part)
+        return entry[0]
+
+    def current_tokens(self):
+        """{'YYYY-MM-DDTHH:MM': (token, minute epoch seconds)} for the minutes around now."""
+        minute = int(self.clock() // 60)
+        if minute != self.minute:
+            self._refresh(minute)
+        return self.tokens
+
+    def in_window(self, timestamp: str):
+        """
+        Returns:
+            tuple: (ok, minutes) where minutes is the absolute distance from now.
+        """
+        epoch = self._table_epoch(timestamp)
+        if epoch is None:
+            epoch = parse_iso_epoch(timestamp)
+        minutes = abs(self.clock() - epoch) / 60
+        return minutes <= self.window_minutes, minutes
+
+    def validate(self, timestamp: str, provided_token) -> bool:
+        """Constant-time comparison of provided_token with the expected token (no window check)."""
+        if not isinstance(provided_token, str):
+            return False
+        return hmac.compare_digest(self.expected_token(timestamp).encode(), provided_token.encode('utf-8', 'surrogatepass'))
+
+    def _table_epoch(self, timestamp):
+        # 'YYYY-MM-DDTHH:MM:SS(.fff)Z' 且分钟在表内：分钟起点加上秒数，无需解析日期
+        entry = self.current_tokens().get(timestamp[:16])
+        if entry is None or timestamp[-1:] != 'Z' or timestamp[16:17] != ':':
+            return None
+        seconds = timestamp[17:-1]
+        if not (seconds[:2].isdigit() and seconds[0] < '6' and (len(seconds) == 2 or (seconds[2] == '.' and seconds[3:].isdigit()))):
+            return None
+        return entry[1] + float(seconds)
+
+    def _refresh(self, minute):
+        with self.lock:
+            if minute == self.minute:
+                return
+            # 多留一分钟余量：窗口检查按秒计算，边界分钟可能部分落在窗口内
+            span = int(self.window_minutes) + 1
+            previous = self.tokens
+            tokens = {}
+            for m in range(minute - span, minute + span + 1):
+                key = time.strftime('%Y-%m-%dT%H:%M', time.gmtime(m * 60))
+                tokens[key] = previous.get(key) or (compute_minute_token(key), m * 60)
+            self.tokens = tokens
+            self.minute = minute